@@ -0,0 +1,189 @@
+import threading
+from typing import Dict, Set, List, Tuple, Iterable, Optional
+import database
+import layout
+
+
+def parse_changes(message: str) -> Tuple[int, Optional[List[Tuple[bool, int, int]]]]:
+    """
+    :param message: change message published by the graph scripts, see graphmanager.GRAPH_LUA.
+     example: "12 +0>5 -0>3" is graph version 12, edge 0->5 added and edge 0->3 removed.
+     "13 *" is graph version 13, any edge may have changed.
+    :return: (version, changes). each change is (added, parent, child). changes is None if any edge may have
+     changed.
+    """
+    parts = message.split(" ")
+    changes = []
+    for c in parts[1:]:
+        if c == "*":
+            return int(parts[0]), None
+        parent, child = c[1:].split(">")
+        changes.append((c[0] == "+", int(parent), int(child)))
+    return int(parts[0]), changes
+
+
+class AdjacencyCache:
+    """
+    in-memory copy of the graph's edges, so that neighbor and edge queries don't need a round trip to redis.
+
+    nodes are cached as a whole: a cached node has both its parents and children sets. changes from this and
+    other processes come in through the graph change channel and are applied in graph version order, so the
+    cache doesn't go stale when other processes write to the graph.
+    """
+
+    def __init__(self, db: database.Database, key_layout: layout.Layout, version_key: str, channel: str):
+        """
+        :param db: database to load edges from
+        :param key_layout: key layout of the graph
+        :param version_key: key of the graph version counter. it's incremented by every published change.
+        :param channel: channel that the graph changes are published to
+        """
+        self.db = db
+        self.layout = key_layout
+        self.version_key = version_key
+        self.channel = channel
+
+        self.parents: Dict[int, Set[int]] = {}
+        self.children: Dict[int, Set[int]] = {}
+        self.version: Optional[int] = None  # graph version that the cached data is up to date with
+        self.lock = threading.RLock()
+        self.subscribed = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0  # number of times the whole cache was cleared
+
+    def start(self, preload: Iterable = ()):
+        """
+        starts listening for changes and loads the starting data. changes published while loading are applied
+        once loading is done.
+
+        :param preload: ids of nodes to load now instead of on first use
+        """
+        threading.Thread(target=self._listen, daemon=True, name="AdjacencyCacheListener").start()
+        self.subscribed.wait()
+
+        with self.lock:
+            # anything published after this version is still waiting in the subscription, and will be
+            # applied after this. replaying changes is fine since adding or removing an edge twice does nothing.
+            self.version = int(self.db.get_val(self.version_key) or 0)
+            for chunk in database.chunked(preload, self.db.chunk_size):
+                self._store(chunk, self._fetch(chunk), self.version)
+
+    def _listen(self):
+        for msg in self.db.subscribe(self.channel):
+            if msg is None:
+                if self.subscribed.is_set():
+                    self.clear()  # reconnected, so some changes may have been missed
+                self.subscribed.set()
+            else:
+                self.apply(msg, from_channel=True)
+
+    def _fetch(self, ids: List) -> List[Tuple[Set[int], Set[int]]]:
+        keys = []
+        for _id in ids:
+            keys += [self.layout.parents_key(_id), self.layout.children_key(_id)]
+        sets = self.db.get_from_sets(keys)
+        return [(sets[2 * i], sets[2 * i + 1]) for i in range(len(ids))]
+
+    def _store(self, ids: List, sets: List[Tuple[Set[int], Set[int]]], version: int):
+        # only store data that's at least as new as the cache. data that's newer gets the changes in between
+        # replayed onto it, which doesn't change it.
+        if version < self.version:
+            return
+        for _id, (parents, children) in zip(ids, sets):
+            self.parents[int(_id)] = parents
+            self.children[int(_id)] = children
+
+    def get_many(self, ids: List) -> List[Tuple[Set[int], Set[int]]]:
+        """
+        :param ids: node ids
+        :return: list of (parents, children) sets for each id, in the same order as ids. the sets are copies.
+        """
+        ret: List = [None] * len(ids)
+        missing = []
+        with self.lock:
+            for i in range(len(ids)):
+                _id = int(ids[i])
+                if _id in self.children:
+                    ret[i] = (set(self.parents[_id]), set(self.children[_id]))
+                else:
+                    missing.append(i)
+            self.hits += len(ids) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # version is read before the sets, so the sets are at least as new as it
+            version = int(self.db.get_val(self.version_key) or 0)
+            missing_ids = [ids[i] for i in missing]
+            sets = self._fetch(missing_ids)
+            with self.lock:
+                self._store(missing_ids, sets, version)
+            for i, s in zip(missing, sets):
+                ret[i] = (set(s[0]), set(s[1]))
+        return ret
+
+    def apply(self, message: str, from_channel: bool = False):
+        """
+        applies a change message to the cache.
+
+        :param message: change message, see parse_changes
+        :param from_channel: True if the message came from the change channel. False if it's the return value of
+         this process's own script call, which can arrive before earlier messages from other processes.
+        """
+        version, changes = parse_changes(message)
+        with self.lock:
+            if self.version is None or version <= self.version:
+                return  # already applied, or start() hasn't read the starting version yet
+            if changes is None:
+                self._clear(version)
+                return
+            if version > self.version + 1:
+                if from_channel:
+                    # a message was missed, so nothing can be trusted
+                    self._clear(version)
+                else:
+                    # earlier changes are still on the way. these nodes have to be loaded again
+                    for _, parent, child in changes:
+                        self.children.pop(parent, None)
+                        self.parents.pop(parent, None)
+                        self.children.pop(child, None)
+                        self.parents.pop(child, None)
+                return
+
+            for added, parent, child in changes:
+                if parent in self.children:
+                    if added:
+                        self.children[parent].add(child)
+                    else:
+                        self.children[parent].discard(child)
+                if child in self.parents:
+                    if added:
+                        self.parents[child].add(parent)
+                    else:
+                        self.parents[child].discard(parent)
+            self.version = version
+
+    def clear(self):
+        """
+        removes everything from the cache. nodes will be loaded from redis again when they're used.
+        """
+        with self.lock:
+            self._clear(int(self.db.get_val(self.version_key) or 0))
+
+    def _clear(self, version: int):
+        self.parents = {}
+        self.children = {}
+        self.version = version
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: dict with number of cached nodes, cache hits, cache misses, invalidations, and graph version
+        """
+        with self.lock:
+            return {"nodes": len(self.children),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "version": self.version}
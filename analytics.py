@@ -0,0 +1,201 @@
+"""
+whole-graph analytics: in-degree, out-degree, bfs subtree sizes, pagerank, and depth from the root.
+
+the edges are copied out of redis into numpy arrays once, everything is computed on those, and the results are
+stored back in redis sorted sets, see RANK_KEYS. GraphManager.important_ids reads the pagerank one.
+
+run it with main.py --analytics. numpy is needed for this module only.
+"""
+import time
+from typing import Dict, Any, Tuple
+import database
+from graphmanager import GraphManager
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # only needed for analytics
+
+# name of each result -> key of the sorted set it's stored in. members are node ids, scores are the results. the keys
+# are also hardcoded in GRAPH_LUA's remove_node
+RANK_KEYS = {
+    "in_degree": "rank:in_degree",
+    "out_degree": "rank:out_degree",
+    "subtree_size": "rank:subtree_size",
+    "pagerank": GraphManager.IMPORTANCE_KEY,
+    "depth": "rank:depth",
+}
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-6  # stop when the total change of all ranks in one iteration is less than this
+PAGERANK_MAX_ITERATIONS = 100
+
+
+class GraphSnapshot:
+    """
+    every edge of the graph at one point in time, as numpy arrays. edges go from parent to child. the root's edge
+    to itself is left out.
+    """
+
+    def __init__(self, n: int, src, dst, ids=None):
+        """
+        :param n: number of node ids
+        :param src: parent of each edge
+        :param dst: child of each edge
+        :param ids: ids of the nodes that exist. if None, every id below n
+        """
+        self.n = n
+        self.src = src
+        self.dst = dst
+        self.ids = ids if ids is not None else np.arange(n, dtype=np.int64)
+
+    @staticmethod
+    def load(g: GraphManager) -> "GraphSnapshot":
+        """
+        reads every node's children, one pipelined round trip per chunk of nodes. removed nodes are skipped, see
+        GraphManager.live_ids
+
+        :param g: graph to read
+        """
+        src = []
+        dst = []
+        ids = []
+        n = g.next_id
+        for chunk in database.chunked(g.live_ids(0, n), g.db.chunk_size):
+            ids += chunk
+            keys = [g.layout.children_key(_id) for _id in chunk]
+            for _id, children in zip(chunk, g.db.get_from_sets(keys)):
+                src += [_id] * len(children)
+                dst += children
+        src = np.array(src, dtype=np.int64)
+        dst = np.array(dst, dtype=np.int64)
+        keep = (src != dst) & (dst < n)  # self-links, and edges to nodes added while reading
+        return GraphSnapshot(n, src[keep], dst[keep], np.array(ids, dtype=np.int64))
+
+    def csr(self, reverse: bool = False) -> Tuple[Any, Any]:
+        """
+        :param reverse: if True, lists each node's parents instead of its children
+        :return: (indptr, indices). the neighbors of node i are indices[indptr[i]:indptr[i + 1]]
+        """
+        src, dst = (self.dst, self.src) if reverse else (self.src, self.dst)
+        order = np.argsort(src, kind="stable")
+        indptr = np.zeros(self.n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=self.n), out=indptr[1:])
+        return indptr, dst[order]
+
+
+def neighbors(indptr, indices, frontier) -> Tuple[Any, Any]:
+    """
+    :return: (neighbors, sources). every neighbor of every node in frontier, and which frontier node it came from
+    """
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = int(counts.sum())
+    # position of each neighbor in indices: its node's start, plus its index among that node's neighbors
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+    return indices[offsets], np.repeat(frontier, counts)
+
+
+def bfs_tree(snapshot: GraphSnapshot, root: int = 0) -> Tuple[Any, Any, list]:
+    """
+    breadth-first search down from the root, one whole level at a time
+
+    :return: (depth, parent, levels). depth is -1 for nodes that can't be reached. parent is each node's parent in
+     the bfs tree, the first one that reached it, or -1. levels is a list of arrays of the nodes at each depth.
+    """
+    indptr, indices = snapshot.csr()
+    depth = np.full(snapshot.n, -1, dtype=np.int64)
+    parent = np.full(snapshot.n, -1, dtype=np.int64)
+    depth[root] = 0
+    frontier = np.array([root], dtype=np.int64)
+    levels = []
+    while len(frontier):
+        levels.append(frontier)
+        found, sources = neighbors(indptr, indices, frontier)
+        new = depth[found] == -1
+        found, sources = found[new], sources[new]
+        found, first = np.unique(found, return_index=True)
+        depth[found] = len(levels)
+        parent[found] = sources[first]
+        frontier = found
+    return depth, parent, levels
+
+
+def subtree_sizes(snapshot: GraphSnapshot, parent, levels: list):
+    """
+    number of nodes below each node in the bfs tree. a node with several parents is only counted under the one that
+    reached it first, so this is a lower bound of the node's number of descendants, exact for trees. the exact
+    number would need every node's whole set of descendants, which doesn't fit in memory for big graphs. use
+    GraphManager.descendants_json for one node's descendants.
+    """
+    counts = np.zeros(snapshot.n, dtype=np.int64)
+    reached = np.concatenate(levels)
+    counts[reached] = 1
+    # deepest level first, so every node's count is complete before it's added to its parent's
+    for level in reversed(levels[1:]):
+        np.add.at(counts, parent[level], counts[level])
+    return counts - (counts > 0)  # not counting the node itself
+
+
+def pagerank(snapshot: GraphSnapshot, damping: float = PAGERANK_DAMPING, tolerance: float = PAGERANK_TOLERANCE,
+             max_iterations: int = PAGERANK_MAX_ITERATIONS):
+    """
+    pagerank with rank flowing from children to parents, so nodes that many other nodes build on rank highest.
+    rank of nodes without parents is spread over every node.
+
+    :return: rank of each node. the ranks add up to 1.
+    """
+    n = snapshot.n
+    # reversed edges: from child to parent
+    src, dst = snapshot.dst, snapshot.src
+    out_degree = np.bincount(src, minlength=n).astype(np.float64)
+    dangling = out_degree == 0
+    inverse_degree = np.divide(1.0, out_degree, out=np.zeros(n), where=~dangling)
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iterations):
+        flow = np.bincount(dst, weights=(rank * inverse_degree)[src], minlength=n)
+        new_rank = (1 - damping) / n + damping * (flow + rank[dangling].sum() / n)
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tolerance:
+            break
+    return rank
+
+
+def compute(g: GraphManager) -> Dict[str, Any]:
+    """
+    computes every result in RANK_KEYS and stores them in redis
+
+    :param g: graph to compute the results for
+    :return: dict with "nodes", "edges", and the seconds spent on "load_seconds", "compute_seconds", and
+     "store_seconds"
+    """
+    if np is None:
+        raise ImportError("analytics.compute: numpy is needed for graph analytics. install it with pip.")
+
+    start = time.monotonic()
+    snapshot = GraphSnapshot.load(g)
+    loaded = time.monotonic()
+
+    depth, parent, levels = bfs_tree(snapshot)
+    results = {
+        "in_degree": np.bincount(snapshot.dst, minlength=snapshot.n),
+        "out_degree": np.bincount(snapshot.src, minlength=snapshot.n),
+        "subtree_size": subtree_sizes(snapshot, parent, levels),
+        "pagerank": pagerank(snapshot),
+        "depth": depth,
+    }
+    computed = time.monotonic()
+
+    # every node gets every result. a cycle can be cut off from the root, like after linking a node to its own
+    # parent, so nodes that the bfs didn't reach have depth -1
+    ids = snapshot.ids
+    for name, values in results.items():
+        g.db.replace_sorted_set(RANK_KEYS[name], zip(ids.tolist(), values[ids].tolist()))
+    g.db.delete("rank:descendants")  # older name of rank:subtree_size
+    # changes GraphManager.version_tag, so cached get-graph?order=importance responses aren't used anymore
+    g.db.incr(GraphManager.INDEX_GENERATION_KEY)
+    stored = time.monotonic()
+
+    return {"nodes": len(ids), "edges": len(snapshot.src), "load_seconds": loaded - start,
+            "compute_seconds": computed - loaded, "store_seconds": stored - computed}
@@ -1,9 +1,20 @@
+import gzip
 import json
+import random
+import selectors
+import socket
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-from typing import Tuple, Callable, Dict, List, Any, Union
+from typing import Tuple, Callable, Dict, List, Any, Union, Iterable
 from graphmanager import GraphManager
+import metrics
+from staticfiles import StaticFiles, etag_matches, accepted_encodings
 
 
 def apply_func(keys: List[str], defaults: List[Union[str, int]], func: Callable,
@@ -37,6 +48,226 @@ def apply_func(keys: List[str], defaults: List[Union[str, int]], func: Callable,
     return func(*app)
 
 
+REQUEST_SECONDS = metrics.REGISTRY.histogram("http_request_seconds", "time to handle api requests")
+RESPONSE_BYTES = metrics.REGISTRY.histogram("http_response_bytes", "size of api response bodies",
+                                            metrics.Histogram.SIZE_BUCKETS)
+
+
+class StreamResponse:
+    """
+    api functions can return this instead of a string to send the response in pieces while it's being generated.
+    it's sent with chunked transfer encoding, so the response's size doesn't need to be known in advance.
+    """
+
+    def __init__(self, chunks: Iterable[Union[str, bytes]], mime_type: str):
+        """
+        :param chunks: pieces of the response body. str is encoded as utf-8. empty pieces are skipped.
+        :param mime_type: value of the Content-type header. overrides the one in the api's handler dict.
+        """
+        self.chunks = chunks
+        self.mime_type = mime_type
+
+
+class RequestBody:
+    """
+    a request's body. it's read from the connection as it's used instead of all at once, so big uploads don't have
+    to fit in memory. api functions get it as args["body"][0].
+    """
+
+    def __init__(self, rfile, length: int):
+        """
+        :param rfile: the connection's input stream
+        :param length: value of the Content-length header
+        """
+        self.rfile = rfile
+        self.remaining = length  # bytes that haven't been read yet
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        :param size: max number of bytes to read. -1 reads everything that's left.
+        :return: up to size bytes. empty when the whole body has been read.
+        """
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b""
+        self.remaining = self.remaining - len(data) if len(data) == size else 0  # short read: connection closed
+        return data
+
+    def __iter__(self) -> Iterable[bytes]:
+        """
+        :return: generator of the body's lines, including their line endings
+        """
+        while self.remaining > 0:
+            line = self.rfile.readline(self.remaining)
+            if not line:
+                self.remaining = 0  # connection closed
+                return
+            self.remaining -= len(line)
+            yield line
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that handles requests on a fixed-size pool of worker threads, so one slow request doesn't
+    block every other client. unlike ThreadingHTTPServer, the number of threads can't grow without limit.
+
+    a worker handles one request at a time, not a whole connection. kept-alive connections wait for their next
+    request in a selector on one extra thread, and only go back to the pool once the request arrives, so idle
+    clients don't hold on to workers. the handler has to handle one request per call, see GraphAPIHandler.handle.
+    """
+    IDLE_CHECK_SECONDS = 1.0  # how often idle connections are checked for their timeout
+    CLOSE_SECONDS = 5.0  # max seconds server_close waits for requests that are being handled
+
+    def __init__(self, server_address, handler_class, workers: int):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="GraphAPIWorker")
+        # set by server_close. long requests like GraphAPI.watch_changes check it so they end
+        self.closing = threading.Event()
+        self.running = 0  # number of tasks submitted to the executor that haven't finished
+        self.running_changed = threading.Condition()
+        self.idle_lock = threading.Lock()
+        self.parked = []  # handlers of connections waiting to be added to the selector
+        # written to when a connection is parked, so the selector thread adds it without waiting for a timeout
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.idle_thread = threading.Thread(target=self._watch_idle, daemon=True, name="GraphAPIIdleConnections")
+        self.idle_thread.start()
+
+    def _submit(self, func, *args):
+        def run():
+            try:
+                func(*args)
+            finally:
+                with self.running_changed:
+                    self.running -= 1
+                    self.running_changed.notify_all()
+        with self.running_changed:
+            self.running += 1
+        try:
+            self.executor.submit(run)
+        except RuntimeError:
+            with self.running_changed:
+                self.running -= 1
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self._submit(self.process_request_thread, request, client_address)
+        except RuntimeError:
+            self.shutdown_request(request)  # the executor was shut down
+
+    def finish_request(self, request, client_address):
+        # returns the handler, which socketserver's doesn't, so its connection can be kept
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def process_request_thread(self, request, client_address):
+        # same as socketserver.ThreadingMixIn.process_request_thread, but the connection is kept if it's alive
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        if self._request_done(handler):
+            self._continue_connection(handler)
+
+    def _continue_connection(self, handler):
+        # handles requests on a kept-alive connection until it's closed or no more requests have arrived
+        while True:
+            try:
+                handler.handle()
+            except Exception:
+                self.handle_error(handler.request, handler.client_address)
+                handler.close_connection = True
+            if not self._request_done(handler):
+                return
+
+    def _request_done(self, handler) -> bool:
+        """
+        closes the connection, or parks it until its next request arrives
+
+        :return: True if the next request has already arrived, and should be handled now instead
+        """
+        if handler.close_connection or self.closing.is_set():
+            self._close_connection(handler)
+            return False
+        # requests that have already arrived can be in rfile's buffer, where the selector can't see them
+        sock = handler.connection
+        try:
+            sock.setblocking(False)
+            buffered = handler.rfile.peek(1)
+            sock.settimeout(handler.timeout)
+        except OSError:
+            self._close_connection(handler)
+            return False
+        if buffered:
+            return True
+        with self.idle_lock:
+            self.parked.append(handler)
+        self.wakeup_sender.send(b"\0")
+        return False
+
+    def _close_connection(self, handler):
+        handler.close_connection = True
+        try:
+            handler.finish()
+        except OSError:
+            pass  # the client is already gone
+        self.shutdown_request(handler.request)
+
+    def _watch_idle(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+        idle: OrderedDict = OrderedDict()  # handler -> time it was parked, oldest first
+        while not self.closing.is_set():
+            for key, _ in selector.select(PooledHTTPServer.IDLE_CHECK_SECONDS):
+                if key.data is None:
+                    self.wakeup_receiver.recv(4096)
+                    continue
+                selector.unregister(key.fileobj)
+                del idle[key.data]
+                try:
+                    self._submit(self._continue_connection, key.data)
+                except RuntimeError:
+                    self._close_connection(key.data)  # the executor was shut down
+            with self.idle_lock:
+                parked, self.parked = self.parked, []
+            now = time.monotonic()
+            for handler in parked:
+                selector.register(handler.connection, selectors.EVENT_READ, handler)
+                idle[handler] = now
+            while idle:
+                handler, since = next(iter(idle.items()))
+                if now - since < handler.timeout:
+                    break
+                selector.unregister(handler.connection)
+                del idle[handler]
+                self._close_connection(handler)
+        for handler in idle:
+            self._close_connection(handler)
+        with self.idle_lock:
+            parked, self.parked = self.parked, []
+        for handler in parked:
+            self._close_connection(handler)
+        selector.close()
+
+    def server_close(self):
+        """
+        stops accepting connections, closes idle ones, and waits up to CLOSE_SECONDS for requests that are being
+        handled. requests that haven't started are dropped. call shutdown first if serve_forever is running.
+        """
+        self.closing.set()
+        super().server_close()
+        self.wakeup_sender.send(b"\0")
+        self.idle_thread.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.running_changed:
+            if not self.running_changed.wait_for(lambda: self.running <= 0, PooledHTTPServer.CLOSE_SECONDS):
+                print(f"PooledHTTPServer.server_close(): {self.running} requests didn't finish in "
+                      f"{PooledHTTPServer.CLOSE_SECONDS} seconds.")
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+
 class GraphAPI:
     """
     api will have to update title/content, add, delete, link, unlink
@@ -53,8 +284,35 @@ unlink will just need id
     something to get a list of all title attributes and/or a search function
     """
 
-    def __init__(self, g: GraphManager):
+    WORKERS = 8  # number of requests handled at the same time
+    WATCHERS = 4  # number of watch-changes streams open at the same time, on top of WORKERS
+    WATCH_SECONDS = 300  # watch-changes streams end after this long. EventSource clients reconnect by themselves
+
+    def __init__(self, g: GraphManager, host: str = "localhost", port: int = 8080, workers: int = WORKERS,
+                 static_reload: bool = False, slow_request_seconds: float = None, slow_request_sample: float = 1.0,
+                 watchers: int = WATCHERS):
+        """
+        :param g: graph to serve
+        :param host: address to listen on
+        :param port: port to listen on. 0 picks any free port.
+        :param workers: max number of requests handled at once. idle keep-alive connections don't hold on to a
+         worker, see PooledHTTPServer. g's Database should have at least workers + watchers redis connections in its
+         pool, plus the ones used by background threads, see main.py's --redis-pool-size.
+        :param static_reload: if True, web app files are loaded again when they change. see StaticFiles
+        :param slow_request_seconds: requests that take at least this long are logged with a breakdown of where the
+         time went. None to not log them.
+        :param slow_request_sample: fraction of slow requests to log
+        :param watchers: max number of watch-changes streams. each one holds a worker thread and a redis connection
+         while it's open, so the server has this many threads more than workers.
+        """
         self.g: GraphManager = g
+        self.static = StaticFiles(reload=static_reload)
+        self.slow_request_seconds = slow_request_seconds
+        self.slow_request_sample = slow_request_sample
+        # every watch-changes stream holds on to a thread and a redis connection. they get their own threads, so
+        # open streams never leave fewer than workers threads for other requests
+        self.watchers = threading.BoundedSemaphore(max(1, watchers))
+        metrics.REGISTRY.add_collector(lambda: metrics.flatten("graph", self.g.stats()))
 
         # todo: make everything return a json of the relevant nodes. make a convenient function for
         # converting nodes to json
@@ -63,14 +321,31 @@ unlink will just need id
             "get-node": (self.get_node, "text/json"),
             "get-graph": (self.get_graph, "text/json"),
             "get-neighbors": (self.get_neighbors, "text/json"),
+            "get-subgraph": (self.get_subgraph, "text/json"),
+            "get-ancestors": (self.get_ancestors, "text/json"),
+            "get-descendants": (self.get_descendants, "text/json"),
+            "get-path": (self.get_path, "text/json"),
+            "get-changes": (self.get_changes, "text/json"),
+            "watch-changes": (self.watch_changes, "text/event-stream"),
             "search": (self.search, "text/json"),
+            "suggest": (self.suggest, "text/json"),
+            "get-stats": (self.get_stats, "text/json"),
+            "metrics": (self.get_metrics, "text/plain; version=0.0.4"),
+            "export": (self.export, "application/x-ndjson"),
         }
 
         self.post_handlers: Dict[str, Tuple[Callable[[Dict[str, List[str]]], Any], str]] = {
             "add": (self.add, "text/json"),
             "link": (self.link, "text/text"),
+            "import": (self.import_graph, "text/json"),
+            "batch": (self.batch, "text/json"),
         }
 
+        # get requests whose responses only change when GraphManager.version_tag changes. these get etags.
+        self.versioned_handlers = {"get-all-node-ids", "get-node", "get-graph", "get-neighbors", "get-subgraph",
+                                   "get-ancestors", "get-descendants", "get-path", "get-changes",
+                                   "search", "export"}
+
         self.patch_handlers: Dict[str, Tuple[Callable[[Dict[str, List[str]]], Any], str]] = {
             "update": (self.update, "text/json"),
         }
@@ -81,12 +356,20 @@ unlink will just need id
         }
 
         GraphAPIHandler.api = self
-        self.server = HTTPServer(("localhost", 8080), GraphAPIHandler)
+        self.server = PooledHTTPServer((host, port), GraphAPIHandler, workers + max(1, watchers))
 
     def start_server(self):
         print(f"Concept Graph server listening on port {self.server.server_port}.")
         self.server.serve_forever()
 
+    def stop_server(self):
+        """
+        stops start_server, ends watch-changes streams, and waits a bounded time for other requests, see
+        PooledHTTPServer.server_close
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
     def add(self, args: Dict[str, List[str]]):
         """
         adds a node to the graph.
@@ -100,16 +383,38 @@ unlink will just need id
 
     def delete(self, args):
         """
-        not implemented. see GraphManager.remove_node
-
-        :param args:
-        :return:
+        :param args: has key "id". see GraphManager.remove_node
+        :return: "True" if the node was removed, "False" if it doesn't exist
         """
         keys = ["id"]
         defaults = [0]
         func = self.g.remove_node
         return apply_func(keys, defaults, func, args)
 
+    MAX_BATCH_BODY_SIZE = 16 * 1024 * 1024  # max bytes in a batch request's body
+
+    def batch(self, args):
+        """
+        does a list of add, update, link, and unlink operations at once, see GraphManager.batch
+
+        :param args: the body is a json list of operations, at most MAX_BATCH_BODY_SIZE bytes
+        :return: json with "results", each operation's result, and "nodes", data objects of the added and updated
+         nodes. "nodes" isn't cut to MAX_LIST_SIZE like other node lists, it's bounded by GraphManager.MAX_BATCH_SIZE
+         since each operation adds or updates at most one node.
+        """
+        def run_batch(body):
+            # checked before reading, so a huge body isn't read and parsed only to be refused
+            if body.remaining > GraphAPI.MAX_BATCH_BODY_SIZE:
+                raise ValueError(f"batch: body is larger than {GraphAPI.MAX_BATCH_BODY_SIZE} bytes.")
+            results = self.g.batch(json.loads(body.read()))
+            ids = list(dict.fromkeys(r for r in results if r is not None))
+            return json.dumps({"results": results, "nodes": self.g.node_attrs(ids)})
+
+        keys = ["body"]
+        defaults = [None]
+        func = run_batch
+        return apply_func(keys, defaults, func, args)
+
     def update(self, args):
         """
         :param args: can have keys "id", "attr", and "val". "attr" can be "title", "content", "type", etc
@@ -122,11 +427,77 @@ unlink will just need id
         return apply_func(keys, defaults, func, args)
 
     def search(self, args):
-        keys = ["q"]
-        defaults = [""]
-        func = self.g.search
+        """
+        :param args: can have keys "q", "rows", "type", and "cursor". see GraphManager.search
+        :return: json of the search results
+        """
+        keys = ["q", "rows", "type", "cursor"]
+        defaults = ["", 10, "", ""]
+        func = lambda q, rows, _type, cursor: self.g.search(q, rows, _type or None, cursor or None)
+        return apply_func(keys, defaults, func, args)
+
+    def suggest(self, args):
+        """
+        :param args: can have keys "prefix" and "count". see GraphManager.suggest
+        :return: json list of matching nodes' ids and titles
+        """
+        keys = ["prefix", "count"]
+        defaults = ["", 10]
+        func = self.g.suggest
         return apply_func(keys, defaults, func, args)
 
+    def get_stats(self, args):
+        """
+        :return: json of cache and search index queue stats, see GraphManager.stats
+        """
+        keys = []
+        defaults = []
+        func = lambda: json.dumps(self.g.stats())
+        return apply_func(keys, defaults, func, args)
+
+    def export(self, args):
+        """
+        :return: StreamResponse of the whole graph, see GraphManager.export_ndjson
+        """
+        keys = []
+        defaults = []
+        func = lambda: StreamResponse(self.g.export_ndjson(), "application/x-ndjson")
+        return apply_func(keys, defaults, func, args)
+
+    def import_graph(self, args):
+        """
+        adds the graph in the request body to this graph, see GraphManager.import_ndjson
+
+        :param args: can have key "batch-size". the body is a file from export.
+        :return: json with "nodes", "edges", "first_id", and "seconds"
+        """
+        keys = ["body", "batch-size"]
+        defaults = [None, GraphManager.IMPORT_BATCH_SIZE]
+        func = lambda body, batch_size: json.dumps(self.g.import_ndjson(body, batch_size))
+        return apply_func(keys, defaults, func, args)
+
+    def get_metrics(self, args):
+        """
+        :return: request, database, redis and solr metrics in the prometheus text format, see metrics.Registry
+        """
+        keys = []
+        defaults = []
+        func = metrics.REGISTRY.render
+        return apply_func(keys, defaults, func, args)
+
+    def log_slow_request(self, method: str, path: str, status: int, seconds: float, stages: Dict[str, float]):
+        """
+        prints a request that took at least slow_request_seconds, with the time spent in each stage.
+        "python" is the handler's time that wasn't spent waiting for redis or solr.
+        """
+        if self.slow_request_seconds is None or seconds < self.slow_request_seconds \
+                or random.random() >= self.slow_request_sample:
+            return
+        stages = dict(stages)
+        stages["python"] = max(0.0, stages.get("handler", 0.0) - stages.get("redis", 0.0) - stages.get("solr", 0.0))
+        breakdown = ", ".join(f"{k} {1000 * v:.1f}ms" for k, v in sorted(stages.items()))
+        print(f"slow request: {method} {path} {status} {1000 * seconds:.1f}ms ({breakdown})")
+
     def link(self, args):
         keys = ["parent", "child", "two-way"]
         defaults = [0, 0, False]
@@ -141,10 +512,13 @@ unlink will just need id
         return apply_func(keys, defaults, func, args)
 
     def get_all_node_ids(self, args):
+        """
+        :return: json with "ranges", every node id as [start, stop) ranges, see GraphManager.live_id_ranges, and
+         "count", the number of nodes
+        """
         keys = []
         defaults = []
-        func = lambda: json.dumps(list(self.g.nodes))
-        # todo: replace this with a 2-number node id range
+        func = lambda: json.dumps({"ranges": self.g.live_id_ranges(), "count": self.g.node_count()})
         return apply_func(keys, defaults, func, args)
 
     def get_node(self, args):
@@ -154,18 +528,40 @@ unlink will just need id
         func = lambda _id: self.g.nodes_json([_id])
         return apply_func(keys, defaults, func, args)
 
+    MAX_PAGE_SIZE = 10000  # max "count" for get_graph
+
     def get_graph(self, args):
         """
-
-        :param args:
-        :return: string containing json of all graph data
+        :param args: can have keys "format", "start", "count", "ids", "induced", and "order".
+         format "ndjson" streams every node and edge, see GraphManager.graph_ndjson.
+         with a "count", returns one page of the graph starting at node "start", see GraphManager.graph_page.
+         otherwise returns json of the graph, truncated to GraphManager.MAX_LIST_SIZE. "ids" is a comma-separated
+         list of the nodes to include, default is all of them, or the most important ones if "order" is
+         "importance", see GraphManager.important_ids, or the most recently changed ones if it's "recent", see
+         GraphManager.recent_ids. "induced" is "true" to only include edges between
+         included nodes, see GraphManager.graph_json.
+        :return: string containing json of graph data, or a StreamResponse for "ndjson"
         """
 
-        def make_json_graph():
-            return self.g.graph_json(list(self.g.nodes))
+        def make_json_graph(_format, start, count, ids, induced, order):
+            if _format == "ndjson":
+                return StreamResponse(self.g.graph_ndjson(self.g.nodes), "application/x-ndjson")
+            if count > 0:
+                return self.g.graph_page(start, min(count, GraphAPI.MAX_PAGE_SIZE))
+            if ids:
+                ids = [int(i) for i in ids.split(",")]
+            elif order == "importance":
+                ids = self.g.important_ids()
+            elif order == "recent":
+                ids = self.g.recent_ids()
+            else:
+                # graph_json sends MAX_LIST_SIZE nodes and at most MAX_LIST_SIZE * 5 edges. every node has an edge to
+                # its parent, so the edges are all found within this many ids
+                ids = list(islice(self.g.nodes, GraphManager.MAX_LIST_SIZE * 5))
+            return self.g.graph_json(ids, induced)
 
-        keys = []
-        defaults = []
+        keys = ["format", "start", "count", "ids", "induced", "order"]
+        defaults = ["json", 0, 0, "", False, "id"]
         func = make_json_graph
         return apply_func(keys, defaults, func, args)
 
@@ -175,6 +571,78 @@ unlink will just need id
         func = self.g.neighbors_edges_json
         return apply_func(keys, defaults, func, args)
 
+    MAX_SUBGRAPH_DEPTH = 20  # max "depth" for get_subgraph
+
+    def get_subgraph(self, args):
+        """
+        :param args: can have keys "id", "depth", "direction", "limit", and "edge-limit".
+         see GraphManager.subgraph_json. "limit" and "edge-limit" are capped at GraphAPI.MAX_PAGE_SIZE.
+        :return: json of the nodes near "id" and the edges between them
+        """
+        def make_subgraph(_id, depth, direction, limit, edge_limit):
+            return self.g.subgraph_json(_id, min(depth, GraphAPI.MAX_SUBGRAPH_DEPTH), direction,
+                                        min(limit, GraphAPI.MAX_PAGE_SIZE), min(edge_limit, GraphAPI.MAX_PAGE_SIZE))
+
+        keys = ["id", "depth", "direction", "limit", "edge-limit"]
+        defaults = [0, 2, "both", GraphManager.MAX_LIST_SIZE, GraphManager.MAX_LIST_SIZE * 5]
+        func = make_subgraph
+        return apply_func(keys, defaults, func, args)
+
+    def get_ancestors(self, args):
+        """
+        :param args: can have keys "id", "depth", and "count". "depth" 0, the default, finds every ancestor. see
+         GraphManager.ancestors_json
+        :return: json of the nodes that "id" can be reached from
+        """
+        func = lambda _id, depth, count: self.g.ancestors_json(_id, min(depth, GraphAPI.MAX_SUBGRAPH_DEPTH) or None,
+                                                               count)
+        return apply_func(["id", "depth", "count"], [0, 0, GraphManager.MAX_LIST_SIZE], func, args)
+
+    def get_descendants(self, args):
+        """
+        :param args: same as get_ancestors. see GraphManager.descendants_json
+        :return: json of the nodes that can be reached from "id"
+        """
+        func = lambda _id, depth, count: self.g.descendants_json(_id, min(depth, GraphAPI.MAX_SUBGRAPH_DEPTH) or None,
+                                                                 count)
+        return apply_func(["id", "depth", "count"], [0, 0, GraphManager.MAX_LIST_SIZE], func, args)
+
+    def get_changes(self, args):
+        """
+        :param args: can have keys "since" and "count". see GraphManager.changes_json
+        :return: json of the changes after "since"
+        """
+        return apply_func(["since", "count"], ["0", GraphManager.MAX_CHANGES], self.g.changes_json, args)
+
+    def watch_changes(self, args):
+        """
+        server-sent events with the graph's changes as they happen. see GraphManager.watch_changes
+
+        :param args: can have key "since". EventSource clients send it as the Last-Event-ID header when they
+         reconnect.
+        :return: StreamResponse of events
+        """
+        def events(since):
+            if not self.watchers.acquire(blocking=False):
+                # too many streams are open. the client tries again after this many milliseconds
+                yield "retry: 10000\n\n"
+                return
+            try:
+                yield from self.g.watch_changes(since, GraphAPI.WATCH_SECONDS, stop=self.server.closing)
+            finally:
+                self.watchers.release()
+        return StreamResponse(events(args["since"][0] if "since" in args else None), "text/event-stream")
+
+    MAX_PATH_DEPTH = 50  # max "max-depth" for get_path
+
+    def get_path(self, args):
+        """
+        :param args: can have keys "from", "to", and "max-depth". see GraphManager.path_json
+        :return: json of a shortest path from "from" to "to"
+        """
+        func = lambda _from, to, max_depth: self.g.path_json(_from, to, min(max_depth, GraphAPI.MAX_PATH_DEPTH))
+        return apply_func(["from", "to", "max-depth"], [0, 0, 20], func, args)
+
 
 class GraphAPIHandler(BaseHTTPRequestHandler):
     # todo: is there a way to do this without a class variable?
@@ -182,33 +650,162 @@ class GraphAPIHandler(BaseHTTPRequestHandler):
     # but i need a specific instance of GraphAPI here
     api: GraphAPI = None
 
+    # HTTP/1.1 keeps connections open between requests, so every response needs a Content-length header
+    protocol_version = "HTTP/1.1"
+    timeout = 5  # seconds before an idle keep-alive connection is closed, and max seconds to wait for a read
+    # headers and body are separate writes. with nagle's algorithm, the body waits for the client's delayed ack
+    # of the headers, which adds ~40ms to every response on a kept-alive connection
+    disable_nagle_algorithm = True
+    COMPRESS_MIN_SIZE = 1024  # api responses at least this many bytes long are gzipped if the client accepts it
+    # unread request bodies up to this many bytes are read and thrown away so the connection can be kept alive.
+    # bigger ones close the connection instead
+    DRAIN_MAX_SIZE = 1024 * 1024
+
+    def send_body(self, code: int, mime_type: str, body: Union[str, bytes], headers: Dict[str, str] = None):
+        """
+        sends a complete response
+
+        :param code: HTTP status code
+        :param mime_type: value of the Content-type header
+        :param body: response body. str is encoded as utf-8.
+        :param headers: extra headers to send
+        """
+        if not isinstance(body, bytes):
+            body = bytes(str(body), "utf-8")
+        self.status = code
+        self.body_bytes = len(body)
+        self.send_response(code)
+        self.send_header("Content-type", mime_type)
+        self.send_header("Content-length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_modified(self, headers: Dict[str, str]):
+        """
+        sends a 304 response, which tells the client that its cached copy is still up to date
+
+        :param headers: headers to send, should include ETag
+        """
+        self.status = 304
+        self.send_response(304)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def send_compressed(self, code: int, mime_type: str, body: Union[str, bytes], headers: Dict[str, str] = None):
+        """
+        same as send_body, but gzips the body if it's big enough and the client accepts gzip
+        """
+        if not isinstance(body, bytes):
+            body = bytes(str(body), "utf-8")
+        headers = dict(headers or {})
+        headers["Vary"] = "Accept-Encoding"
+        if len(body) >= GraphAPIHandler.COMPRESS_MIN_SIZE \
+                and "gzip" in accepted_encodings(self.headers.get("Accept-Encoding")):
+            body = gzip.compress(body, 5)  # lower level than the default, since this is done for every response
+            headers["Content-Encoding"] = "gzip"
+        self.send_body(code, mime_type, body, headers)
+
+    def send_stream(self, code: int, res: StreamResponse, headers: Dict[str, str] = None):
+        """
+        sends a response with chunked transfer encoding. if generating a chunk raises an error, the connection is
+        closed without the final chunk, so the client can tell that the response is incomplete.
+
+        :param code: HTTP status code
+        :param res: response to send
+        :param headers: extra headers to send
+        """
+        self.status = code
+        self.send_response(code)
+        self.send_header("Content-type", res.mime_type)
+        self.send_header("Transfer-encoding", "chunked")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        try:
+            for chunk in res.chunks:
+                if not isinstance(chunk, bytes):
+                    chunk = bytes(chunk, "utf-8")
+                if chunk:  # an empty chunk would end the response
+                    self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+                    self.body_bytes += len(chunk)
+        except Exception as e:
+            self.close_connection = True
+            print(f"GraphAPIHandler.send_stream(): response to \"{self.path}\" failed: {str(e)}")
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
     def do_handle(self, handlers):
+        start = time.perf_counter()
+        metrics.start_stages()
+        self.status = 0
+        self.body_bytes = 0
+        endpoint = "other"  # unknown paths are grouped together, so they can't add an unlimited number of labels
+        body = RequestBody(self.rfile, 0)
         try:
+            if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+                self.close_connection = True
+                raise ValueError("request bodies must have a Content-length header")
+            body.remaining = int(self.headers.get("Content-Length") or 0)
             req = urlparse(self.path)
             cmd = req.path[1:]
             args = parse_qs(req.query)
+            args["body"] = [body]
+            if self.headers.get("Last-Event-ID"):
+                # sent by EventSource clients when they reconnect, see GraphAPI.watch_changes
+                args.setdefault("since", [self.headers["Last-Event-ID"]])
             func, mime_type = handlers.get(cmd, (None, "text/text"))
 
             if self.handle_file_request(cmd):
+                endpoint = "static"
                 return
 
             if func is None:
-                self.send_response(404)
-                self.send_header("Content-type", "text/text")
-                self.end_headers()
-                self.wfile.write(bytes(f"404 Error: Invalid API request: \"{self.path}\"", "utf-8"))
+                self.send_body(404, "text/text", f"404 Error: Invalid API request: \"{self.path}\"")
             else:
-                res = func(args)
-                self.send_response(200)
-                self.send_header("Content-type", mime_type)
-                self.end_headers()
-                self.wfile.write(bytes(str(res), "utf-8"))
+                endpoint = cmd
+                headers = {}
+                if handlers is self.api.get_handlers and cmd in self.api.versioned_handlers:
+                    # checked before doing anything else, so clients that poll cost almost nothing
+                    tag = f'"{self.api.g.version_tag()}"'
+                    headers["ETag"] = "W/" + tag
+                    headers["Cache-Control"] = "no-cache"
+                    if etag_matches(self.headers.get("If-None-Match"), {tag}):
+                        self.send_not_modified(headers)
+                        return
+
+                with metrics.stage("handler"):
+                    res = func(args)
+                with metrics.stage("write"):
+                    if isinstance(res, StreamResponse):
+                        self.send_stream(200, res, headers)
+                    else:
+                        self.send_compressed(200, mime_type, res, headers)
         except Exception as e:
-            self.send_response(400)
-            self.send_header("Content-type", "text/text")
-            self.end_headers()
-            self.wfile.write(bytes(f"An error occurred: {str(e)}", "utf-8"))
+            self.send_body(400, "text/text", f"An error occurred: {str(e)}")
             # todo: better error logging
+        finally:
+            if body.remaining > GraphAPIHandler.DRAIN_MAX_SIZE:
+                self.close_connection = True
+            else:
+                body.read()  # so the next request on this connection starts at the right place
+            seconds = time.perf_counter() - start
+            stages = metrics.stop_stages()
+            REQUEST_SECONDS.observe(seconds, endpoint=endpoint, method=self.command, status=self.status)
+            RESPONSE_BYTES.observe(self.body_bytes, endpoint=endpoint, method=self.command)
+            self.api.log_slow_request(self.command, self.path, self.status, seconds, stages)
+
+    def handle(self):
+        # one request per call, see PooledHTTPServer
+        self.close_connection = True
+        self.handle_one_request()
+
+    def finish(self):
+        # kept-alive connections stay open for their next request, see PooledHTTPServer._request_done
+        if self.close_connection:
+            super().finish()
 
     def log_message(self, format_string, *args):
         pass
@@ -235,24 +832,19 @@ class GraphAPIHandler(BaseHTTPRequestHandler):
         if file_name == "":
             file_name = "page.html"
 
-        if file_name not in ["page.html", "main.js", "httprequests.js", "styles.css", "favicon.ico"]:
+        file = self.api.static.get(file_name)
+        if file is None:
             return False
 
-        content_types = {
-            "html": "text/html",
-            "js": "text/javascript",
-            "css": "text/css",
-            "ico": "image/x-icon",
-        }
+        coding = file.choose(self.headers.get("Accept-Encoding"))
+        body, etag = file.variants[coding]
+        headers = {"ETag": etag, "Cache-Control": StaticFiles.CACHE_CONTROL, "Vary": "Accept-Encoding"}
 
-        self.send_response(200)
-        self.send_header("Content-type", content_types[file_name.split(".")[-1]])
-        self.end_headers()
+        if etag_matches(self.headers.get("If-None-Match"), file.etags):
+            self.send_not_modified(headers)
+            return True
 
-        if file_name == "favicon.ico":
-            with open(f"_web/{file_name}", "rb") as file:
-                self.wfile.write(file.read())
-        else:
-            with open(f"_web/{file_name}", "r") as file:
-                self.wfile.write(bytes(file.read(), "utf-8"))
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        self.send_body(200, file.content_type, body, headers)
         return True
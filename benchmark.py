@@ -0,0 +1,356 @@
+"""
+benchmark for the graph server. generates a synthetic concept graph, then times GraphManager functions and HTTP
+endpoints against it and prints a json report.
+
+runs against an in-process fake redis (needs the fakeredis package, and lupa for the lua scripts) or a real
+redis server, with LocalSolr standing in for solr. the real solr core is never touched.
+
+examples:
+    py benchmark.py --nodes 10000 --output before.json
+    py benchmark.py --nodes 10000 --compare before.json
+    py benchmark.py --redis-url redis://localhost:6379/15 --allow-flush --nodes 1000000 --degree powerlaw
+"""
+import argparse
+import http.client
+import json
+import random
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Any, Callable, Iterable, Tuple
+import redis
+import database
+import layout
+import metrics
+from api import GraphAPI
+from graphmanager import GraphManager, get_current_time
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None  # only needed without --redis-url
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on windows, so peak memory isn't reported there
+
+
+class LocalSolr:
+    """
+    in-memory stand-in for the parts of pysolr.Solr that Database uses. search matches documents whose title
+    contains every word of the query.
+    """
+
+    class Results:
+        def __init__(self, docs: List[Dict[str, Any]], hits: int):
+            self.docs = docs
+            self.hits = hits
+            self.nextCursorMark = None
+
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.words: Dict[str, set] = {}  # word -> ids of documents with that word in their title
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @staticmethod
+    def split_words(text: str) -> List[str]:
+        return [w for w in re.split(r"\W+", str(text).lower()) if w]
+
+    def add(self, docs, **kwargs):
+        with self.lock:
+            self.requests += 1
+            for doc in (docs if isinstance(docs, list) else [docs]):
+                _id = str(doc["id"])
+                old = self.docs.get(_id, {})
+                if any(isinstance(v, dict) for v in doc.values()):  # atomic update
+                    new = dict(old)
+                    new.update({k: v["set"] if isinstance(v, dict) else v for k, v in doc.items()})
+                else:
+                    new = dict(doc)
+                new["id"] = _id
+                for w in LocalSolr.split_words(old.get("title", "")):
+                    self.words[w].discard(_id)
+                for w in LocalSolr.split_words(new.get("title", "")):
+                    self.words.setdefault(w, set()).add(_id)
+                self.docs[_id] = new
+        return json.dumps({"responseHeader": {"status": 0}})
+
+    def delete(self, id=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+            for _id in (id if isinstance(id, list) else [id]):
+                doc = self.docs.pop(str(_id), {})
+                for w in LocalSolr.split_words(doc.get("title", "")):
+                    self.words[w].discard(str(_id))
+
+    def commit(self, **kwargs):
+        with self.lock:
+            self.requests += 1
+
+    def search(self, q, **kwargs):
+        """
+        supports rows, fq filters like type:"x", and cursorMark. results are sorted by id, and cursors are offsets.
+        """
+        with self.lock:
+            self.requests += 1
+            words = LocalSolr.split_words(q)
+            ids = set.intersection(*[self.words.get(w, set()) for w in words]) if words else set()
+            for fq in kwargs.get("fq", []):
+                field, value = fq.split(":", 1)
+                ids = {_id for _id in ids if str(self.docs[_id].get(field)) == json.loads(value)}
+            rows = int(kwargs.get("rows", 10))
+            cursor = kwargs.get("cursorMark")
+            offset = 0 if cursor in [None, "*"] else int(cursor)
+            page = sorted(ids, key=int)[offset:offset + rows]
+            docs = [{"id": _id, "title": [self.docs[_id]["title"]]} for _id in page]
+            res = LocalSolr.Results(docs, len(ids))
+            if cursor is not None:
+                res.nextCursorMark = str(offset + len(page)) if page else cursor
+            return res
+
+
+WORDS = ["algebra", "linear", "vector", "matrix", "group", "ring", "field", "limit", "series", "integral",
+         "derivative", "graph", "tree", "set", "function", "proof", "theorem", "space", "measure", "topology",
+         "number", "prime", "order", "map", "category", "logic", "model", "probability", "random", "variable"]
+
+
+def generate_graph(n: int, degree: str, mean_degree: float, seed: int) -> Iterable[Tuple[int, List[int]]]:
+    """
+    generates a random concept graph. node 0 is the root, and every other node has at least one parent with a lower
+    id, so the graph has no cycles other than the root's link to itself.
+
+    :param n: number of nodes, including the root
+    :param degree: "tree" for exactly one parent per node, "uniform" for a random number of parents with an
+     average of mean_degree, picked uniformly, or "powerlaw" for the same number of parents picked by preferential
+     attachment, so a few nodes get most of the children
+    :param mean_degree: average number of parents per node for "uniform" and "powerlaw"
+    :param seed: random seed
+    :return: generator of (id, parent ids) for ids 1 to n - 1
+    """
+    rng = random.Random(seed)
+    endpoints = [0]  # every node once, plus once per child it has, for preferential attachment
+    for _id in range(1, n):
+        count = 1 if degree == "tree" else max(1, min(_id, int(rng.expovariate(1 / mean_degree) + 0.5)))
+        parents = set()
+        while len(parents) < count:
+            if degree == "powerlaw":
+                parents.add(endpoints[rng.randrange(len(endpoints))])
+            else:
+                parents.add(rng.randrange(_id))
+        parents = sorted(parents)
+        if degree == "powerlaw":
+            endpoints += parents
+            endpoints.append(_id)
+        yield _id, parents
+
+
+def load_graph(g: GraphManager, graph: Iterable[Tuple[int, List[int]]], seed: int) -> Tuple[int, int]:
+    """
+    writes a generated graph straight into redis with Database.write_batch, which is much faster than add_node for
+    big graphs. writes the same keys as GRAPH_LUA's add_node and link_nodes, in g's key layout, and the live node
+    bitmap. nodes aren't added to the search index, use GraphManager.reindex for that.
+
+    :return: (number of nodes, number of edges), including the root
+    """
+    rng = random.Random(seed)
+    nodes = 1
+    edges = 0
+    now = g.layout.encode_time(get_current_time())
+    for chunk in database.chunked(graph, 5000):
+        hashes = []
+        set_members = []
+        children: Dict[int, List[int]] = {}
+        for _id, parents in chunk:
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))) + f" {_id}"
+            attrs = {"type": "concept", "title": title, "content": "", "tags": ""}
+            if g.layout.store_id:
+                attrs["id"] = _id
+            attrs["created"] = attrs["last_modified"] = now
+            hashes.append((_id, attrs))
+            set_members.append((g.layout.parents_key(_id), parents))
+            for p in parents:
+                children.setdefault(p, []).append(_id)
+            edges += len(parents)
+        set_members += [(g.layout.children_key(p), c) for p, c in children.items()]
+        g.db.write_batch(hashes, set_members, bits=[(GraphManager.LIVE_NODES_KEY, [_id for _id, _ in chunk])])
+        g.db.set_val("next_id", chunk[-1][0] + 1)
+        nodes += len(chunk)
+    return nodes, edges + 1  # the root's link to itself
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class Benchmark:
+    def __init__(self, g: GraphManager, counter: metrics.RedisCounter):
+        self.g = g
+        self.counter = counter
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def run(self, name: str, op: Callable[[int], Any], times: int):
+        """
+        calls op(i) for i from 0 to times - 1 and records its latency, throughput, and redis commands
+        """
+        latencies = []
+        commands, round_trips = self.counter.snapshot()
+        start = time.perf_counter()
+        for i in range(times):
+            t = time.perf_counter()
+            op(i)
+            latencies.append(time.perf_counter() - t)
+        total = time.perf_counter() - start
+        end_commands, end_round_trips = self.counter.snapshot()
+        self.results[name] = {
+            "ops": times,
+            "ops_per_second": times / total if total else 0.0,
+            "p50_ms": 1000 * percentile(latencies, 0.5),
+            "p99_ms": 1000 * percentile(latencies, 0.99),
+            "redis_commands_per_op": (end_commands - commands) / times,
+            "redis_round_trips_per_op": (end_round_trips - round_trips) / times,
+        }
+        print(f"{name}: {self.results[name]['ops_per_second']:.1f} ops/s, "
+              f"p50 {self.results[name]['p50_ms']:.2f} ms, p99 {self.results[name]['p99_ms']:.2f} ms",
+              file=sys.stderr)
+
+
+def http_get(conn: http.client.HTTPConnection, path: str) -> bytes:
+    conn.request("GET", path)
+    res = conn.getresponse()
+    body = res.read()
+    if res.status != 200:
+        raise RuntimeError(f"GET {path} returned {res.status}: {body[:200]}")
+    return body
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    :return: descriptions of the operations that got slower than threshold allows, e.g. 0.2 for 20% slower
+    """
+    ret = []
+    for name, res in current["operations"].items():
+        old = baseline["operations"].get(name)
+        if old is None:
+            continue
+        if res["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            ret.append(f"{name}: p50 {old['p50_ms']:.2f} ms -> {res['p50_ms']:.2f} ms")
+        if res["redis_commands_per_op"] > old["redis_commands_per_op"] * (1 + threshold):
+            ret.append(f"{name}: redis commands per op {old['redis_commands_per_op']:.1f} -> "
+                       f"{res['redis_commands_per_op']:.1f}")
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description="concept-graph benchmark")
+    parser.add_argument("--nodes", type=int, default=10000, help="number of nodes in the generated graph")
+    parser.add_argument("--degree", choices=["tree", "uniform", "powerlaw"], default="uniform",
+                        help="how parents are picked, see generate_graph")
+    parser.add_argument("--mean-degree", type=float, default=2.0, help="average number of parents per node")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ops", type=int, default=200, help="number of times each operation is timed")
+    parser.add_argument("--redis-url", help="redis server to use instead of an in-process fake redis")
+    parser.add_argument("--allow-flush", action="store_true",
+                        help="allow deleting everything in the --redis-url database before starting")
+    parser.add_argument("--adjacency-cache", action="store_true", help="run with GraphManager's adjacency cache")
+    parser.add_argument("--layout", choices=list(layout.LAYOUTS), default=layout.DEFAULT,
+                        help="redis key layout of the generated graph, see layout.Layout")
+    parser.add_argument("--no-http", action="store_true", help="skip the http endpoint benchmarks")
+    parser.add_argument("--output", help="file to write the json report to. default is stdout")
+    parser.add_argument("--compare", help="earlier json report to compare with. exits with status 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="how much slower an operation can get before --compare reports it, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    if args.redis_url:
+        if not args.allow_flush:
+            parser.error("--redis-url needs --allow-flush, since the benchmark deletes everything in that database")
+        client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    elif fakeredis is not None:
+        client = fakeredis.FakeRedis(decode_responses=True)
+    else:
+        parser.error("install fakeredis (and lupa) or pass --redis-url")
+    client.flushdb()
+    solr = LocalSolr()
+    db = database.Database(client=client, solr=solr)
+    counter = db.redis_counter
+
+    start = time.perf_counter()
+    g = GraphManager(db, adjacency_cache=False, layout_name=args.layout)
+    nodes, edges = load_graph(g, generate_graph(args.nodes, args.degree, args.mean_degree, args.seed), args.seed)
+    load_seconds = time.perf_counter() - start
+    if args.adjacency_cache:
+        g = GraphManager(db, adjacency_cache=True)
+    print(f"generated {nodes} nodes and {edges} edges in {load_seconds:.1f} s", file=sys.stderr)
+
+    rng = random.Random(args.seed)
+    ids = [rng.randrange(nodes) for _ in range(args.ops)]
+    queries = [rng.choice(WORDS) for _ in range(args.ops)]
+    b = Benchmark(g, counter)
+
+    reindex_start = time.perf_counter()
+    commands, round_trips = counter.snapshot()
+    g.reindex(restart=True)
+    reindex_seconds = time.perf_counter() - reindex_start
+    end_commands, end_round_trips = counter.snapshot()
+    b.results["reindex"] = {"ops": nodes, "ops_per_second": nodes / reindex_seconds,
+                            "p50_ms": 1000 * reindex_seconds, "p99_ms": 1000 * reindex_seconds,
+                            "redis_commands_per_op": (end_commands - commands) / nodes,
+                            "redis_round_trips_per_op": (end_round_trips - round_trips) / nodes}
+
+    b.run("add_node", lambda i: g.add_node("concept", f"benchmark {i}", "", "", ids[i]), args.ops)
+    b.run("link_nodes", lambda i: g.link_nodes(ids[i], ids[-i - 1]), args.ops)
+    b.run("neighbors_edges_json", lambda i: g.neighbors_edges_json(ids[i]), args.ops)
+    b.run("subgraph_json", lambda i: g.subgraph_json(ids[i], 2), args.ops)
+    b.run("graph_json", lambda i: g.graph_json(list(g.nodes)), max(1, args.ops // 10))
+    b.run("graph_ndjson", lambda i: sum(len(c) for c in g.graph_ndjson(g.nodes)), 1)
+    db.flush_search_index(True)
+    b.run("search", lambda i: g.search(queries[i]), args.ops)
+
+    def search_all_pages(i):
+        cursor = "*"
+        while cursor is not None:
+            cursor = json.loads(g.search(queries[i], 100, None, cursor))["next"]
+    b.run("search all pages", search_all_pages, max(1, args.ops // 10))
+
+    if not args.no_http:
+        api = GraphAPI(g, port=0)
+        threading.Thread(target=api.server.serve_forever, daemon=True).start()
+        conn = http.client.HTTPConnection("localhost", api.server.server_port)
+        b.run("http get-node", lambda i: http_get(conn, f"/get-node?id={ids[i]}"), args.ops)
+        b.run("http get-neighbors", lambda i: http_get(conn, f"/get-neighbors?id={ids[i]}"), args.ops)
+        b.run("http get-graph", lambda i: http_get(conn, "/get-graph"), max(1, args.ops // 10))
+        b.run("http get-graph ndjson", lambda i: http_get(conn, "/get-graph?format=ndjson"), 1)
+        b.run("http search", lambda i: http_get(conn, f"/search?q={queries[i]}"), args.ops)
+        conn.close()
+        api.server.shutdown()
+
+    report = {
+        "config": vars(args),
+        "graph": {"nodes": nodes, "edges": edges, "load_seconds": load_seconds},
+        "operations": b.results,
+        "peak_rss_kb": None if resource is None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    db.close()
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(out)
+    else:
+        print(out)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for r in regressions:
+            print(f"regression: {r}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,277 @@
-import json
+import threading
+import time
 import redis
 import pysolr
-from typing import Dict, Any
+import metrics
+from itertools import islice
+from redis.client import NEVER_DECODE
+from typing import Dict, Any, Iterable, List, Set, Callable, Optional, Tuple
+
+
+def chunked(items: Iterable, size: int, first_size: int = None) -> Iterable[List]:
+    """
+    :param items: any iterable
+    :param size: max number of items per chunk
+    :param first_size: if given, the first chunk has up to this many items, and each chunk after it twice as many
+     as the one before, up to size. for callers that usually stop early, so they don't read a whole chunk they
+     don't need.
+    :return: generator of lists with up to size items each, in the same order as items
+    """
+    it = iter(items)
+    n = min(first_size, size) if first_size else size
+    while True:
+        chunk = list(islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+        n = min(n * 2, size)
+
+
+# BYTE_BITS[b] lists the set bits of byte b, in redis bitmap order: bit 0 is the byte's highest bit
+BYTE_BITS = [tuple(i for i in range(8) if b & (128 >> i)) for b in range(256)]
+
+
+def bit_offsets(data: bytes, first_bit: int = 0) -> Iterable[int]:
+    """
+    :param data: part of a redis bitmap
+    :param first_bit: offset of data's first bit in the bitmap
+    :return: generator of the offsets of data's set bits, in increasing order
+    """
+    for i, b in enumerate(data):
+        if b == 255:
+            yield from range(first_bit + i * 8, first_bit + i * 8 + 8)
+        elif b:
+            base = first_bit + i * 8
+            for bit in BYTE_BITS[b]:
+                yield base + bit
+
+
+class SearchIndexQueue:
+    """
+    collects search index changes and sends them to solr in batches from a background thread, instead of sending
+    one request and a commit per change. changes to the same id that are waiting to be sent are merged into one.
+
+    changes become searchable within commit_within milliseconds after they're sent, so searches can lag behind
+    writes by up to max_delay seconds plus commit_within.
+    """
+    BATCH_SIZE = 500  # number of waiting changes that makes the queue send right away
+    MAX_DELAY = 1.0  # max seconds a change waits before it's sent
+    COMMIT_WITHIN = 1000  # milliseconds until sent changes are searchable. solr does a soft commit for this
+
+    def __init__(self, solr: pysolr.Solr, batch_size: int = BATCH_SIZE, max_delay: float = MAX_DELAY,
+                 commit_within: int = COMMIT_WITHIN):
+        """
+        :param solr: solr core to send changes to
+        :param batch_size: see SearchIndexQueue.BATCH_SIZE. also the max number of documents per solr request.
+        :param max_delay: see SearchIndexQueue.MAX_DELAY
+        :param commit_within: see SearchIndexQueue.COMMIT_WITHIN
+        """
+        self.solr = solr  # already instrumented by Database, see metrics.instrument_solr
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.commit_within = commit_within
+
+        # id -> (is_full_document, fields). full documents replace the whole solr document, others only set
+        # the listed fields. (True, None) deletes the document
+        self.pending: Dict[str, Tuple[bool, Dict[str, Any]]] = {}
+        self.oldest: Optional[float] = None  # time.monotonic() of when the oldest waiting change was queued
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()  # so that only one flush talks to solr at a time
+        self.closed = False
+
+        self.sent = 0  # number of documents sent to solr
+        self.batches = 0  # number of solr requests
+        self.failures = 0  # number of failed flushes
+        self.last_lag = 0.0  # how long the changes sent by the last flush waited, in seconds
+
+        self.on_flush: Optional[Callable[[], None]] = None  # called after changes have been sent to solr
+
+        self.thread = threading.Thread(target=self._run, daemon=True, name="SearchIndexQueue")
+        self.thread.start()
+
+    def add(self, doc: Dict[str, Any]):
+        """
+        :param doc: full search document, must have an "id" key. replaces any waiting changes to the same id.
+        """
+        self._queue(str(doc["id"]), (True, dict(doc)))
+
+    def update(self, _id, fields: Dict[str, Any]):
+        """
+        :param _id: id of the document to update
+        :param fields: fields to set. other fields of the document stay the same.
+        """
+        self._queue(str(_id), (False, dict(fields)))
+
+    def delete(self, _id):
+        """
+        :param _id: id of the document to delete. replaces any waiting changes to the same id.
+        """
+        self._queue(str(_id), (True, None))
+
+    @staticmethod
+    def _merge(old: Tuple[bool, Dict[str, Any]], new: Tuple[bool, Dict[str, Any]]) -> Tuple[bool, Dict[str, Any]]:
+        if new[0]:
+            return new  # a full document or a delete replaces everything before it
+        if old[1] is None:
+            return old  # the document is deleted, so there's nothing to update
+        return old[0], {**old[1], **new[1]}
+
+    def _queue(self, _id: str, change: Tuple[bool, Dict[str, Any]]):
+        with self.cond:
+            if _id in self.pending:
+                change = SearchIndexQueue._merge(self.pending[_id], change)
+            self.pending[_id] = change
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+                self.cond.notify()  # start the max_delay timer
+            elif len(self.pending) >= self.batch_size:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed:
+                    if len(self.pending) >= self.batch_size:
+                        break
+                    if self.oldest is None:
+                        self.cond.wait()
+                    else:
+                        wait = self.max_delay - (time.monotonic() - self.oldest)
+                        if wait <= 0:
+                            break
+                        self.cond.wait(wait)
+                if self.closed:
+                    return
+            self.flush()
+
+    def flush(self, commit: bool = False) -> bool:
+        """
+        sends all waiting changes to solr now. if sending fails, the changes are queued again.
+
+        :param commit: if True, also does a soft commit so the changes are searchable when this returns
+        :return: True if everything was sent, else False
+        """
+        with self.flush_lock:
+            with self.cond:
+                batch = self.pending
+                oldest = self.oldest
+                self.pending = {}
+                self.oldest = None
+            if not batch:
+                return True
+
+            docs = []
+            deletes = []
+            for _id, (full, fields) in batch.items():
+                if fields is None:
+                    deletes.append(_id)
+                elif full:
+                    docs.append(fields)
+                else:
+                    # https://solr.apache.org/guide/6_6/updating-parts-of-documents.html#UpdatingPartsofDocuments-Example
+                    doc = {k: {"set": v} for k, v in fields.items()}
+                    doc["id"] = _id
+                    docs.append(doc)
+
+            try:
+                for chunk in chunked(docs, self.batch_size):
+                    # pysolr raises an error if solr returns an error status
+                    self.solr.add(chunk, commit=False, commitWithin=self.commit_within)
+                    self.batches += 1
+                for chunk in chunked(deletes, self.batch_size):
+                    self.solr.delete(id=chunk, commit=False)
+                    self.batches += 1
+                # deletes can't have a commitWithin, so they're made searchable with a soft commit
+                if commit or deletes:
+                    self.solr.commit(softCommit=True)
+            except Exception as e:
+                print(f"SearchIndexQueue.flush(): Failed to send {len(batch)} changes to solr, will retry: {str(e)}")
+                self.failures += 1
+                with self.cond:
+                    # changes queued while this flush was running are newer, so they go on top
+                    for _id, change in batch.items():
+                        if _id in self.pending:
+                            change = SearchIndexQueue._merge(change, self.pending[_id])
+                        self.pending[_id] = change
+                    self.oldest = time.monotonic()
+                return False
+
+            self.sent += len(batch)
+            self.last_lag = time.monotonic() - oldest
+            if self.on_flush is not None:
+                self.on_flush()
+            return True
+
+    def close(self):
+        """
+        stops the background thread and sends everything that's still waiting
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with "depth" (number of waiting changes), "lag" (seconds the oldest waiting change has waited),
+         "last_lag", "sent", "batches", and "failures"
+        """
+        with self.cond:
+            return {"depth": len(self.pending),
+                    "lag": 0.0 if self.oldest is None else time.monotonic() - self.oldest,
+                    "last_lag": self.last_lag,
+                    "sent": self.sent,
+                    "batches": self.batches,
+                    "failures": self.failures}
 
 
 class Database:
+    PIPELINE_CHUNK_SIZE = 1000  # max number of commands sent in one pipelined round trip
+    # max number of open redis connections, shared by all threads using this Database. enough for GraphAPI's
+    # default workers and watchers plus the 4 background threads, see main.py's --redis-pool-size
+    REDIS_POOL_SIZE = 16
+    REDIS_POOL_TIMEOUT = 10  # seconds to wait for a free connection before raising an error
 
-    def __init__(self):
+    def __init__(self, chunk_size: int = PIPELINE_CHUNK_SIZE, pool_size: int = REDIS_POOL_SIZE,
+                 index_batch_size: int = SearchIndexQueue.BATCH_SIZE,
+                 index_max_delay: float = SearchIndexQueue.MAX_DELAY, client: redis.Redis = None,
+                 solr: pysolr.Solr = None):
+        """
+        :param chunk_size: max number of commands per pipeline for the get_*_many functions. bigger chunks mean
+         fewer round trips but more memory used by redis and by this process for each reply.
+        :param pool_size: max number of redis connections. should be at least the number of threads that use
+         this Database at the same time, otherwise they'll wait on each other for connections.
+        :param index_batch_size: see SearchIndexQueue.BATCH_SIZE
+        :param index_max_delay: see SearchIndexQueue.MAX_DELAY
+        :param client: redis client to use instead of connecting to the local redis server. must have
+         decode_responses=True. pool_size is ignored if this is given.
+        :param solr: solr client to use instead of connecting to the local solr core. must not always commit.
+        """
+        self.chunk_size = chunk_size
 
         # todo: add authentication to redis and solr
 
-        # both of these will raise an error if their respective server isn't already running
-        self.db = redis.Redis(decode_responses=True)
-        self.solr = pysolr.Solr("http://localhost:8983/solr/graph_core/", always_commit=True)
+        # both of these will raise an error if their respective server isn't already running.
+        # the blocking pool makes threads wait for a free connection instead of erroring when all are in use
+        if client is None:
+            client = redis.Redis(connection_pool=redis.BlockingConnectionPool(
+                max_connections=pool_size, timeout=Database.REDIS_POOL_TIMEOUT, decode_responses=True))
+        self.db = client
+        self.pool = client.connection_pool
+        self.redis_counter = metrics.RedisCounter(client)
+        # commits are done by solr itself, see SearchIndexQueue.COMMIT_WITHIN
+        if solr is None:
+            solr = pysolr.Solr("http://localhost:8983/solr/graph_core/", always_commit=False)
+        self.solr = solr
+        metrics.instrument_solr(solr)
+        self.index_queue = SearchIndexQueue(self.solr, index_batch_size, index_max_delay)
 
+    @metrics.timed
     def set_attr(self, key, attr, val):
         self.db.hset(key, attr, val)
 
+    @metrics.timed
     def set_attrs(self, key, attrs: Dict[str, Any]):
         """
 
@@ -24,91 +279,424 @@ class Database:
         :param attrs: dict with attribute names and values to set them to
         :return:
         """
+        # using a loop because i have an old redis version. if i ever update it, i'll use the mapping param.
+        # the pipeline still sends them all in one round trip
+        pipe = self.db.pipeline()
         for pair in attrs.items():
-            # using a loop because i have an old redis version. if i ever update it, i'll use the mapping param
-            self.db.hset(key, pair[0], pair[1])
+            pipe.hset(key, pair[0], pair[1])
+        pipe.execute()
 
+    @metrics.timed
     def get_attr(self, key, attr):
         return self.db.hget(key, attr)
 
+    @metrics.timed
+    def get_attr_many(self, keys: Iterable, attr) -> List[Optional[str]]:
+        """
+        same as get_attr, but for many keys. uses one pipelined round trip per chunk of keys.
+
+        :param keys: keys of the hashes
+        :param attr: attribute to get from each hash
+        :return: list of values, in the same order as keys. missing keys or attributes give None.
+        """
+        ret = []
+        for chunk in chunked(keys, self.chunk_size):
+            pipe = self.db.pipeline(transaction=False)
+            for k in chunk:
+                pipe.hget(k, attr)
+            ret += pipe.execute()
+        return ret
+
+    @metrics.timed
     def get_attrs(self, key):
         return self.db.hgetall(key)
 
+    @metrics.timed
+    def get_attrs_many(self, keys: Iterable) -> List[Dict[str, str]]:
+        """
+        same as get_attrs, but for many keys. uses one pipelined round trip per chunk of keys
+        instead of one round trip per key.
+
+        :param keys: keys of the hashes to get
+        :return: list of attribute dicts, in the same order as keys. missing keys give an empty dict.
+        """
+        ret = []
+        for chunk in chunked(keys, self.chunk_size):
+            pipe = self.db.pipeline(transaction=False)
+            for k in chunk:
+                pipe.hgetall(k)
+            ret += pipe.execute()
+        return ret
+
+    @metrics.timed
     def has_attr(self, key, attr):
         return self.db.hexists(key, attr)
 
+    @metrics.timed
     def set_val(self, key, val):
         self.db.set(key, val)
 
+    @metrics.timed
     def get_val(self, key):
         return self.db.get(key)
 
-    def incr(self, key, amt=1):
-        self.db.incr(key, amt)
+    @metrics.timed
+    def get_vals(self, keys: List) -> List[Optional[str]]:
+        """
+        :param keys: keys to get the values of, in one round trip
+        :return: list of values, in the same order as keys. missing keys give None.
+        """
+        return self.db.mget(keys)
+
+    @metrics.timed
+    def incr(self, key, amt=1) -> int:
+        """
+        :return: the key's new value
+        """
+        return self.db.incr(key, amt)
 
+    @metrics.timed
     def get_all_keys(self):
         return self.db.keys()
 
+    @metrics.timed
     def delete(self, key):
         self.db.delete(key)
 
+    @metrics.timed
+    def exists_many(self, keys: Iterable) -> List[bool]:
+        """
+        same as exists, but for many keys. uses one pipelined round trip per chunk of keys.
+        """
+        ret = []
+        for chunk in chunked(keys, self.chunk_size):
+            pipe = self.db.pipeline(transaction=False)
+            for k in chunk:
+                pipe.exists(k)
+            ret += [bool(x) for x in pipe.execute()]
+        return ret
+
+    @metrics.timed
     def exists(self, key):
         return self.db.exists(key)
 
-    def add_to_set(self, key, val):
-        self.db.sadd(key, val)
+    @metrics.timed
+    def add_to_set(self, key, *vals):
+        self.db.sadd(key, *vals)
 
+    @metrics.timed
     def remove_from_set(self, key, val):
         self.db.srem(key, val)
 
-    def get_from_set(self, key):
-        return self.db.smembers(key)
+    @metrics.timed
+    def get_from_set(self, key) -> Set[int]:
+        """
+        :param key: key of a set of integers. every set in this database holds node ids.
+        :return: the set's members as ints
+        """
+        return {int(x) for x in self.db.smembers(key)}
+
+    @metrics.timed
+    def get_from_sets(self, keys: Iterable) -> List[Set[int]]:
+        """
+        same as get_from_set, but for many keys. uses one pipelined round trip per chunk of keys.
+
+        :param keys: keys of the sets to get
+        :return: list of sets of ints, in the same order as keys. missing keys give an empty set.
+        """
+        ret = []
+        for chunk in chunked(keys, self.chunk_size):
+            pipe = self.db.pipeline(transaction=False)
+            for k in chunk:
+                pipe.smembers(k)
+            ret += [{int(x) for x in s} for s in pipe.execute()]
+        return ret
+
+    @metrics.timed
+    def write_batch(self, hashes: Iterable[Tuple[str, Dict[str, Any]]], set_members: Iterable[Tuple[str, List]],
+                    scores: Iterable[Tuple[str, Dict[Any, float]]] = (), bits: Iterable[Tuple[str, List[int]]] = ()):
+        """
+        sets many hashes and adds to many sets, one pipelined round trip per chunk of commands. other clients can see
+        the writes before all of them are done.
+
+        :param hashes: (key, fields) pairs. fields are added to the hash, other fields stay the same.
+        :param set_members: (key, members) pairs. members are added to the set.
+        :param scores: (key, {member: score}) pairs. members are added to the sorted set or get the new score.
+        :param bits: (key, offsets) pairs. the bits at offsets are set to 1 in the bitmap.
+        """
+        commands = [("hset", k, v) for k, v in hashes] + [("sadd", k, v) for k, v in set_members if v] + \
+            [("zadd", k, v) for k, v in scores if v] + [("setbit", k, o) for k, v in bits for o in v]
+        for chunk in chunked(commands, self.chunk_size):
+            pipe = self.db.pipeline(transaction=False)
+            for command, k, v in chunk:
+                if command == "hset":
+                    # HMSET instead of HSET's mapping param for old redis versions
+                    pipe.hmset(k, v)
+                elif command == "sadd":
+                    pipe.sadd(k, *v)
+                elif command == "zadd":
+                    pipe.zadd(k, v)
+                else:
+                    pipe.setbit(k, v, 1)
+            pipe.execute()
+
+    @metrics.timed
+    def remove_batch(self, set_members: Iterable[Tuple[str, List]]):
+        """
+        removes members from many sets, one pipelined round trip per chunk of sets. see write_batch
+
+        :param set_members: (key, members) pairs. members are removed from the set.
+        """
+        for chunk in chunked(((k, v) for k, v in set_members if v), self.chunk_size):
+            pipe = self.db.pipeline(transaction=False)
+            for k, v in chunk:
+                pipe.srem(k, *v)
+            pipe.execute()
+
+    @metrics.timed
+    def replace_sorted_set(self, key, items: Iterable[Tuple[Any, float]]):
+        """
+        replaces a sorted set's contents. the new contents are written to a temporary key in pipelined chunks, then
+        renamed to key, so readers see either the old set or the whole new one.
+
+        :param key: key of the sorted set
+        :param items: (member, score) pairs
+        """
+        tmp = f"{key}:tmp"
+        self.db.delete(tmp)
+        for chunk in chunked(items, self.chunk_size):
+            self.db.zadd(tmp, dict(chunk))
+        if self.db.exists(tmp):
+            self.db.rename(tmp, key)
+        else:
+            self.db.delete(key)  # redis has no empty sorted sets
+
+    @metrics.timed
+    def get_sorted_range(self, key, start: int, count: int) -> List[int]:
+        """
+        :param key: key of a sorted set of node ids
+        :param start: index of the first member to get, highest score first
+        :param count: number of members to get
+        :return: members as ints, highest score first
+        """
+        if count <= 0:
+            return []
+        return [int(x) for x in self.db.zrevrange(key, start, start + count - 1)]
+
+    @metrics.timed
+    def get_bytes(self, key, start: int, length: int) -> bytes:
+        """
+        :param key: key of a string, like a bitmap
+        :param start: index of the first byte to get
+        :param length: max number of bytes to get
+        :return: the bytes, without decoding them as text. fewer than length at the end of the string.
+        """
+        return self.db.execute_command("GETRANGE", key, start, start + length - 1, **{NEVER_DECODE: []}) or b""
+
+    @metrics.timed
+    def get_bits(self, key, offsets: List[int]) -> List[bool]:
+        """
+        :param key: key of a bitmap
+        :param offsets: bits to get
+        :return: whether each bit is 1. uses one pipelined round trip.
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for offset in offsets:
+            pipe.getbit(key, offset)
+        return [bool(x) for x in pipe.execute()] if offsets else []
+
+    @metrics.timed
+    def count_bits(self, key) -> int:
+        """
+        :return: number of bits set to 1 in a bitmap
+        """
+        return self.db.bitcount(key)
+
+    @metrics.timed
+    def add_to_list(self, key, *vals):
+        self.db.rpush(key, *vals)
+
+    @metrics.timed
+    def stream_range(self, key, start: str, count: int, reverse: bool = False) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        :param key: key of a redis stream
+        :param start: id of the first entry to get. the entry with this id is included if it exists.
+        :param count: max number of entries
+        :param reverse: if True, gets the entries before start instead of after it, newest first
+        :return: list of (entry id, fields) pairs
+        """
+        if reverse:
+            return self.db.xrevrange(key, max=start, min="-", count=count)
+        return self.db.xrange(key, min=start, max="+", count=count)
+
+    def stream_wait(self, key, after: str, timeout: float) -> bool:
+        """
+        waits for an entry to be added to a redis stream. uses one connection from the pool while waiting.
+
+        :param key: key of a redis stream
+        :param after: id of the last entry the caller has seen
+        :param timeout: max seconds to wait
+        :return: True if there are entries after the given one, False if the timeout ran out
+        """
+        return bool(self.db.xread({key: after}, count=1, block=max(1, int(timeout * 1000))))
+
+    def configure(self, settings: Dict[str, Any]) -> bool:
+        """
+        changes redis server settings with CONFIG SET. they last until redis restarts, so also put them in
+        redis.conf to keep them.
+
+        :param settings: setting names and values
+        :return: True if every setting was changed. some hosted redis servers don't allow CONFIG SET.
+        """
+        ok = True
+        for k, v in settings.items():
+            try:
+                self.db.config_set(k, v)
+            except redis.ResponseError as e:
+                print(f"Database.configure(): Failed to set redis setting {k} to {v}: {str(e)}")
+                ok = False
+        return ok
+
+    def memory_used(self) -> int:
+        """
+        :return: bytes of memory used by the redis server, from INFO memory
+        """
+        return int(self.db.info("memory")["used_memory"])
+
+    def register_script(self, source: str) -> Callable:
+        """
+        scripts run atomically on the redis server, so they're used for anything that needs several commands
+        without other clients' writes happening in between.
+
+        :param source: lua source code of the script
+        :return: function that runs the script. its args show up as ARGV in the script, and it returns the
+         script's return value. the source is only sent to redis once, after that it's called by its hash.
+        """
+        script = self.db.register_script(source)
+
+        @metrics.timed
+        def run_script(*args):
+            return script(args=args)
+        return run_script
+
+    def subscribe(self, channel: str) -> Iterable[Optional[str]]:
+        """
+        listens for messages published to a redis channel. blocks while waiting, so use it from its own thread.
+        uses one connection from the pool for as long as it runs.
+
+        :param channel: name of the channel
+        :return: generator of messages. None is yielded whenever the subscription (re)starts, which means messages
+         published before it may have been missed, e.g. after a lost connection.
+        """
+        while True:
+            pubsub = self.db.pubsub(ignore_subscribe_messages=False)
+            try:
+                pubsub.subscribe(channel)
+                for msg in pubsub.listen():
+                    if msg["type"] == "subscribe":
+                        yield None
+                    elif msg["type"] == "message":
+                        yield msg["data"]
+            except redis.ConnectionError:
+                pass  # resubscribe
+            finally:
+                pubsub.close()
 
     async def save_db(self):
         await self.db.bgsave()
 
+    @metrics.timed
     def add_search_index(self, data):
         """
         example: add_search_index([{"id": "1", "title": "here's some text"},
          {"id": "2", "title": "text associated with id 2"}])
 
+        the data is queued and sent to solr in the background, see SearchIndexQueue.
+
         :param data: a Dict[str,str] with keys and values for search indexing terms. alternatively, a list
         of such dicts.
 
         data must include "id" and "title" keys. optional "content" and "tags" keys.
-        :return: solr's json response, converted to a python object
+        :return: none
         """
         # todo: make "tags" be stored as a list instead of a string
-        return json.loads(self.solr.add(data if type(data) is list else [data]))
+        for doc in (data if type(data) is list else [data]):
+            self.index_queue.add(doc)
+
+    def delete_search_index(self, _id):
+        """
+        the delete is queued and sent to solr in the background, see SearchIndexQueue.
 
-    def update_search_index(self, _id, new_data:dict):
+        :param _id: id of the search item to delete. int or str.
         """
+        self.index_queue.delete(_id)
+
+    @metrics.timed
+    def update_search_index(self, _id, new_data: dict):
+        """
+        the change is queued and sent to solr in the background, see SearchIndexQueue.
+
         :param _id: id of search item to update. int or str.
         :param new_data: dict, same as the one you would use for add_search_index. cannot be a list.
-         does not need an "id" key. note that new_data's value will be changed in-place by this function.
-        :return: False if solr gives an error, else True
+         does not need an "id" key.
+        :return: True. errors from solr are handled by the queue, which retries later.
+        """
+        self.index_queue.update(_id, new_data)
+        return True
+
+    @metrics.timed
+    def add_search_index_now(self, docs: List[Dict[str, Any]]):
         """
+        sends full documents to solr right away, skipping the queue and without committing. for bulk indexing,
+        call commit_search_index when done.
 
-        for k in new_data.keys():
-            # https://solr.apache.org/guide/6_6/updating-parts-of-documents.html#UpdatingPartsofDocuments-Example
-            new_data[k] = {"set": new_data[k]}
+        :param docs: list of dicts like the ones for add_search_index
+        :return: none. raises an error if solr returns one.
+        """
+        if docs:
+            self.solr.add(docs, commit=False)
 
-        new_data["id"] = _id
-        res = json.loads(self.solr.add(new_data))
-        if res["responseHeader"]["status"] != 0:
-            # todo: error handling, and figure out why status is 0. do same in self.search_query()
-            #  but it looks like pysolr already takes care of this by raising an error
-            return False
-        return True
+    @metrics.timed
+    def commit_search_index(self):
+        """
+        makes everything sent to solr so far searchable
+        """
+        self.solr.commit()
+
+    @metrics.timed
+    def flush_search_index(self, commit: bool = False) -> bool:
+        """
+        sends queued search index changes to solr now instead of waiting for the background thread.
+
+        :param commit: if True, the changes are searchable when this returns
+        :return: True if everything was sent
+        """
+        return self.index_queue.flush(commit)
+
+    def close(self):
+        """
+        sends queued search index changes and closes redis connections. call this before exiting.
+        """
+        self.index_queue.close()
+        self.pool.disconnect()
 
-    def search_query(self, query:str) -> dict:
+    @metrics.timed
+    def search_query(self, query: str, rows: int = 10, filters: List[str] = None,
+                     cursor: str = "*") -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
         :param query: string to search for in solr search thing
-        :return: results of solr search query (python object loaded from json).
-        this is a dict with "numFound", "start", "numFoundExact", and "docs" keys
+        :param rows: max number of results
+        :param filters: solr filter queries. solr caches each one separately, so use them for conditions that are
+         the same across many searches.
+        :param cursor: "*" for the first page, else the cursor returned with the previous page
+        :return: (docs, next cursor). docs are dicts with "id" and "title". next cursor is None if there are no more
+         results.
         """
-        res = self.solr.search(query)
-        return res.docs
+        # cursorMark needs a sort that ends with the unique key. fl leaves out everything else solr would return
+        res = self.solr.search(query, rows=rows, fq=filters or [], fl="id,title", sort="score desc, id asc",
+                               cursorMark=cursor)
+        next_cursor = getattr(res, "nextCursorMark", None)
+        return res.docs, None if next_cursor is None or next_cursor == cursor else next_cursor
 
 
 if __name__ == "__main__":
@@ -1,7 +1,334 @@
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
+from itertools import islice
 import json
-from typing import List, Iterable
+import threading
+import time
+from typing import List, Iterable, Tuple, Set, Callable, Dict, Any, Union
+import adjacency
 import database
+import layout
+import nodecache
+import reachability
+import searchcache
+import suggest
+
+
+# lua functions for graph mutations. these run on the redis server through Database.register_script, so each
+# mutation is one round trip and other clients can't see or interfere with a half-finished one.
+# node ids come in as strings, since that's how redis passes script args.
+# the key layout comes from layout.Layout.lua_header, which is put in front of these scripts. if updating the
+# root-linking rules, update these and the matching GraphManager functions.
+#
+# every script that changes the graph increments the graph version and publishes the edge changes to the graph
+# change channel, see adjacency.parse_changes for the format. the same message is returned to the caller.
+# the edge changes and the ids of changed nodes are also added to the change stream, see GraphManager.changes_json.
+# it's trimmed to about the newest 100000 entries.
+GRAPH_LUA = """
+local changes = {}
+local changed_nodes = {}
+local removed_nodes = {}
+
+local function add_edge(_from, _to)
+    local added = redis.call('SADD', _to .. PARENTS, _from) + redis.call('SADD', _from .. CHILDREN, _to)
+    if added > 0 then
+        table.insert(changes, '+' .. _from .. '>' .. _to)
+    end
+end
+
+local function remove_edge(_from, _to)
+    local removed = redis.call('SREM', _to .. PARENTS, _from) + redis.call('SREM', _from .. CHILDREN, _to)
+    if removed > 0 then
+        table.insert(changes, '-' .. _from .. '>' .. _to)
+    end
+end
+
+-- time is the node's new last_modified, see Layout.encode_time. the index stores it as UNIX seconds
+local function node_changed(id, time)
+    redis.call('ZADD', 'nodes:last_modified', string.format('%.6f', tonumber(time) / TIME_SCALE), id)
+    table.insert(changed_nodes, id)
+end
+
+local function publish_changes()
+    local version = redis.call('INCR', 'graph_version')
+    local message = tostring(version)
+    if #changes > 0 then
+        message = message .. ' ' .. table.concat(changes, ' ')
+    end
+    redis.call('PUBLISH', 'graph_changes', message)
+    if #changes > 0 or #changed_nodes > 0 or #removed_nodes > 0 then
+        redis.call('XADD', 'graph_change_stream', 'MAXLEN', '~', '100000', '*', 'version', version,
+                   'edges', table.concat(changes, ' '), 'nodes', table.concat(changed_nodes, ' '),
+                   'removed', table.concat(removed_nodes, ' '))
+    end
+    return message
+end
+
+local function link_nodes(parent, child, two_way)
+    add_edge(parent, child)
+    if parent ~= '0' then
+        -- same as unlink_nodes('0', child), but child can't end up without parents here
+        remove_edge('0', child)
+    end
+    if two_way then
+        add_edge(child, parent)
+    end
+end
+
+-- returns the id of the first of ids that isn't a node, or nil if they all are
+local function missing_node(ids)
+    for _, id in ipairs(ids) do
+        if redis.call('EXISTS', id) == 0 then
+            return id
+        end
+    end
+    return nil
+end
+
+local function unlink_nodes(parent, child, two_way)
+    remove_edge(parent, child)
+    if two_way then
+        remove_edge(child, parent)
+    end
+    -- link to root if no other links exist
+    if redis.call('SCARD', child .. PARENTS) == 0 then
+        add_edge('0', child)
+    end
+end
+
+local function add_node(type, title, content, tags, parent, time)
+    -- ids of removed nodes are used again first. new ids come from INCR's return value so that concurrent adds
+    -- can't get the same id
+    local id = redis.call('RPOP', 'free_ids')
+    if not id then
+        id = tostring(redis.call('INCR', 'next_id') - 1)
+    end
+    if type == 'root' and id ~= '0' then
+        type = 'concept'
+    end
+    local fields = {'type', type, 'title', title, 'content', content, 'tags', tags}
+    if STORE_ID then
+        table.insert(fields, 'id')
+        table.insert(fields, id)
+    end
+    table.insert(fields, 'created')
+    table.insert(fields, time)
+    table.insert(fields, 'last_modified')
+    table.insert(fields, time)
+    -- HMSET instead of HSET with multiple fields for old redis versions
+    redis.call('HMSET', id, unpack(fields))
+    redis.call('SETBIT', 'live_nodes', id, 1)
+    redis.call('INCR', 'index_generation')
+    node_changed(id, time)
+    link_nodes(parent, id, false)
+    return id
+end
+
+-- unlinks the node from everything, links its children that are left without parents to the root, and deletes it.
+-- its id goes on the free list for add_node. returns 0 if the node was removed, 1 if it doesn't exist
+local function remove_node(id)
+    if redis.call('EXISTS', id) == 0 then
+        return 1
+    end
+    for _, parent in ipairs(redis.call('SMEMBERS', id .. PARENTS)) do
+        remove_edge(parent, id)
+    end
+    for _, child in ipairs(redis.call('SMEMBERS', id .. CHILDREN)) do
+        remove_edge(id, child)
+        if redis.call('SCARD', child .. PARENTS) == 0 then
+            add_edge('0', child)
+        end
+    end
+    redis.call('DEL', id)
+    redis.call('SETBIT', 'live_nodes', id, 0)
+    redis.call('RPUSH', 'free_ids', id)
+    redis.call('ZREM', 'nodes:last_modified', id)
+    -- so the next node that gets this id doesn't get the removed node's ranks. see analytics.RANK_KEYS
+    for _, key in ipairs({'rank:in_degree', 'rank:out_degree', 'rank:subtree_size', 'rank:pagerank', 'rank:depth'}) do
+        redis.call('ZREM', key, id)
+    end
+    redis.call('INCR', 'index_generation')
+    table.insert(removed_nodes, id)
+    return 0
+end
+
+-- returns 0 if the attribute was set, 1 if the node doesn't exist, 2 if the node doesn't have the attribute
+local function set_node_attr(id, attr, val, time, searchable)
+    if redis.call('EXISTS', id) == 0 then
+        return 1
+    end
+    if redis.call('HEXISTS', id, attr) == 0 then
+        return 2
+    end
+    redis.call('HMSET', id, attr, val, 'last_modified', time)
+    node_changed(id, time)
+    if searchable then
+        redis.call('INCR', 'index_generation')
+    end
+    return 0
+end
+"""
+
+# ARGV: type, title, content, tags, parent, current time (see Layout.encode_time).
+# returns {new node's id, change message}
+ADD_NODE_LUA = GRAPH_LUA + """
+if redis.call('GET', 'next_id') == '0' then
+    -- a new graph, and the root is added to itself. the change stream gets a first entry that marks the start of
+    -- the graph, so changes_json can tell that the stream has every change, see GraphManager._changes
+    redis.call('XADD', 'graph_change_stream', '*', 'version', '0', 'edges', '', 'nodes', '', 'removed', '',
+               'start', '1')
+elseif redis.call('EXISTS', ARGV[5]) == 0 then
+    return redis.error_reply('node ' .. ARGV[5] .. ' does not exist')
+end
+local id = add_node(ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6])
+return {id, publish_changes()}
+"""
+# ARGV: parent, child, two_way (1 or 0). returns the change message
+LINK_NODES_LUA = GRAPH_LUA + """
+-- an edge to a removed node would end up on the next node that gets its id
+local missing = missing_node({ARGV[1], ARGV[2]})
+if missing then
+    return redis.error_reply('node ' .. missing .. ' does not exist')
+end
+link_nodes(ARGV[1], ARGV[2], ARGV[3] == '1')
+return publish_changes()
+"""
+# ARGV: parent, child, two_way (1 or 0). returns the change message
+UNLINK_NODES_LUA = GRAPH_LUA + """
+-- unlinking a removed node would link it to the root again
+local missing = missing_node({ARGV[1], ARGV[2]})
+if missing then
+    return redis.error_reply('node ' .. missing .. ' does not exist')
+end
+unlink_nodes(ARGV[1], ARGV[2], ARGV[3] == '1')
+return publish_changes()
+"""
+# ARGV: id. returns {status from remove_node, change message}. the graph version is only incremented if the node
+# was removed
+REMOVE_NODE_LUA = GRAPH_LUA + """
+local status = remove_node(ARGV[1])
+if status ~= 0 then
+    return {status, false}
+end
+return {status, publish_changes()}
+"""
+# ARGV: id, attr, val, current time, searchable (1 or 0). returns {status from set_node_attr, change message}.
+# the graph version is only incremented if the attribute was set
+SET_NODE_ATTR_LUA = GRAPH_LUA + """
+local status = set_node_attr(ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5] == '1')
+if status ~= 0 then
+    return {status, false}
+end
+return {status, publish_changes()}
+"""
+# ARGV: json list of operations (see GraphManager.batch, with ids as strings and "$i" references), current time.
+# the operations are checked first, without writing anything, so either all of them happen or none do.
+# returns {1, list of each operation's node id or false, change message}, or {0, index of the bad operation, error}
+BATCH_LUA = GRAPH_LUA + """
+local ops = cjson.decode(ARGV[1])
+local now = ARGV[2]
+local node_attrs = {type = true, title = true, content = true, tags = true}
+
+-- ids[j] is the node id of operation j (1-based), or false. "$k" refers to operation k (0-based)
+local function resolve(v, ids, i)
+    if string.sub(v, 1, 1) ~= '$' then
+        return v
+    end
+    local ref = tonumber(string.sub(v, 2))
+    if ref == nil or ref < 0 or ref >= i - 1 or not ids[ref + 1] then
+        return nil
+    end
+    return ids[ref + 1]
+end
+
+-- first pass: find the ids that adds will get, and check everything set_node_attr would check
+local planned = {}
+local added = {}
+local next_id = tonumber(redis.call('GET', 'next_id'))
+-- add_node takes ids from the end of the free list first
+local adds = 0
+for _, op in ipairs(ops) do
+    if op.op == 'add' then
+        adds = adds + 1
+    end
+end
+local free = adds > 0 and redis.call('LRANGE', 'free_ids', -adds, -1) or {}
+for i, op in ipairs(ops) do
+    planned[i] = false
+    local refs = {}
+    for _, k in ipairs({'id', 'parent', 'child'}) do
+        if op[k] ~= nil then
+            refs[k] = resolve(op[k], planned, i)
+            if refs[k] == nil then
+                return {0, i - 1, 'invalid reference ' .. op[k]}
+            end
+        end
+    end
+    -- an edge to a removed node would end up on the next node that gets its id, see LINK_NODES_LUA
+    for _, k in ipairs({'parent', 'child'}) do
+        if refs[k] and not added[refs[k]] and redis.call('EXISTS', refs[k]) == 0 then
+            return {0, i - 1, 'node ' .. refs[k] .. ' does not exist'}
+        end
+    end
+    if op.op == 'add' then
+        if #free > 0 then
+            planned[i] = table.remove(free)
+        else
+            planned[i] = tostring(next_id)
+            next_id = next_id + 1
+        end
+        added[planned[i]] = true
+    elseif op.op == 'update' then
+        planned[i] = refs.id
+        if added[refs.id] then
+            if not node_attrs[op.attr] then
+                return {0, i - 1, "attribute '" .. op.attr .. "' does not exist in node '" .. refs.id .. "'"}
+            end
+        elseif redis.call('EXISTS', refs.id) == 0 then
+            return {0, i - 1, 'node ' .. refs.id .. ' does not exist'}
+        elseif redis.call('HEXISTS', refs.id, op.attr) == 0 then
+            return {0, i - 1, "attribute '" .. op.attr .. "' does not exist in node '" .. refs.id .. "'"}
+        end
+    end
+end
+
+local ids = {}
+for i, op in ipairs(ops) do
+    ids[i] = false
+    if op.op == 'add' then
+        ids[i] = add_node(op.type, op.title, op.content, op.tags, resolve(op.parent, ids, i), now)
+    elseif op.op == 'update' then
+        ids[i] = resolve(op.id, ids, i)
+        set_node_attr(ids[i], op.attr, op.val, now, op.searchable)
+    elseif op.op == 'link' then
+        link_nodes(resolve(op.parent, ids, i), resolve(op.child, ids, i), op.two_way)
+    else
+        unlink_nodes(resolve(op.parent, ids, i), resolve(op.child, ids, i), op.two_way)
+    end
+end
+return {1, ids, publish_changes()}
+"""
+# ARGV: the bitmap of nodes with ids before ARGV[2]. creates the live node bitmap, see
+# GraphManager._create_live_nodes_bitmap. nodes added since the bitmap was made are added to it here
+CREATE_LIVE_NODES_LUA = """
+if redis.call('EXISTS', 'live_nodes') == 1 then
+    return 0
+end
+redis.call('SET', 'live_nodes', ARGV[1])
+local next_id = tonumber(redis.call('GET', 'next_id') or '0')
+for id = tonumber(ARGV[2]), next_id - 1 do
+    if redis.call('EXISTS', tostring(id)) == 1 then
+        redis.call('SETBIT', 'live_nodes', id, 1)
+    end
+end
+return 1
+"""
+# for writes that don't go through these scripts, like GraphManager.import_ndjson. returns a change message that
+# tells adjacency caches that any edge may have changed
+INVALIDATE_LUA = GRAPH_LUA + """
+table.insert(changes, '*')
+return publish_changes()
+"""
 
 
 def get_current_time():
@@ -13,18 +340,161 @@ def get_current_time():
 
 class GraphManager:
     # todo: maybe don't hardcode this? or put it somewhere else, it's more of an api thing
-    MAX_LIST_SIZE = 100  # for nodes_list() and edges_list(). edges_list uses 10 times this
+    MAX_LIST_SIZE = 100  # for nodes_list() and edges_list(). edges_list uses 5 times this
+    EDGES_FIRST_CHUNK_SIZE = 64  # ids whose edges edges_list reads in its first round trip, see database.chunked
 
-    def __init__(self):
+    GRAPH_VERSION_KEY = "graph_version"  # these seven are also hardcoded in GRAPH_LUA
+    GRAPH_CHANGES_CHANNEL = "graph_changes"
+    INDEX_GENERATION_KEY = "index_generation"  # incremented whenever the search index changes
+    CHANGE_STREAM_KEY = "graph_change_stream"  # see changes_json
+    LAST_MODIFIED_KEY = "nodes:last_modified"  # sorted set of node ids by last_modified, as UNIX seconds
+    LIVE_NODES_KEY = "live_nodes"  # bitmap with a 1 for each node id that's in use, see live_ids
+    FREE_IDS_KEY = "free_ids"  # list of ids of removed nodes, used again by add_node
+    IMPORTANCE_KEY = "rank:pagerank"  # sorted set of node ids by importance, see analytics.compute
+
+    def __init__(self, db: database.Database = None, adjacency_cache: bool = False, preload: bool = True,
+                 search_cache: bool = True, layout_name: str = None, node_cache: bool = True,
+                 suggest_index: bool = False):
         """
         GraphManager provides functions to interact with the graph
+
+        :param db: database to use. if None, uses a Database with default settings.
+        :param layout_name: name of the redis key layout, see layout.LAYOUTS. new graphs are created in it, and
+         existing graphs must already be stored in it, see migrate_layout. if None, uses the graph's current
+         layout, or layout.DEFAULT for new graphs.
+        :param adjacency_cache: if True, keeps a copy of all edges in memory so that neighbor and edge queries don't
+         need to ask redis. see adjacency.AdjacencyCache
+        :param preload: if True and adjacency_cache is True, loads every node's edges now instead of on first use
+        :param search_cache: if True, repeated searches are answered from memory until the search index changes.
+         see searchcache.SearchCache
+        :param node_cache: if True, nodes' json is kept in memory and reused until they change. see
+         nodecache.NodeJsonCache
+        :param suggest_index: if True, loads every node's title into memory now for GraphManager.suggest. see
+         suggest.SuggestIndex
         """
-        self.db = database.Database()
+        self.db = db if db is not None else database.Database()
+        self.layout = self._load_layout(layout_name)
+        self.db.configure(self.layout.redis_config)
+        self._register_scripts()
+        self.adjacency_cache = None
+        self.suggest_index = None
+        # built on the first ancestor or descendant query, see ancestors_json
+        self.reachability_index = reachability.ReachabilityIndex(self.db, self.adjacency_sets, lambda: self.nodes,
+                                                                 GraphManager.GRAPH_VERSION_KEY,
+                                                                 GraphManager.GRAPH_CHANGES_CHANNEL)
+        self.search_cache = searchcache.SearchCache() if search_cache else None
+        self.node_cache = nodecache.NodeJsonCache() if node_cache else None
+        # changes reach solr some time after they're written, so the cache is cleared again once they're sent
+        self.db.index_queue.on_flush = lambda: self.db.incr(GraphManager.INDEX_GENERATION_KEY)
         # todo: handle invalid redis connection
         if not self.db.exists("next_id"):
             self.db.set_val("next_id", 0)
+        self._create_live_nodes_bitmap()
+        if self.next_id == 0:
             self.add_node("root", "root", "", "")
 
+        if adjacency_cache:
+            self.adjacency_cache = adjacency.AdjacencyCache(self.db, self.layout, GraphManager.GRAPH_VERSION_KEY,
+                                                            GraphManager.GRAPH_CHANGES_CHANNEL)
+            self.adjacency_cache.start(self.nodes if preload else ())
+
+        if suggest_index:
+            self.suggest_index = suggest.SuggestIndex()
+            self.suggest_index.build(self._titles(self.nodes))
+
+    def _titles(self, ids: Iterable) -> Iterable[Tuple[int, str]]:
+        """
+        :return: generator of (id, title) pairs, read with one pipelined round trip per chunk of ids. missing nodes
+         have title None.
+        """
+        for chunk in database.chunked(ids, self.db.chunk_size):
+            yield from zip(chunk, self.db.get_attr_many(chunk, "title"))
+
+    def _load_layout(self, name: str = None) -> layout.Layout:
+        stored = self.db.get_val(layout.LAYOUT_KEY)
+        if stored is None:
+            # graphs from before layouts were added don't have the key
+            stored = layout.CLASSIC.name if self.db.exists("next_id") else (name or layout.DEFAULT)
+            self.db.set_val(layout.LAYOUT_KEY, stored)
+        if ">" in stored:
+            # scripts fail until the migration is finished, so nothing can be written in the old layout
+            print(f"GraphManager: the graph is being migrated from layout {stored.replace('>', ' to ')}. "
+                  f"finish the migration with migrate_layout before writing to it.")
+            return layout.LAYOUTS[stored.split(">")[0]]
+        if name is not None and name != stored:
+            raise ValueError(f"GraphManager: the graph is stored in layout '{stored}', not '{name}'. "
+                             f"use migrate_layout to convert it.")
+        return layout.LAYOUTS[stored]
+
+    def _register_scripts(self):
+        header = self.layout.lua_header()
+        self._add_node_script = self.db.register_script(header + ADD_NODE_LUA)
+        self._link_nodes_script = self.db.register_script(header + LINK_NODES_LUA)
+        self._unlink_nodes_script = self.db.register_script(header + UNLINK_NODES_LUA)
+        self._set_node_attr_script = self.db.register_script(header + SET_NODE_ATTR_LUA)
+        self._remove_node_script = self.db.register_script(header + REMOVE_NODE_LUA)
+        self._invalidate_script = self.db.register_script(header + INVALIDATE_LUA)
+        self._batch_script = self.db.register_script(header + BATCH_LUA)
+
+    def _create_live_nodes_bitmap(self):
+        """
+        graphs from before nodes could be removed don't have the live node bitmap. it's made here by checking which
+        ids have a node, once.
+        """
+        if self.db.exists(GraphManager.LIVE_NODES_KEY):
+            return
+        next_id = self.next_id
+        bitmap = bytearray((next_id + 7) // 8)
+        for i, exists in enumerate(self.db.exists_many(range(next_id))):
+            if exists:
+                bitmap[i // 8] |= 128 >> (i % 8)
+        if self.db.register_script(CREATE_LIVE_NODES_LUA)(bytes(bitmap), next_id) and next_id > 0:
+            print(f"GraphManager: created the live node bitmap for {next_id} node ids.")
+
+    LIVE_IDS_CHUNK_SIZE = 64 * 1024  # bytes of the live node bitmap read per round trip, enough for 524288 ids
+
+    def live_ids(self, start: int = 0, stop: int = None) -> Iterable[int]:
+        """
+        ids of nodes that haven't been removed, from the live node bitmap. it's read in chunks while the ids are
+        used, one round trip per LIVE_IDS_CHUNK_SIZE * 8 ids, so ids of removed nodes are skipped without reading
+        anything else.
+
+        :param start: first id to include
+        :param stop: ids from this one on aren't included. None for no limit.
+        :return: generator of ids, in increasing order
+        """
+        byte = max(start, 0) // 8
+        while stop is None or byte * 8 < stop:
+            data = self.db.get_bytes(GraphManager.LIVE_NODES_KEY, byte, GraphManager.LIVE_IDS_CHUNK_SIZE)
+            for _id in database.bit_offsets(data, byte * 8):
+                if stop is not None and _id >= stop:
+                    return
+                if _id >= start:
+                    yield _id
+            if len(data) < GraphManager.LIVE_IDS_CHUNK_SIZE:
+                return
+            byte += len(data)
+
+    def live_id_ranges(self) -> List[List[int]]:
+        """
+        :return: every live node id as a list of [start, stop] ranges, like python's range: start is the first id
+         of the range and stop is one more than the last one. ids are mostly used in order, so this is much smaller
+         than a list of ids.
+        """
+        ret = []
+        for _id in self.live_ids():
+            if ret and ret[-1][1] == _id:
+                ret[-1][1] += 1
+            else:
+                ret.append([_id, _id + 1])
+        return ret
+
+    def node_count(self) -> int:
+        """
+        :return: number of nodes that haven't been removed, including the root
+        """
+        return self.db.count_bits(GraphManager.LIVE_NODES_KEY)
+
     @property
     def next_id(self):
         """
@@ -36,66 +506,209 @@ class GraphManager:
     @property
     def nodes(self) -> Iterable:
         """
-        :return: iterable of all node ids
+        :return: iterable of all node ids, without removed nodes. see live_ids
         """
-        return range(0, self.next_id)
+        return self.live_ids()
 
     def nodes_list(self, ids: List) -> List:
         """
         :param ids: ids of nodes to return
         :return: list of node data items. a node data item is a dict with the node's attributes as keys.
         """
-        ret = []
-        for x in ids:
-            n = self.db.get_attrs(x)
-            ret.append(n)
-            if len(ret) >= GraphManager.MAX_LIST_SIZE:
-                break
+        return self.node_attrs(islice(ids, GraphManager.MAX_LIST_SIZE))
+
+    def node_attrs(self, ids: Iterable) -> List[Dict[str, str]]:
+        """
+        same as nodes_list, but without the MAX_LIST_SIZE limit
+
+        :param ids: ids of nodes to return
+        :return: list of attribute dicts in the same format for every layout, in the same order as ids. missing
+         nodes give an empty dict.
+        """
+        ids = list(ids)
+        return [self.layout.decode_node(_id, n) for _id, n in zip(ids, self.db.get_attrs_many(ids))]
+
+    def nodes_fragments(self, ids: Iterable) -> List[str]:
+        """
+        json of nodes' data objects. with the node cache, nodes whose last_modified hasn't changed aren't read or
+        encoded again, which costs one pipelined HGET per chunk of ids instead of reading every node.
+
+        used for responses about a few specific nodes. bulk reads like graph_ndjson don't use it, since they would
+        push everything else out of the cache.
+
+        :param ids: ids of nodes
+        :return: list of json strings, in the same order as ids. missing nodes give "{}".
+        """
+        ids = list(ids)
+        if self.node_cache is None:
+            return [nodecache.dumps(n) for n in self.node_attrs(ids)]
+
+        # read before the nodes, so a write in between makes the new entries out of date instead of wrong
+        versions = self.db.get_attr_many(ids, "last_modified")
+        ret = self.node_cache.get_many(ids, versions)
+        missing = [i for i in range(len(ids)) if ret[i] is None]
+        if missing:
+            for i, n in zip(missing, self.node_attrs([ids[i] for i in missing])):
+                ret[i] = nodecache.dumps(n)
+                if versions[i] is not None:
+                    self.node_cache.put(ids[i], versions[i], ret[i])
         return ret
 
-    def edges_list(self, ids: List) -> List:
+    def _nodes_array(self, ids: Iterable) -> str:
+        """
+        :return: json list of the nodes' data objects, same as json.dumps(self.nodes_list(ids))
+        """
+        return "[" + ", ".join(self.nodes_fragments(islice(ids, GraphManager.MAX_LIST_SIZE))) + "]"
+
+    def important_ids(self, count: int = MAX_LIST_SIZE) -> List[int]:
+        """
+        :param count: max number of ids
+        :return: ids of the most important nodes, most important first, from the last analytics.compute. nodes
+         added since then aren't included. if it hasn't been run, returns the first count ids.
+        """
+        ret = self.db.get_sorted_range(GraphManager.IMPORTANCE_KEY, 0, count)
+        if not ret:
+            return list(islice(self.nodes, count))
+        # remove_node takes removed nodes out of the ranks, but not ones removed while analytics.compute was running
+        return [_id for _id, live in zip(ret, self.db.get_bits(GraphManager.LIVE_NODES_KEY, ret)) if live]
+
+    def recent_ids(self, count: int = MAX_LIST_SIZE) -> List[int]:
+        """
+        :param count: max number of ids
+        :return: ids of the most recently added or changed nodes, newest first. nodes that haven't changed since
+         the last_modified index was added aren't included.
+        """
+        return self.db.get_sorted_range(GraphManager.LAST_MODIFIED_KEY, 0, count)
+
+    def edges_list(self, ids: List, induced: bool = False) -> List:
         """
         edges attached to earlier ids are first. if the max list size is a problem, put more important nodes
-        at the beginning of the ids list.
+        at the beginning of the ids list, see important_ids.
 
         :param ids: ids of nodes to return
+        :param induced: if True, only includes edges between two of the nodes in ids, and lists each edge once
         :return: list of edges that are connected to any of those nodes. an individual edge
         is a 2-element list: [sourceID, targetID]
         """
-        # todo: add a way to only include edges that are between two of the nodes listed in the ids param
         ret = []
-        for _id in ids:
-            parents = self.db.get_from_set(str(_id) + ".parents")
-            children = self.db.get_from_set(str(_id) + ".children")
-            ret += [[int(p), _id] for p in parents]
-            ret += [[_id, int(c)] for c in children]
+        if induced:
+            ids = [int(i) for i in ids]
+            id_set = set(ids)
+            for _id, _, children in self.adjacency_sets(ids, GraphManager.EDGES_FIRST_CHUNK_SIZE):
+                # every edge between two of the ids is in its source's children, so parents aren't needed
+                ret += [[_id, c] for c in children if c in id_set]
+                if len(ret) >= GraphManager.MAX_LIST_SIZE * 5:
+                    break
+            return ret
+
+        for _id, parents, children in self.adjacency_sets(ids, GraphManager.EDGES_FIRST_CHUNK_SIZE):
+            ret += [[p, _id] for p in parents]
+            ret += [[_id, c] for c in children]
             if len(ret) >= GraphManager.MAX_LIST_SIZE * 5:
                 break
         return ret
 
+    def adjacency_sets(self, ids: Iterable, first_chunk_size: int = None) -> Iterable[Tuple[int, Set[int], Set[int]]]:
+        """
+        fetches parents and children of many nodes, one pipelined round trip per chunk of ids, or none if they're
+        in the adjacency cache. chunks are only fetched when needed, so you can stop iterating early without
+        loading every id.
+
+        :param ids: ids of nodes to get the adjacency sets of
+        :param first_chunk_size: if given, the first chunk is this small and later ones grow, see database.chunked
+        :return: generator of (id, parents, children) tuples, in the same order as ids
+        """
+        for chunk in database.chunked(ids, self.db.chunk_size, first_chunk_size):
+            if self.adjacency_cache is not None:
+                for _id, (parents, children) in zip(chunk, self.adjacency_cache.get_many(chunk)):
+                    yield _id, parents, children
+                continue
+
+            keys = []
+            for _id in chunk:
+                keys += [self.layout.parents_key(_id), self.layout.children_key(_id)]
+            sets = self.db.get_from_sets(keys)
+            for i in range(len(chunk)):
+                yield chunk[i], sets[2 * i], sets[2 * i + 1]
+
+    def _apply_changes(self, message: str):
+        """
+        :param message: change message returned by one of the graph scripts
+        """
+        if self.adjacency_cache is not None:
+            self.adjacency_cache.apply(message)
+        self.reachability_index.apply(message)
+
     def nodes_json(self, ids: List):
         """
         :param ids: list of ids to get the json data for
         :return: json data with a list of data objects for the specified nodes, formatted as a string
         """
-        return json.dumps(self.nodes_list(ids))
+        return self._nodes_array(ids)
 
-    def edges_json(self, ids: List):
+    def edges_json(self, ids: List, induced: bool = False):
         """
         :param ids: list of node ids to get edge data for
+        :param induced: see GraphManager.edges_list
         :return: json data with a list of edges of the specified nodes, formatted as a string. an individual edge
         is a 2-element list: [sourceID, targetID]
         """
-        return json.dumps(self.edges_list(ids))
+        return nodecache.dumps(self.edges_list(ids, induced))
 
-    def graph_json(self, ids: List):
+    def graph_json(self, ids: List, induced: bool = False):
         """
         :param ids: list of ids to be included
+        :param induced: if True, only includes edges between the nodes that are in "nodes". see GraphManager.edges_list
         :return: json with "nodes" and "edges" attributes containing data as described in GraphManager.nodes_list and
         GraphManager.edges_list
         """
-        ret = {"nodes": self.nodes_list(ids),
-               "edges": self.edges_list(ids)}
+        if induced:
+            # nodes_list stops at MAX_LIST_SIZE, so edges to nodes after that would point to nodes that aren't sent
+            ids = list(islice(ids, GraphManager.MAX_LIST_SIZE))
+        # put together from strings so the nodes' json can come from the node cache
+        return f'{{"nodes": {self._nodes_array(ids)}, "edges": {self.edges_json(ids, induced)}}}'
+
+    def graph_ndjson(self, ids: Iterable) -> Iterable[str]:
+        """
+        same data as graph_json, but without the MAX_LIST_SIZE limit. nodes and edges are read from redis one chunk
+        at a time while the output is consumed, so memory use doesn't grow with the number of ids.
+
+        each edge is listed once, after its source node, so listing every node lists every edge exactly once.
+
+        :param ids: ids of nodes to be included. can be a lazy iterable like self.nodes.
+        :return: generator of newline-delimited json strings, one per chunk of ids. each line is either
+         {"node": node data object} or {"edge": [sourceID, targetID]}
+        """
+        for chunk in database.chunked(ids, self.db.chunk_size):
+            lines = []
+            for n in self.node_attrs(chunk):
+                if n:  # missing nodes have no attributes
+                    lines.append(json.dumps({"node": n}))
+            for _id, _, children in self.adjacency_sets(chunk):
+                lines += [json.dumps({"edge": [_id, c]}) for c in children]
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+    def graph_page(self, start: int, count: int) -> str:
+        """
+        one page of the whole graph. to get every node and edge, start at 0 and keep requesting the "next" page
+        until it's null.
+
+        :param start: first node id of the page
+        :param count: number of node ids in the page
+        :return: json with "nodes", "edges", and "next" attributes. "nodes" has data objects of nodes
+         start to start + count - 1, "edges" has the edges whose source is one of those nodes, and "next" is the
+         start of the next page, or null if this is the last page.
+        """
+        next_id = self.next_id
+        ids = list(self.live_ids(start, min(start + count, next_id)))
+        nodes = [n for n in self.node_attrs(ids) if n]
+        edges = []
+        for _id, _, children in self.adjacency_sets(ids):
+            edges += [[_id, c] for c in children]
+        ret = {"nodes": nodes,
+               "edges": edges,
+               "next": start + count if start + count < next_id else None}
         return json.dumps(ret)
 
     def neighbors_edges_json(self, _id: int):
@@ -107,31 +720,246 @@ class GraphManager:
         :return: string json with "nodes" and "edges" attributes. "nodes" is a list of node data objects. "edges"
         is a list of 2-element lists: [sourceID, targetID]
         """
-        nodes = self.nodes_list(self.neighbor_ids(_id))
-        edges = self.edges_list([_id])
-        ret = {"nodes": nodes, "edges": edges}
-        return json.dumps(ret)
+        # one round trip for both adjacency sets instead of fetching them for neighbor_ids and edges_list separately
+        _, parents, children = next(iter(self.adjacency_sets([_id])))
+        nodes = self._nodes_array([_id, *children, *parents])
+        edges = [[p, _id] for p in parents] + [[_id, c] for c in children]
+        return f'{{"nodes": {nodes}, "edges": {nodecache.dumps(edges)}}}'
+
+    def subgraph_json(self, _id: int, depth: int = 2, direction: str = "both", node_limit: int = MAX_LIST_SIZE,
+                      edge_limit: int = MAX_LIST_SIZE * 5):
+        """
+        gets the nodes within depth steps of a node, along with all edges between them. the graph is expanded one
+        level at a time, with one pipelined redis round trip per level.
+
+        :param _id: id of node to start from
+        :param depth: max number of steps from the start node
+        :param direction: "children" to only follow edges to successors, "parents" to only follow edges to
+         predecessors, or "both"
+        :param node_limit: max number of nodes. nodes closer to the start node are included first.
+        :param edge_limit: max number of edges
+        :return: string json with "nodes", "edges", and "truncated" attributes. "nodes" and "edges" are the same as
+         in neighbors_edges_json. "truncated" is true if node_limit or edge_limit left out nodes or edges.
+        """
+        if direction not in ["children", "parents", "both"]:
+            raise ValueError(f"subgraph_json: direction must be 'children', 'parents', or 'both', not '{direction}'.")
+
+        visited = {_id: None}  # dict instead of set to keep nodes in order of distance from _id
+        children_of = {}  # adjacency of every visited node, for listing edges between them
+        truncated = False
+        frontier = [_id]
+        level = 0
+        while frontier:
+            next_frontier = []
+            for n, parents, children in self.adjacency_sets(frontier):
+                children_of[n] = children
+                if level >= depth:
+                    continue  # only needed for the edges
+                neighbors = []
+                if direction != "parents":
+                    neighbors += sorted(children)
+                if direction != "children":
+                    neighbors += sorted(parents)
+                for m in neighbors:
+                    if m in visited:
+                        continue
+                    if len(visited) >= node_limit:
+                        truncated = True
+                        break
+                    visited[m] = None
+                    next_frontier.append(m)
+            frontier = next_frontier
+            level += 1
+
+        edges = []
+        for n in visited:
+            for c in sorted(children_of[n]):
+                if c in visited:
+                    if len(edges) >= edge_limit:
+                        truncated = True
+                        break
+                    edges.append([n, c])
+
+        nodes = "[" + ", ".join(self.nodes_fragments(visited)) + "]"
+        truncated = "true" if truncated else "false"
+        return f'{{"nodes": {nodes}, "edges": {nodecache.dumps(edges)}, "truncated": {truncated}}}'
+
+    def ancestors_json(self, _id: int, depth: int = None, count: int = MAX_LIST_SIZE):
+        """
+        gets the nodes that a node can be reached from by following edges to children, like every prerequisite of
+        a concept.
+
+        :param _id: id of node to start from
+        :param depth: max number of steps from the start node. if None, every ancestor is found with the
+         reachability index, see reachability.ReachabilityIndex. otherwise the graph is expanded one level at a
+         time, like in subgraph_json.
+        :param count: max number of nodes, capped at MAX_LIST_SIZE
+        :return: string json with "nodes" and "truncated" attributes. "nodes" is a list of node data objects, not
+         including the start node. "truncated" is true if count left out nodes.
+        """
+        return self._closure_json(_id, "parents", depth, count)
+
+    def descendants_json(self, _id: int, depth: int = None, count: int = MAX_LIST_SIZE):
+        """
+        gets the nodes that can be reached from a node by following edges to children, like everything that builds
+        on a concept. see ancestors_json for the parameters and the returned json.
+        """
+        return self._closure_json(_id, "children", depth, count)
+
+    def _closure_json(self, _id: int, direction: str, depth: int, count: int):
+        count = max(0, min(count, GraphManager.MAX_LIST_SIZE))
+        if depth is None:
+            if direction == "parents":
+                ids, truncated = self.reachability_index.ancestors(_id, count)
+            else:
+                ids, truncated = self.reachability_index.descendants(_id, count)
+        else:
+            visited = {int(_id): None}  # dict instead of set to keep nodes in order of distance from _id
+            truncated = False
+            frontier = [int(_id)]
+            for _ in range(depth):
+                next_frontier = []
+                for _, parents, children in self.adjacency_sets(frontier):
+                    for m in sorted(parents if direction == "parents" else children):
+                        if m in visited:
+                            continue
+                        if len(visited) > count:
+                            truncated = True
+                            break
+                        visited[m] = None
+                        next_frontier.append(m)
+                frontier = next_frontier
+                if truncated or not frontier:
+                    break
+            ids = list(islice(visited, 1, None))
+        nodes = "[" + ", ".join(self.nodes_fragments(ids)) + "]"
+        return f'{{"nodes": {nodes}, "truncated": {"true" if truncated else "false"}}}'
+
+    def is_ancestor(self, ancestor: int, descendant: int) -> bool:
+        """
+        :return: True if descendant can be reached from ancestor by following edges to children. answered by the
+         reachability index, see reachability.ReachabilityIndex.reaches
+        """
+        return self.reachability_index.reaches(ancestor, descendant)
+
+    MAX_PATH_VISITED = 100000  # for path_json
+    MAX_PATH_SECONDS = 2.0
+    PATH_CHUNK_SIZE = 100  # nodes of a level whose edges path_json reads per round trip
+
+    def _one_way_sets(self, ids: List, direction: str) -> List[Set[int]]:
+        """
+        :param direction: "children" or "parents"
+        :return: children or parents of each id, in the same order as ids. only reads the sets of that direction,
+         with one pipelined round trip per chunk of ids, or none if they're in the adjacency cache.
+        """
+        if self.adjacency_cache is not None:
+            return [s[direction == "children"] for s in self.adjacency_cache.get_many(ids)]
+        key = self.layout.children_key if direction == "children" else self.layout.parents_key
+        return self.db.get_from_sets([key(_id) for _id in ids])
+
+    def path_json(self, _from: int, to: int, max_depth: int = 20, max_visited: int = MAX_PATH_VISITED,
+                  max_seconds: float = MAX_PATH_SECONDS):
+        """
+        finds a shortest path from one node to another that follows edges from parents to children, like a learning
+        path from a concept to one that builds on it.
+
+        searches forward from _from and backward from to at the same time, always expanding the smaller frontier by
+        one whole level, so it visits far fewer nodes than searching from one side. a level is read PATH_CHUNK_SIZE
+        nodes at a time, and the limits are checked for every node found, so one big level can't go far past them.
+
+        :param _from: id of node to start at
+        :param to: id of node to end at
+        :param max_depth: max number of edges in the path
+        :param max_visited: stops searching after visiting this many nodes
+        :param max_seconds: stops searching after this many seconds
+        :return: string json with "path", "nodes", and "truncated" attributes. "path" is the list of ids from _from
+         to to, or null if there's no path of at most max_depth edges. "nodes" are the data objects of the nodes in
+         "path". "truncated" is true if max_visited or max_seconds stopped the search before it could tell.
+        """
+        _from, to = int(_from), int(to)
+        deadline = time.monotonic() + max_seconds
+        forward = {_from: None}  # node -> the node it was reached from, going forward from _from
+        backward = {to: None}  # node -> the node it was reached from, going backward from to
+        forward_frontier = [_from]
+        backward_frontier = [to]
+        depth = 0
+        meeting = _from if _from == to else None
+        truncated = False
+        while meeting is None and forward_frontier and backward_frontier and depth < max_depth:
+            if len(forward) + len(backward) >= max_visited or time.monotonic() >= deadline:
+                truncated = True
+                break
+            if len(forward_frontier) <= len(backward_frontier):
+                reached, other, direction, frontier = forward, backward, "children", forward_frontier
+            else:
+                reached, other, direction, frontier = backward, forward, "parents", backward_frontier
+            next_frontier = []
+            for chunk in database.chunked(frontier, GraphManager.PATH_CHUNK_SIZE):
+                if time.monotonic() >= deadline:
+                    truncated = True
+                    break
+                for n, neighbors in zip(chunk, self._one_way_sets(chunk, direction)):
+                    for m in sorted(neighbors):
+                        if m in reached:
+                            continue
+                        reached[m] = n
+                        next_frontier.append(m)
+                        # every node found in this level is the same number of steps from both ends, so any of
+                        # them is on a shortest path
+                        if m in other:
+                            meeting = m
+                            break
+                        if len(forward) + len(backward) >= max_visited:
+                            truncated = True
+                            break
+                    if meeting is not None or truncated:
+                        break
+                if meeting is not None or truncated:
+                    break
+            if truncated:
+                break
+            depth += 1
+            if direction == "children":
+                forward_frontier = next_frontier
+            else:
+                backward_frontier = next_frontier
+
+        if meeting is None:
+            return f'{{"path": null, "nodes": [], "truncated": {"true" if truncated else "false"}}}'
+        path = []
+        n = meeting
+        while n is not None:
+            path.append(n)
+            n = forward[n]
+        path.reverse()
+        n = backward[meeting]
+        while n is not None:
+            path.append(n)
+            n = backward[n]
+        nodes = "[" + ", ".join(self.nodes_fragments(path)) + "]"
+        return f'{{"path": {nodecache.dumps(path)}, "nodes": {nodes}, "truncated": false}}'
 
     def successors(self, _id):
         """
         :param _id: id of the node whose successors you want
-        :return: immediate children of node _id (list of ids)
+        :return: immediate children of node _id (set of ids)
         """
-        return self.db.get_from_set(str(_id) + ".children")
+        return next(iter(self.adjacency_sets([_id])))[2]
 
     def predecessors(self, _id):
         """
         :param _id: id of the node whose predecessors you want
-        :return: immediate parents of node _id (list of ids)
+        :return: immediate parents of node _id (set of ids)
         """
-        return self.db.get_from_set(str(_id) + ".parents")
+        return next(iter(self.adjacency_sets([_id])))[1]
 
     def neighbor_ids(self, _id: int):
         """
         :param _id: id of node to list neighbors of
         :return: list of neighbors of node 'id'. includes the node itself along with successors and predecessors.
         """
-        return [_id, *self.successors(_id), *self.predecessors(_id)]
+        _, parents, children = next(iter(self.adjacency_sets([_id])))
+        return [_id, *children, *parents]
 
     def add_node(self, type="default", title="", content="", tags="", parent=0) -> int:
         """
@@ -142,22 +970,11 @@ class GraphManager:
         :param parent: parent of this node
         :return: new node's id
         """
-        _id = self.next_id
-
-        current_time = get_current_time()
-        attrs = {"type": "concept" if type == "root" and _id != 0 else type,
-                 "title": title,
-                 "content": content,
-                 "tags": tags,
-                 "id": _id,
-                 "created": current_time,
-                 "last_modified": current_time,
-                 }
-
-        # add node to database
-        self.db.set_attrs(_id, attrs)
-        self.db.incr("next_id")
-        self.link_nodes(parent, _id)
+        # add node to database and link it to its parent. see GRAPH_LUA's add_node for the attributes it sets
+        _id, changes = self._add_node_script(type, title, content, tags, parent,
+                                             self.layout.encode_time(get_current_time()))
+        _id = int(_id)
+        self._apply_changes(changes)
 
         # if updating these, also update solr schema and self.reindex and self.set_node_attr
         search_attrs = {"type": "concept" if type == "root" and _id != 0 else type,
@@ -167,55 +984,41 @@ class GraphManager:
                         "id": _id}
         # add node to search index
         self.db.add_search_index(search_attrs)
+        if self.suggest_index is not None:
+            self.suggest_index.set_title(_id, title)
         return _id
 
     def remove_node(self, _id: int):
-        # remove all links to and from this node and add it to a "deleted" set in the db.
-        # make sure the deleted node isn't automatically linked as a child of the root node.
-        # when adding a new node, first check if there are any in the "deleted" set that
-        # can be repurposed.
-        # also, remember to remove this node's solr search index
-        raise NotImplementedError("Function \"GraphManager.delete_node(self, _id)\" not implemented")
-
-        if not self.db.exists(_id):
-            return False
+        """
+        removes a node and all of its edges. children that are left without parents are linked to the root. the
+        node's id is used again by a later add_node.
 
-        if _id == 0:
+        :param _id: id of node to remove
+        :return: True if the node was removed, False if it doesn't exist
+        """
+        if int(_id) == 0:
             raise ValueError("Cannot delete root node (node ID 0).")
 
-        for n in self.predecessors(_id):
-            self.unlink_nodes(n, _id)
-
-        for n in self.successors(_id):
-            self.unlink_nodes(_id, n)
-            # todo: if successor has no other links, link it to root
+        # unlinks, deletes, and frees the id in one atomic script, see GRAPH_LUA's remove_node
+        status, changes = self._remove_node_script(_id)
+        if status == 1:
+            return False
+        self._apply_changes(changes)
 
-        # things like e.g. self.nodes rely on nodes not being deletable. so it stays in the db, just unlinked
-        # self.db.delete(_id)
+        self.db.delete_search_index(_id)
+        if self.node_cache is not None:
+            self.node_cache.invalidate(_id)
+        if self.suggest_index is not None:
+            self.suggest_index.remove(_id)
+        return True
 
     def has_link(self, parent: int, child: int):
-        # todo: make get_from_set return ints instead of strings. needing to convert child to a
-        #  string is a database implementation detail, shouldn't be necessary to consider it here
-        #  same thing with self.next_id needing to convert str to int
-        return str(child) in self.db.get_from_set(str(parent) + ".children")
+        return int(child) in self.successors(parent)
 
     def link_nodes(self, parent: int, child: int, two_way: bool = False):
-        # removal of edge to root node has to happen first
-        # in case someone calls link_nodes with the root node
-
-        def add_edge(_from, _to):
-            self.db.add_to_set(str(_to) + ".parents", _from)
-            self.db.add_to_set(str(_from) + ".children", _to)
-
-        # todo: make sure parent and child are valid nodes
-
-        add_edge(parent, child)
-
-        if parent != 0:
-            self.unlink_nodes(0, child)  # unlink_nodes won't error if this link doesn't exist
-
-        if two_way:
-            add_edge(child, parent)
+        # the edge to the root node is removed in the same script, see GRAPH_LUA's link_nodes. the script fails if
+        # either node doesn't exist
+        self._apply_changes(self._link_nodes_script(parent, child, int(two_way)))
 
         # later, this function will also add edge type attributes based on the type of the parent and child.
         # will have to make sure to update edge type when node types are updated in self.set_node_attr()
@@ -229,22 +1032,11 @@ class GraphManager:
         if parent == 0 and child == 0:
             raise ValueError("Cannot unlink node 0 from node 0.")
 
-        # todo: if child has no other links, link it to root. same thing for two_way
-        def remove_edge(_from, _to):
-            self.db.remove_from_set(str(_to) + ".parents", _from)
-            self.db.remove_from_set(str(_from) + ".children", _to)
-
-        # todo: make sure parent and child are valid nodes
+        # todo: if parent has no other links after a two_way unlink, link it to root too
 
-        if self.has_link(parent, child):
-            remove_edge(parent, child)
-
-        if two_way and self.has_link(child, parent):
-            remove_edge(child, parent)
-
-        # link to root if no other links exist
-        if len(self.predecessors(child)) == 0:
-            self.link_nodes(0, child)
+        # removes the edge(s) and links child to root if no other links exist, all in one atomic script. the script
+        # fails if either node doesn't exist
+        self._apply_changes(self._unlink_nodes_script(parent, child, int(two_way)))
 
     def set_node_attr(self, _id, attr, val):
         """
@@ -253,68 +1045,624 @@ class GraphManager:
         :param val: value to set the attribute to
         :return: id of updated node
         """
+        searchable = GraphManager._check_attr(_id, attr, val, "set_node_attr")
+
+        # checks that the node and attribute exist, then sets it along with last_modified
+        status, changes = self._set_node_attr_script(_id, attr, val, self.layout.encode_time(get_current_time()),
+                                                     int(searchable))
+        if status == 1:
+            raise ValueError(f"set_node_attr: node {_id} does not exist.")
+        if status == 2:
+            # todo: make this check against a list of allowed attributes instead?
+            raise ValueError(f"set_node_attr: attribute '{attr}' does not exist in node '{_id}'.")
+        self._apply_changes(changes)
+        if self.node_cache is not None:
+            self.node_cache.invalidate(_id)
+        if attr == "title" and self.suggest_index is not None:
+            self.suggest_index.set_title(_id, val)
+
+        if searchable:
+            self.db.update_search_index(_id, {attr: val})
+
+        return _id
+
+    MAX_BATCH_SIZE = 1000  # max number of operations in one batch
+
+    def batch(self, ops: List[Dict[str, Any]]) -> List[Any]:
+        """
+        does many add, update, link, and unlink operations in one atomic script, so they cost one round trip and
+        other clients never see only some of them. if any operation is invalid, none of them are done.
+
+        operations are dicts like {"op": "add", "type": ..., "title": ..., "content": ..., "tags": ...,
+        "parent": ...}, {"op": "update", "id": ..., "attr": ..., "val": ...}, {"op": "link", "parent": ...,
+        "child": ..., "two-way": ...}, or {"op": "unlink", ...} with the same keys as link. update needs "val", a
+        string or number. missing keys have the same defaults as the api's add, link, and unlink, and "two-way" can
+        be a bool or "true"/"false" like there. ids can be "$i" to use the id of the node added or updated by
+        operation i of the same batch, which must come earlier.
+
+        :param ops: list of operations
+        :return: list with each operation's result: the node id for add and update, None for link and unlink
+        """
+        if not isinstance(ops, list):
+            raise TypeError("batch: operations must be a list.")
+        if len(ops) > GraphManager.MAX_BATCH_SIZE:
+            raise ValueError(f"batch: more than {GraphManager.MAX_BATCH_SIZE} operations.")
+
+        def node_ref(op, k, default=0) -> str:
+            v = str(op.get(k, default))
+            return v if v.startswith("$") else str(int(v))
+
+        def flag(op, k) -> bool:
+            # same as the api's query arguments, see api.apply_func
+            v = op.get(k, False)
+            return v if isinstance(v, bool) else str(v).lower() == "true"
+
+        script_ops = []
+        for i, op in enumerate(ops):
+            kind = op.get("op") if isinstance(op, dict) else None
+            try:
+                if kind == "add":
+                    script_ops.append({"op": kind, "type": str(op.get("type", "comment")),
+                                       "title": str(op.get("title", "Untitled")), "content": str(op.get("content", "")),
+                                       "tags": str(op.get("tags", "")), "parent": node_ref(op, "parent")})
+                elif kind == "update":
+                    _id = node_ref(op, "id")
+                    if "val" not in op:
+                        raise ValueError("update needs a val.")
+                    searchable = GraphManager._check_attr(int(_id) if _id.isdigit() else _id, op.get("attr"),
+                                                          op.get("val"))
+                    script_ops.append({"op": kind, "id": _id, "attr": str(op["attr"]), "val": str(op["val"]),
+                                       "searchable": searchable})
+                elif kind in ["link", "unlink"]:
+                    parent, child = node_ref(op, "parent"), node_ref(op, "child")
+                    if kind == "unlink" and parent == "0" and child == "0":
+                        raise ValueError("Cannot unlink node 0 from node 0.")
+                    script_ops.append({"op": kind, "parent": parent, "child": child,
+                                       "two_way": flag(op, "two-way")})
+                else:
+                    raise ValueError(f"unknown operation {kind}, must be add, update, link, or unlink.")
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"batch: operation {i}: {str(e)}")
+
+        if not script_ops:
+            return []
+        ok, res, changes = self._batch_script(json.dumps(script_ops), self.layout.encode_time(get_current_time()))
+        if not ok:
+            raise ValueError(f"batch: operation {res}: {changes}.")
+        self._apply_changes(changes)
+
+        ret = []
+        for op, _id in zip(script_ops, res):
+            _id = int(_id) if _id else None
+            ret.append(_id)
+            # one search index change per node, since the queue merges changes to the same id
+            if op["op"] == "add":
+                # if updating these, also update in self.add_node
+                self.db.add_search_index({"type": "concept" if op["type"] == "root" and _id != 0 else op["type"],
+                                          "title": op["title"], "content": op["content"], "tags": op["tags"],
+                                          "id": _id})
+                if self.suggest_index is not None:
+                    self.suggest_index.set_title(_id, op["title"])
+            elif op["op"] == "update":
+                if self.node_cache is not None:
+                    self.node_cache.invalidate(_id)
+                if op["attr"] == "title" and self.suggest_index is not None:
+                    self.suggest_index.set_title(_id, op["val"])
+                if op["searchable"]:
+                    self.db.update_search_index(_id, {op["attr"]: op["val"]})
+        return ret
+
+    @staticmethod
+    def _check_attr(_id, attr, val, caller: str = None) -> bool:
+        """
+        checks the rules for setting an attribute that don't need to read the node
+
+        :param caller: name of the function, for error messages
+        :return: True if the attribute is in the search index
+        """
+        prefix = f"{caller}: " if caller else ""
         # todo: louder error handling. return a message
         if attr is None:
-            raise TypeError("set_node_attr: attr must not be None.")
+            raise TypeError(f"{prefix}attr must not be None.")
 
         unchangeable = ["id", "created", "last_modified"]
         if attr in unchangeable:
-            raise ValueError(f'set_node_attr: cannot set attributes {unchangeable}.')
+            raise ValueError(f'{prefix}cannot set attributes {unchangeable}.')
 
-        # make sure the node isn't the root and exists. relies on nodes not being deletable.
+        # make sure the node isn't the root
         if _id == 0:
-            raise ValueError("set_node_attr: cannot set root node's attributes (node id 0).")
+            raise ValueError(f"{prefix}cannot set root node's attributes (node id 0).")
 
-        if attr == "type" and val == "root":
-            raise ValueError("set_node_attr: cannot set node's 'type' attribute to 'root'")
+        if val is None or isinstance(val, bool) or not isinstance(val, (str, int, float)):
+            raise TypeError(f"{prefix}val must be a string or number, not {type(val).__name__}.")
 
-        if _id >= self.next_id:
-            raise ValueError(f"set_node_attr: node {_id} does not exist.")
+        if attr == "type" and val == "root":
+            raise ValueError(f"{prefix}cannot set node's 'type' attribute to 'root'")
 
-        if not self.db.has_attr(_id, attr):
-            # todo: make this check against a list of allowed attributes instead?
-            raise ValueError(f"set_node_attr: attribute '{attr}' does not exist in node '{_id}'.")
+        # if updating these, also update in self.add_node and self.reindex
+        return attr in ["title", "type", "content", "tags"]  # probably shouldn't hardcode this,
+        # should get list of allowed attributes from the database instead
 
-        self.db.set_attr(_id, attr, val)
-        self.db.set_attr(_id, "last_modified", get_current_time())
+    MAX_SEARCH_ROWS = 1000  # max "rows" for search
 
-        # if updating these, also update in self.add_node and self.reindex
-        if attr in ["title", "type", "content", "tags"]:  # probably shouldn't hardcode this,
-            # should get list of allowed attributes from the database instead
-            self.db.update_search_index(_id, {attr: val})
+    def suggest(self, prefix: str, count: int = 10) -> str:
+        """
+        titles that start with prefix, or that have a word that starts with it, from memory instead of solr
 
-        return _id
+        :param prefix: text typed so far
+        :param count: max number of results, capped at MAX_LIST_SIZE
+        :return: json list of dicts {"id": x, "title": y}
+        """
+        if self.suggest_index is None:
+            raise ValueError("suggest: the suggest index isn't enabled, see GraphManager.__init__.")
+        return nodecache.dumps(self.suggest_index.suggest(prefix, max(0, min(count, GraphManager.MAX_LIST_SIZE))))
 
-    def search(self, query):
+    def search(self, query, rows: int = 10, _type: str = None, cursor: str = None):
         """
         :param query: search query
-        :return: list of dicts {"id": x, "title": y} of some nodes that match the query
+        :param rows: max number of results, capped at MAX_SEARCH_ROWS
+        :param _type: if given, only nodes with this type are returned
+        :param cursor: None for the first page in the old format, "*" for the first page with a cursor for the next
+         one, or the "next" cursor of the previous page
+        :return: without a cursor, json list of dicts {"id": x, "title": y} of some nodes that match the query.
+         with a cursor, json with "results", that list, and "next", the cursor for the next page or null if this is
+         the last one.
         """
-        res = self.db.search_query(query)
+        rows = max(0, min(rows, GraphManager.MAX_SEARCH_ROWS))
+        if self.search_cache is None:
+            return self._search(query, rows, _type, cursor)
+
+        start = time.perf_counter()
+        # read before searching, so a write during the search makes this result too old to be cached
+        generation = int(self.db.get_val(GraphManager.INDEX_GENERATION_KEY) or 0)
+        key = (query, rows, _type, cursor)
+        res = self.search_cache.get(key, generation)
+        hit = res is not None
+        if not hit:
+            res = self._search(query, rows, _type, cursor)
+            self.search_cache.put(key, generation, res)
+        self.search_cache.record(hit, time.perf_counter() - start)
+        return res
+
+    def _search(self, query, rows: int, _type: str, cursor: str):
+        filters = []
+        if _type:
+            # quoted so that the type can't change the query. a filter instead of part of the query, so solr
+            # caches the matching documents for every search with the same type
+            filters.append('type:"' + _type.replace("\\", "\\\\").replace('"', '\\"') + '"')
+        docs, next_cursor = self.db.search_query(query, rows, filters, cursor or "*")
         ret = []
-        for doc in res:
-            # remove "_version_", use str title instead of list
-            ret.append({"id": doc["id"], "title": doc["title"][0]})
-        # if we want to make a "get more results" thing, use res["numFound"] and res["start"]
-        return json.dumps(ret)  # json.dumps should probably be in api.py
+        for doc in docs:
+            # use str title instead of list
+            title = doc["title"][0] if isinstance(doc["title"], list) else doc["title"]
+            ret.append({"id": doc["id"], "title": title})
+        if cursor is None:
+            return json.dumps(ret)  # json.dumps should probably be in api.py
+        return json.dumps({"results": ret, "next": next_cursor})
+
+    REINDEX_BATCH_SIZE = 500  # nodes per solr request in reindex
+    REINDEX_WORKERS = 4  # solr requests sent at the same time by reindex
+    REINDEX_CHECKPOINT_KEY = "reindex_checkpoint"  # every node before this id has been sent to solr
+    REINDEX_FAILED_KEY = "reindex_failed"  # set of ids that couldn't be indexed
 
-    def reindex(self):
+    MAX_CHANGES = 1000  # max number of change stream entries read by changes_json
+
+    def _changes(self, since: str, count: int = MAX_CHANGES) -> Tuple[str, str, bool]:
+        """
+        :return: (json, next, changed) for changes_json. next is the "next" attribute. changed is False if there
+         were no changes to list.
+        """
+        key = GraphManager.CHANGE_STREAM_KEY
+        if since != "0" and "-" not in since:
+            # a timestamp. starts after the last entry from before it
+            before = self.db.stream_range(key, str(int(float(since) * 1000)), 1, reverse=True)
+            since = before[0][0] if before else "0"
+        # the entry with id since is read too, to check that it hasn't been trimmed from the stream. one more than
+        # count is read to tell if there are more
+        entries = self.db.stream_range(key, since, count + 1 if since == "0" else count + 2)
+        if since == "0":
+            # the stream only has every change if it still has the entry that ADD_NODE_LUA adds when the graph is
+            # created. graphs from before the change stream, or with the start trimmed off, don't have it
+            reset = not entries or entries[0][1].get("start") != "1"
+        else:
+            reset = not entries or entries[0][0] != since
+            entries = entries[1:]
+        more = len(entries) > count
+        entries = entries[:count]
+
+        nodes = {}  # node id -> True if it was changed last, False if it was removed. in the order they changed
+        edges = {}  # (parent, child) -> True if the last change added it
+        for _, fields in entries:
+            for n in fields["nodes"].split():
+                nodes[int(n)] = True
+            for n in fields.get("removed", "").split():
+                nodes[int(n)] = False
+            if fields["edges"]:
+                _, changes = adjacency.parse_changes(f"{fields['version']} {fields['edges']}")
+                if changes is None:
+                    reset = True
+                    break
+                for added, parent, child in changes:
+                    edges[(parent, child)] = added
+        if reset:
+            latest = self.db.stream_range(key, "+", 1, reverse=True)
+            next_id = latest[0][0] if latest else "0"
+            return f'{{"nodes": [], "removed_nodes": [], "added_edges": [], "removed_edges": [], ' \
+                   f'"next": "{next_id}", "more": false, "reset": true}}', next_id, True
+
+        next_id = entries[-1][0] if entries else since
+        fragments = "[" + ", ".join(self.nodes_fragments(n for n, changed in nodes.items() if changed)) + "]"
+        removed_nodes = [n for n, changed in nodes.items() if not changed]
+        added_edges = [[p, c] for (p, c), added in edges.items() if added]
+        removed_edges = [[p, c] for (p, c), added in edges.items() if not added]
+        return f'{{"nodes": {fragments}, "removed_nodes": {nodecache.dumps(removed_nodes)}, ' \
+               f'"added_edges": {nodecache.dumps(added_edges)}, ' \
+               f'"removed_edges": {nodecache.dumps(removed_edges)}, "next": "{next_id}", ' \
+               f'"more": {"true" if more else "false"}, "reset": false}}', next_id, bool(entries)
+
+    def changes_json(self, since: str, count: int = MAX_CHANGES) -> str:
+        """
+        what changed in the graph after a point in time, so clients can keep a copy of the graph up to date without
+        getting all of it again. every graph script adds an entry with the ids of the nodes it changed and the
+        edges it added or removed to a redis stream, so this only reads the entries after since.
+
+        :param since: id of a change stream entry, like the "next" attribute of an earlier result, or a UNIX
+         timestamp. "0" for every change since the graph was created.
+        :param count: max number of change stream entries to read, capped at MAX_CHANGES
+        :return: string json with "nodes", "removed_nodes", "added_edges", "removed_edges", "next", "more", and
+         "reset" attributes. "nodes" are the current data objects of the nodes that changed, and "removed_nodes" are
+         the ids of the nodes that were removed. a node is only in the one that happened last, since removed ids
+         are used again. an edge that was added and then removed is only in "removed_edges", and the other way
+         around. "next" is the since for the next call. "more" is true if there are more changes after "next".
+         "reset" is true if the changes can't be listed, because they're too old and have been trimmed from the
+         stream, the graph was created before there was a change stream, or the graph was changed without the
+         graph scripts, like by import_ndjson. the client has to get
+         the whole graph again then, and continue from "next".
+        """
+        return self._changes(since, max(1, min(count, GraphManager.MAX_CHANGES)))[0]
+
+    WATCH_STOP_SECONDS = 1.0  # max seconds between checks of watch_changes's stop event
+
+    def watch_changes(self, since: str = None, max_seconds: float = 300, wait_seconds: float = 15,
+                      stop: threading.Event = None) -> Iterable[str]:
+        """
+        changes as they happen, as server-sent events. each event's data is a changes_json result and its id is
+        that result's "next", so EventSource clients that reconnect continue where they stopped.
+
+        :param since: see changes_json. if None, starts with changes from after this call.
+        :param max_seconds: stops after about this many seconds. EventSource clients reconnect by themselves.
+        :param wait_seconds: sends a comment line after this many seconds without changes, so proxies and clients
+         don't time out the connection
+        :param stop: stops within about WATCH_STOP_SECONDS after this is set, like when the server shuts down
+        :return: generator of events
+        """
+        deadline = time.monotonic() + max_seconds
+        if since is None:
+            latest = self.db.stream_range(GraphManager.CHANGE_STREAM_KEY, "+", 1, reverse=True)
+            since = latest[0][0] if latest else "0"
+        yield "retry: 1000\n\n"
+        while True:
+            data, since, changed = self._changes(since)
+            if changed:
+                yield f"id: {since}\ndata: {data}\n\n"
+            # waits in short steps, so the stop event is noticed. since is a stream id now, or "0" if the stream is
+            # empty
+            quiet_since = time.monotonic()
+            while True:
+                now = time.monotonic()
+                if now >= deadline or (stop is not None and stop.is_set()):
+                    return
+                if now - quiet_since >= wait_seconds:
+                    yield ": no changes\n\n"
+                    quiet_since = now
+                timeout = min(GraphManager.WATCH_STOP_SECONDS, deadline - now, quiet_since + wait_seconds - now)
+                if self.db.stream_wait(GraphManager.CHANGE_STREAM_KEY, since if since != "0" else "0-0", timeout):
+                    break
+
+    def version_tag(self) -> str:
+        """
+        :return: string that changes whenever the graph or the search index changes. used for etags.
+        """
+        graph_version, index_generation = self.db.get_vals([GraphManager.GRAPH_VERSION_KEY,
+                                                            GraphManager.INDEX_GENERATION_KEY])
+        return f"{graph_version or 0}-{index_generation or 0}"
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with the stats of the adjacency cache, reachability index, search cache, node cache, suggest
+         index, and search index queue. caches that aren't enabled are None.
+        """
+        return {"adjacency_cache": None if self.adjacency_cache is None else self.adjacency_cache.stats(),
+                "reachability_index": self.reachability_index.stats(),
+                "search_cache": None if self.search_cache is None else self.search_cache.stats(),
+                "node_cache": None if self.node_cache is None else self.node_cache.stats(),
+                "suggest_index": None if self.suggest_index is None else self.suggest_index.stats(),
+                "index_queue": self.db.index_queue.stats()}
+
+    def reindex(self, batch_size: int = REINDEX_BATCH_SIZE, workers: int = REINDEX_WORKERS, restart: bool = False,
+                progress: Callable[[int, int, float], None] = None) -> Dict[str, Any]:
         """
         will add all nodes to the search index. before you use this, make sure the search index data
         has been cleared from solr manually.
 
-        :return: none
+        nodes are read from redis in pipelined chunks and sent to solr in batches by a pool of worker threads, with
+        one commit at the end. removed nodes are skipped using the live node bitmap, see live_ids. progress is saved in
+        redis after each batch, so if reindexing is interrupted, the next
+        call continues where it stopped.
+
+        :param batch_size: number of nodes per redis read and solr request
+        :param workers: number of solr requests to send at the same time
+        :param restart: if True, ignores saved progress from an interrupted reindex and starts from node 0
+        :param progress: called after each batch with (nodes done, total nodes, seconds since start)
+        :return: dict with "indexed" (number of nodes sent this run), "failed" (sorted list of ids that couldn't be
+         indexed, including ones from interrupted earlier runs), and "seconds"
         """
-        for n in self.nodes:
-            try:
-                ndat = self.db.get_attrs(n)
-                sdat = {  # if updating these, also update in self.add_node and self.set_node_attr
-                    "id": n,
-                    "title": ndat["title"],
-                    "type": ndat["type"],
-                    "content": ndat["content"],
-                    "tags": ndat["tags"]
-                }
-                self.db.add_search_index(sdat)
-            except Exception as e:
-                print(f"GraphManager.reindex(): Failed to index node {n}.")
+        if restart:
+            self.db.delete(GraphManager.REINDEX_CHECKPOINT_KEY)
+
+        start_time = time.monotonic()
+        total = self.next_id
+        start = int(self.db.get_val(GraphManager.REINDEX_CHECKPOINT_KEY) or 0)
+        if start == 0:
+            self.db.delete(GraphManager.REINDEX_FAILED_KEY)
+        done = start
+        indexed = 0
+        # first id of batch -> (ids in the batch, future of its solr request), in order of first id
+        running: Dict[int, Tuple[List[int], Future]] = {}
+
+        def send(docs):
+            self.db.add_search_index_now(docs)
+            return len(docs)
+
+        def finish_batches(wait_for_all: bool):
+            # saves progress up to the first batch that's still running
+            nonlocal done, indexed
+            while running:
+                batch_start, (batch_ids, future) = next(iter(running.items()))
+                if not wait_for_all and not future.done() and len(running) < workers * 2:
+                    break
+                del running[batch_start]
+                try:
+                    indexed += future.result()
+                except Exception as e:
+                    print(f"GraphManager.reindex(): Failed to index nodes {batch_ids[0]} to {batch_ids[-1]}: {str(e)}")
+                    self.db.add_to_set(GraphManager.REINDEX_FAILED_KEY, *batch_ids)
+                done = batch_ids[-1] + 1
+                self.db.set_val(GraphManager.REINDEX_CHECKPOINT_KEY, done)
+                if progress is not None:
+                    progress(done, total, time.monotonic() - start_time)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk in database.chunked(self.live_ids(start, total), batch_size):
+                docs = []
+                for n, ndat in zip(chunk, self.db.get_attrs_many(chunk)):
+                    if not ndat:
+                        continue  # missing node
+                    try:
+                        sdat = {  # if updating these, also update in self.add_node and self.set_node_attr
+                            "id": n,
+                            "title": ndat["title"],
+                            "type": ndat["type"],
+                            "content": ndat["content"],
+                            "tags": ndat["tags"]
+                        }
+                        docs.append(sdat)
+                    except Exception as e:
+                        print(f"GraphManager.reindex(): Failed to index node {n}: {str(e)}")
+                        self.db.add_to_set(GraphManager.REINDEX_FAILED_KEY, n)
+
+                running[chunk[0]] = (chunk, executor.submit(send, docs))
+                finish_batches(False)  # also limits how many batches are waiting in memory
+            finish_batches(True)
+
+        self.db.commit_search_index()
+        self.db.delete(GraphManager.REINDEX_CHECKPOINT_KEY)  # finished, so the next reindex starts over
+        failed = sorted(self.db.get_from_set(GraphManager.REINDEX_FAILED_KEY))
+        return {"indexed": indexed, "failed": failed, "seconds": time.monotonic() - start_time}
+
+    MIGRATE_BATCH_SIZE = 1000  # nodes per script call in migrate_layout
+
+    def migrate_layout(self, name: str, batch_size: int = MIGRATE_BATCH_SIZE,
+                       progress: Callable[[int, int, float], None] = None) -> Dict[str, Any]:
+        """
+        converts the graph to another redis key layout, see layout.Layout. nodes are converted in batches of one
+        script call each, so other clients never see a half-converted node, and redis can answer other clients
+        between batches. progress is saved in redis after each batch, so if the migration is interrupted, the next
+        call continues where it stopped.
+
+        while migrating, every graph script fails, so nothing is written in the old layout. processes that still use
+        the old layout can't read converted nodes, so restart them with the new layout when this is done.
+
+        :param name: name of the layout to convert to, see layout.LAYOUTS
+        :param batch_size: number of nodes per script call
+        :param progress: called after each batch with (nodes done, total nodes, seconds since start)
+        :return: dict with "nodes" (number of nodes converted this run), "seconds", "memory_before", and
+         "memory_after". the memory values are bytes used by redis, see Database.memory_used.
+        """
+        if name not in layout.LAYOUTS:
+            raise ValueError(f"migrate_layout: unknown layout '{name}', must be one of {list(layout.LAYOUTS)}.")
+        target = layout.LAYOUTS[name]
+
+        stored = self.db.get_val(layout.LAYOUT_KEY)
+        if ">" in stored:
+            source_name, target_name = stored.split(">")
+            if target_name != name:
+                raise ValueError(f"migrate_layout: an earlier migration to '{target_name}' isn't finished yet.")
+        else:
+            source_name = stored
+            if source_name != name:
+                self.db.delete(layout.MIGRATION_CHECKPOINT_KEY)
+                self.db.set_val(layout.LAYOUT_KEY, f"{source_name}>{name}")
+        source = layout.LAYOUTS[source_name]
+
+        start_time = time.monotonic()
+        memory_before = self.db.memory_used()
+        migrated = 0
+        if source is not target:
+            # before converting, so converted keys get the target layout's encodings
+            self.db.configure(target.redis_config)
+            script = self.db.register_script(layout.MIGRATE_LAYOUT_LUA)
+            total = self.next_id
+            start = int(self.db.get_val(layout.MIGRATION_CHECKPOINT_KEY) or 0)
+            for chunk in database.chunked(range(start, total), batch_size):
+                script(*layout.migrate_args(source, target, chunk[-1] + 1, chunk))
+                migrated += len(chunk)
+                if progress is not None:
+                    progress(chunk[-1] + 1, total, time.monotonic() - start_time)
+
+            self.db.set_val(layout.LAYOUT_KEY, name)
+            self.db.delete(layout.MIGRATION_CHECKPOINT_KEY)
+
+        self.layout = target
+        self._register_scripts()
+        if self.adjacency_cache is not None:
+            self.adjacency_cache.layout = target
+        return {"nodes": migrated, "seconds": time.monotonic() - start_time,
+                "memory_before": memory_before, "memory_after": self.db.memory_used()}
+
+    EXPORT_FORMAT = 1  # version of the export_ndjson format
+    IMPORT_BATCH_SIZE = 5000  # lines per redis pipeline and solr request in import_ndjson
+
+    def export_ndjson(self) -> Iterable[str]:
+        """
+        the whole graph in the format that import_ndjson reads. a header line comes first, then the lines of
+        graph_ndjson for every node.
+
+        :return: generator of newline-delimited json strings. the first line is
+         {"graph": {"format": EXPORT_FORMAT, "max_id": highest node id}}
+        """
+        header = {"format": GraphManager.EXPORT_FORMAT, "max_id": self.next_id - 1}
+        yield json.dumps({"graph": header}) + "\n"
+        yield from self.graph_ndjson(self.nodes)
+
+    def import_ndjson(self, lines: Iterable[Union[str, bytes]], batch_size: int = IMPORT_BATCH_SIZE,
+                      progress: Callable[[int, int, float], None] = None) -> Dict[str, Any]:
+        """
+        adds a graph from export_ndjson to this graph. lines are read as they're needed, so the file doesn't have to
+        fit in memory.
+
+        ids for all of the file's nodes are reserved with one INCRBY, so the file's node i becomes node
+        first_id + i - 1. the file's root isn't added, its edges go to this graph's root instead. nodes and edges are
+        written with pipelines in batches, not through the graph scripts, so other clients can see a half-finished
+        import. nodes are sent to solr in batches with one commit at the end. ids that the file has no node for, from
+        nodes removed before the export, are added to the free id list, see add_node. edges to or from those ids
+        can't be checked until the whole file has been read, so they're written and then removed again at the end.
+
+        :param lines: lines of the file. str or bytes.
+        :param batch_size: number of lines per redis pipeline and solr request
+        :param progress: called after each batch with (lines done, max id in the file, seconds since start)
+        :return: dict with "nodes", "edges", "skipped_edges" (edges to or from ids that the file has no node for),
+         "first_id", and "seconds"
+        """
+        start_time = time.monotonic()
+        lines = (line for line in lines if line.strip())
+        header = json.loads(next(lines, "{}")).get("graph")
+        if header is None or header.get("format") != GraphManager.EXPORT_FORMAT:
+            raise ValueError(f"import_ndjson: the first line must be a format {GraphManager.EXPORT_FORMAT} "
+                             f"header, see export_ndjson.")
+        max_id = int(header["max_id"])
+
+        first_id = self.db.incr("next_id", max_id) - max_id if max_id > 0 else self.next_id
+        seen = bytearray(max_id + 1)  # 1 for file ids that had a node line
+        has_parent = bytearray(max_id + 1)  # 1 for file ids that are the child of an edge
+        has_edge = bytearray(max_id + 1)  # 1 for file ids that are the parent or child of an edge
+        now_seconds = get_current_time()
+        now = self.layout.encode_time(now_seconds)
+        nodes = 0
+        edges = 0
+        done = 0
+
+        def new_id(file_id) -> int:
+            file_id = int(file_id)
+            if not 0 <= file_id <= max_id:
+                raise ValueError(f"import_ndjson: node id {file_id} is more than the header's max_id.")
+            return 0 if file_id == 0 else first_id + file_id - 1
+
+        for chunk in database.chunked(lines, batch_size):
+            hashes = []
+            sets: Dict[str, List[int]] = {}
+            last_modified = {}
+            live = []
+            docs = []
+            for line in chunk:
+                item = json.loads(line)
+                if "node" in item:
+                    n = item["node"]
+                    file_id = int(n["id"])
+                    _id = new_id(file_id)
+                    if _id == 0:
+                        continue  # this graph already has a root
+                    seen[file_id] = 1
+                    attrs = {k: v for k, v in n.items() if k not in ["id", "created", "last_modified"]}
+                    if attrs.get("type") == "root":
+                        attrs["type"] = "concept"
+                    if self.layout.store_id:
+                        attrs["id"] = _id
+                    for k in ["created", "last_modified"]:
+                        attrs[k] = self.layout.encode_time(float(n[k])) if k in n else now
+                    hashes.append((str(_id), attrs))
+                    last_modified[_id] = float(n.get("last_modified", now_seconds))
+                    live.append(_id)
+                    # if updating these, also update in self.add_node and self.reindex
+                    docs.append({"id": _id, "title": attrs.get("title", ""), "type": attrs.get("type", ""),
+                                 "content": attrs.get("content", ""), "tags": attrs.get("tags", "")})
+                    if self.suggest_index is not None:
+                        self.suggest_index.set_title(_id, attrs.get("title", ""))
+                    nodes += 1
+                elif "edge" in item:
+                    file_parent, file_child = item["edge"]
+                    parent, child = new_id(file_parent), new_id(file_child)
+                    has_parent[int(file_child)] = 1
+                    has_edge[int(file_parent)] = has_edge[int(file_child)] = 1
+                    sets.setdefault(self.layout.parents_key(child), []).append(parent)
+                    sets.setdefault(self.layout.children_key(parent), []).append(child)
+                    edges += 1
+                elif "graph" not in item:
+                    raise ValueError(f"import_ndjson: unknown line: {line[:100]}")
+
+            self.db.write_batch(hashes, sets.items(), [(GraphManager.LAST_MODIFIED_KEY, last_modified)],
+                                [(GraphManager.LIVE_NODES_KEY, live)])
+            self.db.add_search_index_now(docs)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, max_id, time.monotonic() - start_time)
+
+        # edges to ids without a node line. the ids were free before the import, so their sets only have these edges
+        missing = [first_id + i - 1 for i in range(1, max_id + 1) if has_edge[i] and not seen[i]]
+        skipped = set()
+        for chunk in database.chunked(missing, batch_size):
+            keys = [k for _id in chunk for k in (self.layout.parents_key(_id), self.layout.children_key(_id))]
+            sets = self.db.get_from_sets(keys)
+            removals = []
+            for i, _id in enumerate(chunk):
+                parents, children = sets[2 * i], sets[2 * i + 1]
+                skipped.update((p, _id) for p in parents)
+                skipped.update((_id, c) for c in children)
+                removals += [(self.layout.children_key(p), [_id]) for p in parents]
+                removals += [(self.layout.parents_key(c), [_id]) for c in children]
+                removals += [(self.layout.parents_key(_id), list(parents)),
+                             (self.layout.children_key(_id), list(children))]
+            self.db.remove_batch(removals)
+        edges -= len(skipped)
+        # children of skipped edges may have no parents left
+        children = sorted({c for p, c in skipped if c != 0 and first_id <= c < first_id + max_id})
+        for chunk in database.chunked(children, batch_size):
+            for c, parents in zip(chunk, self.db.get_from_sets(self.layout.parents_key(c) for c in chunk)):
+                if not parents:
+                    has_parent[c - first_id + 1] = 0
+
+        # every node other than the root needs a parent, see GRAPH_LUA's unlink_nodes
+        orphans = [first_id + i - 1 for i in range(1, max_id + 1) if seen[i] and not has_parent[i]]
+        for chunk in database.chunked(orphans, batch_size):
+            sets = [(self.layout.parents_key(_id), [0]) for _id in chunk]
+            self.db.write_batch([], sets + [(self.layout.children_key(0), chunk)])
+            edges += len(chunk)
+        unused = [first_id + i - 1 for i in range(1, max_id + 1) if not seen[i]]
+        for chunk in database.chunked(unused, batch_size):
+            self.db.add_to_list(GraphManager.FREE_IDS_KEY, *chunk)
+
+        self.db.commit_search_index()
+        self.db.incr(GraphManager.INDEX_GENERATION_KEY)
+        self._apply_changes(self._invalidate_script())
+        return {"nodes": nodes, "edges": edges, "skipped_edges": len(skipped), "first_id": first_id,
+                "seconds": time.monotonic() - start_time}
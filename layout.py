@@ -0,0 +1,155 @@
+from typing import Dict, Union
+
+
+class Layout:
+    """
+    how a node is stored in redis. every node has a hash with its attributes, stored under its id, and two sets
+    with the ids of its parents and children.
+
+    the classic layout is the original one. the compact layout leaves the id out of the hash since it's already
+    the key, stores times as integer milliseconds instead of float strings, uses shorter set key suffixes, and
+    tunes redis so that most hashes are stored as listpacks and most adjacency sets as intsets.
+    """
+
+    def __init__(self, name: str, parents_suffix: str, children_suffix: str, store_id: bool, time_scale: int,
+                 redis_config: Dict[str, int] = None):
+        """
+        :param name: name of the layout, stored in redis under LAYOUT_KEY
+        :param parents_suffix: added to a node's id to get the key of its parents set
+        :param children_suffix: added to a node's id to get the key of its children set
+        :param store_id: if True, node hashes have an "id" field
+        :param time_scale: "created" and "last_modified" are stored as UNIX time times this. 1 stores float
+         seconds, anything else stores integers.
+        :param redis_config: redis settings that this layout needs to be compact, see Database.configure
+        """
+        self.name = name
+        self.parents_suffix = parents_suffix
+        self.children_suffix = children_suffix
+        self.store_id = store_id
+        self.time_scale = time_scale
+        self.redis_config = redis_config or {}
+
+    def parents_key(self, _id) -> str:
+        return f"{_id}{self.parents_suffix}"
+
+    def children_key(self, _id) -> str:
+        return f"{_id}{self.children_suffix}"
+
+    def encode_time(self, t: float) -> Union[float, int]:
+        """
+        :param t: UNIX timestamp, see graphmanager.get_current_time
+        :return: value to store in redis
+        """
+        if self.time_scale == 1:
+            return t
+        return round(t * self.time_scale)
+
+    def decode_node(self, _id, attrs: Dict[str, str]) -> Dict[str, str]:
+        """
+        :param _id: id of the node
+        :param attrs: the node's hash. changed in place.
+        :return: attrs with the same fields and formats as the classic layout. missing nodes stay empty.
+        """
+        if not attrs or self.store_id:
+            return attrs
+        attrs["id"] = str(_id)
+        for k in ["created", "last_modified"]:
+            if k in attrs:
+                attrs[k] = str(int(attrs[k]) / self.time_scale)
+        return attrs
+
+    def lua_header(self) -> str:
+        """
+        :return: lua code that defines this layout's key suffixes for graphmanager.GRAPH_LUA. it also makes the
+         script fail if the graph has been migrated to another layout since the script was registered.
+        """
+        return f"""
+local PARENTS = '{self.parents_suffix}'
+local CHILDREN = '{self.children_suffix}'
+local STORE_ID = {'true' if self.store_id else 'false'}
+local TIME_SCALE = {self.time_scale}
+if redis.call('GET', '{LAYOUT_KEY}') ~= '{self.name}' then
+    return redis.error_reply('graph layout is not {self.name} anymore, restart with the current layout')
+end
+"""
+
+
+LAYOUT_KEY = "graph_layout"  # name of the layout that the graph is stored in. "a>b" while migrating from a to b
+MIGRATION_CHECKPOINT_KEY = "layout_migration_checkpoint"  # every node before this id has been migrated
+
+CLASSIC = Layout("classic", ".parents", ".children", True, 1)
+COMPACT = Layout("compact", ".p", ".c", False, 1000, {
+    # hashes with values up to this many bytes are stored as listpacks, which are much smaller than hash tables.
+    # the ziplist name works on both old and new redis versions
+    "hash-max-ziplist-value": 2048,
+    # sets of up to this many integers are stored as intsets, 4 bytes per id. adding to an intset moves
+    # everything after the new id, so this can't be too big either
+    "set-max-intset-entries": 8192,
+})
+LAYOUTS = {l.name: l for l in [CLASSIC, COMPACT]}
+DEFAULT = CLASSIC.name  # layout of new graphs if none is given. graphs without LAYOUT_KEY are classic
+
+# ARGV: from parents suffix, from children suffix, to parents suffix, to children suffix, to store_id (1 or 0),
+# time factor (to time_scale / from time_scale), integer times (1 or 0), next checkpoint, node ids...
+# rewrites each node's keys in the new layout. keys are deleted and written again instead of renamed, so redis picks
+# the smallest encoding for them under the current settings.
+MIGRATE_LAYOUT_LUA = """
+local factor = tonumber(ARGV[6])
+local integer_times = ARGV[7] == '1'
+
+local function convert_time(v)
+    if factor == 1 then
+        return v
+    end
+    local t = tonumber(v) * factor
+    if integer_times then
+        return string.format('%.0f', t)
+    end
+    return tostring(t)
+end
+
+local function move_set(from, to)
+    local members = redis.call('SMEMBERS', from)
+    redis.call('DEL', from)
+    -- lua can only unpack so many values at once
+    for i = 1, #members, 1000 do
+        redis.call('SADD', to, unpack(members, i, math.min(i + 999, #members)))
+    end
+end
+
+for i = 9, #ARGV do
+    local id = ARGV[i]
+    local attrs = redis.call('HGETALL', id)
+    if #attrs > 0 then
+        local fields = {}
+        for j = 1, #attrs, 2 do
+            local k, v = attrs[j], attrs[j + 1]
+            if k == 'created' or k == 'last_modified' then
+                v = convert_time(v)
+            end
+            if k ~= 'id' then
+                table.insert(fields, k)
+                table.insert(fields, v)
+            end
+        end
+        if ARGV[5] == '1' then
+            table.insert(fields, 'id')
+            table.insert(fields, id)
+        end
+        redis.call('DEL', id)
+        redis.call('HMSET', id, unpack(fields))
+    end
+    move_set(id .. ARGV[1], id .. ARGV[3])
+    move_set(id .. ARGV[2], id .. ARGV[4])
+end
+redis.call('SET', '""" + MIGRATION_CHECKPOINT_KEY + """', ARGV[8])
+"""
+
+
+def migrate_args(source: Layout, target: Layout, checkpoint: int, ids) -> list:
+    """
+    :return: ARGV for MIGRATE_LAYOUT_LUA
+    """
+    return [source.parents_suffix, source.children_suffix, target.parents_suffix, target.children_suffix,
+            int(target.store_id), target.time_scale / source.time_scale, int(target.time_scale != 1), checkpoint,
+            *ids]
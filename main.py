@@ -1,21 +1,123 @@
 from graphmanager import GraphManager
+from database import Database
 from api import GraphAPI
+import analytics
+import argparse
+import layout
 import threading
 
 
 def main():
-    g = GraphManager()
-    # to reindex solr search engine, call g.reindex() after deleting existing index
+    parser = argparse.ArgumentParser(description="concept-graph server")
+    parser.add_argument("--port", type=int, default=8080, help="port for the http server")
+    parser.add_argument("--workers", type=int, default=GraphAPI.WORKERS,
+                        help="number of requests the http server handles at the same time")
+    parser.add_argument("--watchers", type=int, default=GraphAPI.WATCHERS,
+                        help="number of watch-changes streams the http server keeps open at the same time, on top "
+                             "of --workers")
+    parser.add_argument("--redis-pool-size", type=int, default=Database.REDIS_POOL_SIZE,
+                        help="max number of redis connections. should be at least --workers plus --watchers plus "
+                             "4: the adjacency cache's and the reachability index's change listeners each keep one "
+                             "open, and the search index queue and reachability index rebuilds use one each")
+    parser.add_argument("--reindex", action="store_true",
+                        help="add every node to the solr search index, then exit. clear the index first. "
+                             "an interrupted reindex continues where it stopped")
+    parser.add_argument("--reindex-restart", action="store_true",
+                        help="with --reindex, start from the first node even if an earlier reindex was interrupted")
+    parser.add_argument("--reindex-batch-size", type=int, default=GraphManager.REINDEX_BATCH_SIZE,
+                        help="nodes per solr request for --reindex")
+    parser.add_argument("--reindex-workers", type=int, default=GraphManager.REINDEX_WORKERS,
+                        help="solr requests sent at the same time for --reindex")
+    parser.add_argument("--dev-reload", action="store_true",
+                        help="load web app files again when they change, instead of only at startup")
+    parser.add_argument("--adjacency-cache", action="store_true",
+                        help="keep all edges in memory to answer neighbor and edge queries without asking redis")
+    parser.add_argument("--no-suggest-index", action="store_true",
+                        help="don't load node titles into memory at startup. /suggest won't work without them")
+    parser.add_argument("--layout", choices=list(layout.LAYOUTS), default=None,
+                        help="redis key layout. new graphs are created in it, existing graphs must already use it. "
+                             f"default is the graph's current layout, or {layout.DEFAULT} for new graphs")
+    parser.add_argument("--migrate-layout", choices=list(layout.LAYOUTS), default=None,
+                        help="convert the graph to this redis key layout, then exit. stop other servers using the "
+                             "graph first. an interrupted migration continues where it stopped")
+    parser.add_argument("--migrate-batch-size", type=int, default=GraphManager.MIGRATE_BATCH_SIZE,
+                        help="nodes per redis script call for --migrate-layout")
+    parser.add_argument("--analytics", action="store_true",
+                        help="compute node importance, degrees, descendant counts, and depths, then exit. "
+                             "needs numpy. see analytics.py")
+    parser.add_argument("--export", metavar="FILE", default=None,
+                        help="write the whole graph to FILE as newline-delimited json, then exit")
+    parser.add_argument("--import", dest="import_file", metavar="FILE", default=None,
+                        help="add the graph in FILE, written by --export, to this graph, then exit")
+    parser.add_argument("--import-batch-size", type=int, default=GraphManager.IMPORT_BATCH_SIZE,
+                        help="lines per redis pipeline and solr request for --import")
+    parser.add_argument("--slow-request-ms", type=float, default=None,
+                        help="log requests that take at least this many milliseconds, with where the time went")
+    parser.add_argument("--slow-request-sample", type=float, default=1.0,
+                        help="fraction of slow requests to log, between 0 and 1")
+    args = parser.parse_args()
 
-    reindex = False
-    if reindex:
+    if args.migrate_layout:
+        g = GraphManager(Database(pool_size=args.redis_pool_size))
+    else:
+        serving = not (args.reindex or args.export or args.import_file or args.analytics)
+        g = GraphManager(Database(pool_size=args.redis_pool_size), adjacency_cache=args.adjacency_cache,
+                         layout_name=args.layout, suggest_index=serving and not args.no_suggest_index)
+    # to reindex solr search engine, run with --reindex after deleting existing index
+
+    def print_progress(done, total, seconds):
+        print(f"\r{done}/{total} nodes, {done / max(seconds, 0.001):.0f} nodes/s", end="")
+
+    if args.migrate_layout:
+        print(f"Migrating graph to layout {args.migrate_layout}...")
+        res = g.migrate_layout(args.migrate_layout, args.migrate_batch_size, print_progress)
+        g.db.close()
+        saved = res["memory_before"] - res["memory_after"]
+        print(f"\nDone migrating! Converted {res['nodes']} nodes in {res['seconds']:.1f} seconds. "
+              f"Redis memory: {res['memory_before'] / 2 ** 20:.1f} MiB before, {res['memory_after'] / 2 ** 20:.1f} MiB "
+              f"after ({saved / max(res['nodes'], 1):.0f} bytes saved per node).")
+    elif args.analytics:
+        print("Computing graph analytics...")
+        res = analytics.compute(g)
+        g.db.close()
+        print(f"Done! {res['nodes']} nodes and {res['edges']} edges. Loading took {res['load_seconds']:.1f} "
+              f"seconds, computing {res['compute_seconds']:.1f} seconds, storing {res['store_seconds']:.1f} seconds.")
+    elif args.export:
+        print(f"Exporting graph to {args.export}...")
+        with open(args.export, "w", encoding="utf-8") as f:
+            for chunk in g.export_ndjson():
+                f.write(chunk)
+        g.db.close()
+        print("Done exporting!")
+    elif args.import_file:
+        print(f"Importing graph from {args.import_file}...")
+        with open(args.import_file, "r", encoding="utf-8") as f:
+            res = g.import_ndjson(f, args.import_batch_size, print_progress)
+        g.db.close()
+        print(f"\nDone importing! Added {res['nodes']} nodes and {res['edges']} edges in {res['seconds']:.1f} "
+              f"seconds ({res['nodes'] / max(res['seconds'], 0.001):.0f} nodes/s). Imported nodes start at id "
+              f"{res['first_id']}.")
+    elif args.reindex:
         print("Reindexing solr...")
-        g.reindex()
-        print("Done reindexing!")
+        res = g.reindex(args.reindex_batch_size, args.reindex_workers, args.reindex_restart, print_progress)
+        g.db.close()
+        print(f"\nDone reindexing! Indexed {res['indexed']} nodes in {res['seconds']:.1f} seconds "
+              f"({res['indexed'] / max(res['seconds'], 0.001):.0f} nodes/s).")
+        if res["failed"]:
+            print(f"Failed to index {len(res['failed'])} nodes: {res['failed']}")
     else:
-        api = GraphAPI(g)
+        slow_seconds = args.slow_request_ms / 1000 if args.slow_request_ms is not None else None
+        api = GraphAPI(g, port=args.port, workers=args.workers, static_reload=args.dev_reload,
+                       slow_request_seconds=slow_seconds, slow_request_sample=args.slow_request_sample,
+                       watchers=args.watchers)
         t = threading.Thread(target=api.start_server)
         t.start()
+        try:
+            t.join()
+        finally:
+            # send queued search index changes before exiting
+            api.stop_server()
+            g.db.close()
 
 
 if __name__ == '__main__':
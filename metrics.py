@@ -0,0 +1,276 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Tuple, List, Callable, Any, Optional
+import redis
+
+# label name/value pairs, sorted by name
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def make_labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[Labels, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = make_labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        ret = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                ret.append(f"{self.name}{format_labels(labels)} {value}")
+        return ret
+
+
+class Histogram:
+    # seconds by default. byte sizes use SIZE_BUCKETS
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.values: Dict[Labels, list] = {}  # labels -> [count per bucket..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = make_labels(labels)
+        with self.lock:
+            v = self.values.get(key)
+            if v is None:
+                v = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i in range(len(self.buckets)):
+                if value <= self.buckets[i]:
+                    v[i] += 1
+            v[-2] += 1
+            v[-1] += value
+
+    def render(self) -> List[str]:
+        ret = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, v in sorted(self.values.items()):
+                for i in range(len(self.buckets)):
+                    le = 'le="%s"' % self.buckets[i]
+                    ret.append(f"{self.name}_bucket{format_labels(labels, le)} {v[i]}")
+                le = 'le="+Inf"'
+                ret.append(f"{self.name}_bucket{format_labels(labels, le)} {v[-2]}")
+                ret.append(f"{self.name}_count{format_labels(labels)} {v[-2]}")
+                ret.append(f"{self.name}_sum{format_labels(labels)} {v[-1]}")
+        return ret
+
+
+class Registry:
+    """
+    all metrics of this process, rendered in the prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+        self.collectors: List[Callable[[], Dict[str, float]]] = []
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, description: str) -> Counter:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, description)
+            return self.metrics[name]
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = Histogram.BUCKETS) -> Histogram:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, description, buckets)
+            return self.metrics[name]
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        """
+        :param collector: function that returns gauge names and their current values. called on every render.
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        lines = []
+        for m in metrics:
+            lines += m.render()
+        for collector in collectors:
+            for name, value in sorted(collector().items()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+DATABASE_CALLS = REGISTRY.histogram("database_call_seconds", "time spent in Database functions")
+REDIS_COMMANDS = REGISTRY.counter("redis_commands_total", "commands sent to redis")
+REDIS_ROUND_TRIPS = REGISTRY.histogram("redis_round_trip_seconds", "time spent waiting for redis replies")
+SOLR_REQUESTS = REGISTRY.histogram("solr_request_seconds", "time spent waiting for solr requests")
+
+# per-thread time spent in each stage of the request that the thread is handling, see start_stages
+_local = threading.local()
+
+
+def start_stages():
+    """
+    starts recording per-stage time for the current thread's request
+    """
+    _local.stages = {}
+
+
+def stop_stages() -> Dict[str, float]:
+    """
+    :return: seconds spent in each stage since start_stages
+    """
+    ret = getattr(_local, "stages", None) or {}
+    _local.stages = None
+    return ret
+
+
+def add_stage_time(stage: str, seconds: float):
+    stages = getattr(_local, "stages", None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """
+    times a block of code as a stage of the current request
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+
+def timed(func):
+    """
+    decorator that records a Database function's call count and time in database_call_seconds
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DATABASE_CALLS.observe(time.perf_counter() - start, method=func.__name__)
+    return wrapper
+
+
+class RedisCounter:
+    """
+    counts the commands and round trips that a redis client sends, and how long the round trips take. the counts
+    go to the global metrics and to this object, so that one client's counts can be read separately.
+    """
+
+    def __init__(self, client: redis.Redis):
+        self.commands = 0
+        self.round_trips = 0
+        self.lock = threading.Lock()
+
+        execute_command = client.execute_command
+        pipeline = client.pipeline
+
+        def counted_execute_command(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return execute_command(*args, **kwargs)
+            finally:
+                self.count(1, time.perf_counter() - start)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*e_args, **e_kwargs):
+                commands = len(pipe.command_stack)
+                start = time.perf_counter()
+                try:
+                    return execute(*e_args, **e_kwargs)
+                finally:
+                    self.count(commands, time.perf_counter() - start)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        client.execute_command = counted_execute_command
+        client.pipeline = counted_pipeline
+
+    def count(self, commands: int, seconds: float):
+        with self.lock:
+            self.commands += commands
+            self.round_trips += 1
+        REDIS_COMMANDS.inc(commands)
+        REDIS_ROUND_TRIPS.observe(seconds)
+        add_stage_time("redis", seconds)
+
+    def snapshot(self) -> Tuple[int, int]:
+        """
+        :return: (commands, round trips) so far
+        """
+        with self.lock:
+            return self.commands, self.round_trips
+
+
+def instrument_solr(solr: Any, methods: Tuple[str, ...] = ("add", "search", "delete", "commit")):
+    """
+    records the time of a solr client's requests in solr_request_seconds
+
+    :param solr: pysolr.Solr or something with the same functions
+    :param methods: names of the functions that make requests
+    """
+    for name in methods:
+        func = getattr(solr, name, None)
+        if func is None or getattr(func, "instrumented", False):
+            continue  # missing, or already instrumented by another Database using the same client
+
+        def timed_request(*args, _func=func, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                SOLR_REQUESTS.observe(seconds, method=_name)
+                add_stage_time("solr", seconds)
+
+        timed_request.instrumented = True
+        setattr(solr, name, timed_request)
+
+
+def flatten(prefix: str, stats: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    """
+    turns nested stats dicts like GraphManager.stats into gauge names and values. non-numbers are left out.
+
+    :param prefix: start of every gauge name
+    :param stats: stats dict
+    """
+    ret = {}
+    for k, v in (stats or {}).items():
+        name = f"{prefix}_{k}"
+        if isinstance(v, dict):
+            ret.update(flatten(name, v))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            ret[name] = v
+    return ret
@@ -0,0 +1,103 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # optional, json is used without it
+
+
+def dumps(obj: Any) -> str:
+    """
+    json.dumps, but with orjson if it's installed, which is several times faster. orjson leaves out the spaces
+    after separators.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
+
+
+class NodeJsonCache:
+    """
+    LRU cache of nodes' data objects, already serialized to json, so responses can be put together by joining
+    strings instead of reading and encoding every node again.
+
+    an entry is only used if the node's last_modified is still the same as when the entry was made. every write to
+    a node's attributes changes last_modified, so writes from other processes make entries stale too.
+    """
+    MAX_ENTRIES = 100000
+    MAX_BYTES = 64 * 1024 * 1024  # counts the length of the cached strings, not python's overhead
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries: OrderedDict[int, tuple] = OrderedDict()  # id -> (last_modified, json), oldest first
+        self.size = 0  # total length of cached json
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, ids: List, versions: List[Optional[str]]) -> List[Optional[str]]:
+        """
+        :param ids: node ids
+        :param versions: each node's current last_modified as stored in redis, None for missing nodes
+        :return: cached json of each node, or None where it isn't cached or is out of date
+        """
+        ret = []
+        with self.lock:
+            for _id, version in zip(ids, versions):
+                _id = int(_id)
+                entry = self.entries.get(_id)
+                if entry is None or version is None or entry[0] != version:
+                    ret.append(None)
+                    continue
+                self.entries.move_to_end(_id)
+                ret.append(entry[1])
+            hits = sum(1 for r in ret if r is not None)
+            self.hits += hits
+            self.misses += len(ret) - hits
+        return ret
+
+    def put(self, _id, version: str, fragment: str):
+        """
+        :param _id: node id
+        :param version: the node's last_modified from before its data was read
+        :param fragment: json of the node's data object
+        """
+        if len(fragment) > self.max_bytes:
+            return
+        _id = int(_id)
+        with self.lock:
+            if _id in self.entries:
+                self._remove(_id)
+            self.entries[_id] = (version, fragment)
+            self.size += len(fragment)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, _id):
+        """
+        :param _id: id of a node that was changed by this process
+        """
+        with self.lock:
+            if int(_id) in self.entries:
+                self._remove(int(_id))
+
+    def _remove(self, _id: int):
+        self.size -= len(self.entries.pop(_id)[1])
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with number of entries, their total size, hits, misses, and hit ratio
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "bytes": self.size,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": self.hits / total if total else 0.0}
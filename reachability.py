@@ -0,0 +1,355 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, islice
+from typing import Dict, Set, List, Tuple, Iterable, Optional, Callable, Any
+import adjacency
+import database
+
+
+class ReachabilityIndex:
+    """
+    in-memory index for listing every ancestor or descendant of a node without walking the graph in redis.
+
+    the index is a spanning forest of the graph, mostly one tree under the root. every node is numbered in the
+    order a depth-first search from the root reaches it, so a node's subtree is one interval of numbers:
+    [pre[node], end[node]]. edges that aren't in the tree are kept in a list sorted by the number of their parent.
+    a node's descendants are its subtree's interval, plus the intervals of the children of non-tree edges leaving
+    any interval found so far. ancestors are found the other way around, following tree parents and non-tree
+    edges into the nodes found so far. the work depends on the number of non-tree edges involved, not on the size
+    of the result.
+
+    changes come in through the graph change channel, like in adjacency.AdjacencyCache. added edges become non-tree
+    edges, and new nodes get a one-node interval at the end of the numbering. removing a tree edge moves the child's
+    subtree to the end of the numbering as a tree of its own, leaving a hole where it was. once too many edges have
+    been added or too many holes left, the index is built again on a background thread while the old one keeps
+    answering queries. only a missed change, like after reconnecting, or a change to the whole graph, like
+    GraphManager.import_ndjson, marks the index stale, so that it's built again from every node's edges on the next
+    query.
+    """
+    MIN_REBUILD_EDGES = 1000  # edges added or holes left since the last build before it's built again
+
+    def __init__(self, db: database.Database, adjacency_sets: Callable[[Iterable], Iterable[Tuple[int, Set, Set]]],
+                 nodes: Callable[[], Iterable], version_key: str, channel: str):
+        """
+        :param db: database to read the graph version from and listen for changes on
+        :param adjacency_sets: function that returns (id, parents, children) for each of the ids it's given, see
+         GraphManager.adjacency_sets
+        :param nodes: function that returns every node id, in increasing order
+        :param version_key: key of the graph version counter. it's incremented by every published change.
+        :param channel: channel that the graph changes are published to
+        """
+        self.db = db
+        self.adjacency_sets = adjacency_sets
+        self.nodes = nodes
+        self.version_key = version_key
+        self.channel = channel
+
+        self.order = array("q")  # node ids in depth-first order. -1 for holes left by moved subtrees
+        self.pre = array("q")  # pre[id] is the node's position in order, -1 if it isn't in the index
+        self.end = array("q")  # end[id] is the position of the last node in the node's subtree
+        self.tree_parent = array("q")  # the node's parent in the spanning forest, -1 for roots of the forest
+        self.extra_out: List[Tuple[int, int]] = []  # non-tree edges as (pre[parent], child), sorted
+        self.extra_in: Dict[int, Set[int]] = {}  # child -> parents, for non-tree edges
+        self.added_edges = 0  # edges added since the last build
+        self.indexed = 0  # number of nodes in the index. the rest of order is holes
+        self.version: Optional[int] = None  # graph version that the index is up to date with
+        self.stale = True
+
+        self.lock = threading.RLock()
+        self.started = False
+        self.subscribed = threading.Event()
+        self.builds = 0
+        # (message, from_channel) of messages applied while rebuilding in the background, or None
+        self.pending: Optional[List[Tuple[str, bool]]] = None
+
+    def _start(self):
+        # the listener is only started on first use, so processes that never ask for ancestors or descendants don't
+        # keep a connection subscribed
+        if self.started:
+            return
+        self.started = True
+        threading.Thread(target=self._listen, daemon=True, name="ReachabilityIndexListener").start()
+        self.subscribed.wait()
+
+    def _listen(self):
+        for msg in self.db.subscribe(self.channel):
+            if msg is None:
+                if self.subscribed.is_set():
+                    with self.lock:
+                        self.stale = True  # reconnected, so some changes may have been missed
+                self.subscribed.set()
+            else:
+                self.apply(msg, from_channel=True)
+
+    def _build(self):
+        # has to be called with the lock held
+        self._install(self._load())
+
+    def _load(self) -> Tuple:
+        # reads every node's edges and numbers them, without changing the index. anything published after the
+        # returned version is applied after the build. replaying changes is fine, see apply
+        version = int(self.db.get_val(self.version_key) or 0)
+        loaded = [(_id, sorted(c)) for _id, _, c in self.adjacency_sets(self.nodes())]
+        n = int(loaded[-1][0]) + 1 if loaded else 0
+        children = [[] for _ in range(n)]  # removed nodes have no edges, so each one is a tree of its own
+        for _id, c in loaded:
+            children[int(_id)] = c
+
+        order = array("q")
+        pre = array("q", [-1]) * n
+        end = array("q", [-1]) * n
+        tree_parent = array("q", [-1]) * n
+        extra = []
+        # the root first, so the forest is one tree as long as every node can be reached from the root
+        for root in chain([0], range(n)):
+            if root >= n or pre[root] != -1:
+                continue
+            pre[root] = len(order)
+            order.append(root)
+            stack = [(root, iter(children[root]))]
+            while stack:
+                u, it = stack[-1]
+                for c in it:
+                    if c == u or c >= n:
+                        continue  # the root's edge to itself, and nodes added while loading
+                    if pre[c] == -1:
+                        tree_parent[c] = u
+                        pre[c] = len(order)
+                        order.append(c)
+                        stack.append((c, iter(children[c])))
+                        break
+                    extra.append((u, c))
+                else:
+                    end[u] = len(order) - 1
+                    stack.pop()
+
+        extra_in = {}
+        for u, c in extra:
+            extra_in.setdefault(c, set()).add(u)
+        return order, pre, end, tree_parent, sorted((pre[u], c) for u, c in extra), extra_in, version
+
+    def _install(self, loaded: Tuple):
+        # has to be called with the lock held
+        self.order, self.pre, self.end, self.tree_parent, self.extra_out, self.extra_in, self.version = loaded
+        self.added_edges = 0
+        self.indexed = len(self.order)
+        self.stale = False
+        self.builds += 1
+
+    def _start_rebuild(self):
+        # has to be called with the lock held. queries use the current index until the new one is ready
+        if self.pending is not None:
+            return
+        self.pending = []
+        threading.Thread(target=self._rebuild, args=(self.builds,), daemon=True,
+                         name="ReachabilityIndexRebuild").start()
+
+    def _rebuild(self, builds: int):
+        try:
+            loaded = self._load()
+        except Exception as e:
+            print(f"ReachabilityIndex._rebuild(): failed, the index will be built on the next query: {str(e)}")
+            loaded = None
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if loaded is None:
+                self.stale = True
+            elif not self.stale and self.builds == builds:
+                # otherwise the index has been built again since, or will be
+                self._install(loaded)
+                for message, from_channel in pending:
+                    self.apply(message, from_channel)
+
+    def _detach(self, _id: int):
+        # moves the node's subtree to the end of the numbering as a tree of its own. the nodes it was in the
+        # intervals of can't reach it through the tree anymore, only through non-tree edges
+        s, e = self.pre[_id], self.end[_id]
+        shift = len(self.order) - s
+        moved = self.order[s:e + 1]
+        self.order.extend(moved)
+        self.order[s:e + 1] = array("q", [-1]) * len(moved)
+        for v in moved:
+            if v != -1:
+                self.pre[v] += shift
+                self.end[v] += shift
+        # non-tree edges from inside the subtree have the biggest numbers now, so they go at the end
+        lo = bisect_left(self.extra_out, (s, -1))
+        hi = bisect_left(self.extra_out, (e + 1, -1))
+        self.extra_out += [(p + shift, c) for p, c in self.extra_out[lo:hi]]
+        del self.extra_out[lo:hi]
+        self.tree_parent[_id] = -1
+
+    def _ensure_node(self, _id: int):
+        # gives a node that isn't in the index yet a one-node interval at the end of the numbering
+        if _id >= len(self.pre):
+            extend = array("q", [-1]) * (_id + 1 - len(self.pre))
+            self.pre += extend
+            self.end += extend
+            self.tree_parent += extend
+        if self.pre[_id] == -1:
+            self.pre[_id] = self.end[_id] = len(self.order)
+            self.order.append(_id)
+            self.indexed += 1
+
+    def rebuild_edges(self) -> int:
+        """
+        :return: number of edges that can be added, or holes left, before the index is built again. added edges
+         become non-tree edges and holes take up space in the numbering, which make queries slower, but most edges
+         are tree edges and there are no holes after a build.
+        """
+        return max(ReachabilityIndex.MIN_REBUILD_EDGES, self.indexed // 10)
+
+    def apply(self, message: str, from_channel: bool = False):
+        """
+        applies a change message to the index, like adjacency.AdjacencyCache.apply
+
+        :param message: change message, see adjacency.parse_changes
+        :param from_channel: True if the message came from the change channel. False if it's the return value of
+         this process's own script call, which can arrive before earlier messages from other processes.
+        """
+        version, changes = adjacency.parse_changes(message)
+        with self.lock:
+            if self.pending is not None:
+                # applied again to the index that's being built, see _rebuild
+                self.pending.append((message, from_channel))
+            if self.stale or version <= self.version:
+                return  # already applied, or the index will be built again anyway
+            if version > self.version + 1 and not from_channel:
+                # earlier changes from other processes are still on the way. the channel delivers every change in
+                # order, so this one is applied when it arrives there
+                return
+            if changes is None or version > self.version + 1:
+                # everything changed, or a message was missed. the next query builds the index again
+                self.stale = True
+                return
+            for added, parent, child in changes:
+                if parent == child:
+                    continue
+                self._ensure_node(parent)
+                self._ensure_node(child)
+                tree_edge = self.tree_parent[child] == parent
+                extra = parent in self.extra_in.get(child, ())
+                if added and not tree_edge and not extra:
+                    self.extra_in.setdefault(child, set()).add(parent)
+                    self.extra_out.insert(bisect_left(self.extra_out, (self.pre[parent], child)),
+                                          (self.pre[parent], child))
+                    self.added_edges += 1
+                elif not added and extra:
+                    self.extra_in[child].discard(parent)
+                    del self.extra_out[bisect_left(self.extra_out, (self.pre[parent], child))]
+                elif not added and tree_edge:
+                    self._detach(child)
+            self.version = version
+            if self.added_edges > self.rebuild_edges() or len(self.order) - self.indexed > self.rebuild_edges():
+                self._start_rebuild()
+
+    def _ready(self):
+        # has to be called with the lock held
+        self._start()
+        if self.stale:
+            self._build()
+
+    def _descendant_intervals(self, _id: int) -> Iterable[Tuple[int, int]]:
+        # yields (start, end) of each interval of descendants as it's found, so callers can stop early. intervals in
+        # a depth-first numbering are either nested or disjoint, so a node that's already covered has its whole
+        # subtree covered too. a new interval can cover earlier ones though.
+        starts = []
+        ends = []
+        work = [_id]
+        while work:
+            v = work.pop()
+            s, e = self.pre[v], self.end[v]
+            i = bisect_right(starts, s) - 1
+            if i >= 0 and ends[i] >= s:
+                continue
+            # intervals inside this one are replaced by it
+            j = bisect_left(starts, s)
+            k = bisect_right(starts, e)
+            starts[j:k] = [s]
+            ends[j:k] = [e]
+            lo = bisect_left(self.extra_out, (s, -1))
+            hi = bisect_left(self.extra_out, (e + 1, -1))
+            work += [c for _, c in self.extra_out[lo:hi]]
+            yield s, e
+
+    def descendants(self, _id: int, count: int) -> Tuple[List[int], bool]:
+        """
+        :param _id: node id
+        :param count: max number of ids to return
+        :return: (ids, truncated). ids of nodes that can be reached from _id by following edges to children, in
+         the order they're found. truncated is True if there are more than count of them.
+        """
+        _id = int(_id)
+        with self.lock:
+            self._ready()
+            if _id >= len(self.pre) or self.pre[_id] == -1:
+                return [], False
+            found = {_id: None}  # dict instead of set to keep nodes in the order they're found
+            for s, e in self._descendant_intervals(_id):
+                for n in self.order[s:e + 1]:
+                    if n == -1:
+                        continue  # hole
+                    found[n] = None
+                    if len(found) > count + 1:
+                        break
+                else:
+                    continue
+                break
+            ret = list(islice(found, 1, None))
+        return ret[:count], len(ret) > count
+
+    def ancestors(self, _id: int, count: int) -> Tuple[List[int], bool]:
+        """
+        :param _id: node id
+        :param count: max number of ids to return
+        :return: (ids, truncated). ids of nodes that _id can be reached from, closest tree ancestors first.
+         truncated is True if there are more than count of them.
+        """
+        _id = int(_id)
+        with self.lock:
+            self._ready()
+            if _id >= len(self.pre) or self.pre[_id] == -1:
+                return [], False
+            found = {}  # dict instead of set to keep nodes in the order they're found
+            work = [_id]
+            while work:
+                v = work.pop()
+                # up the tree until reaching a node whose ancestors have already been found
+                while v != -1 and v not in found and len(found) <= count + 1:
+                    found[v] = None
+                    work += [p for p in self.extra_in.get(v, ()) if p not in found]
+                    v = self.tree_parent[v]
+            ret = list(islice(found, 1, None))
+        return ret[:count], len(ret) > count
+
+    def reaches(self, ancestor: int, descendant: int) -> bool:
+        """
+        :return: True if descendant can be reached from ancestor by following edges to children. False if they're
+         the same node.
+        """
+        ancestor, descendant = int(ancestor), int(descendant)
+        if ancestor == descendant:
+            return False
+        with self.lock:
+            self._ready()
+            if max(ancestor, descendant) >= len(self.pre) or -1 in (self.pre[ancestor], self.pre[descendant]):
+                return False
+            if self.pre[ancestor] <= self.pre[descendant] <= self.end[ancestor]:
+                return True
+            return any(s <= self.pre[descendant] <= e for s, e in self._descendant_intervals(ancestor))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with number of indexed nodes, number of holes, number of non-tree edges, number of builds,
+         graph version, whether it's being built again in the background, and whether it will be built again on
+         the next query
+        """
+        with self.lock:
+            return {"nodes": self.indexed,
+                    "holes": len(self.order) - self.indexed,
+                    "extra_edges": len(self.extra_out),
+                    "builds": self.builds,
+                    "version": self.version,
+                    "rebuilding": self.pending is not None,
+                    "stale": self.stale}
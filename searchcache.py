@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Hashable
+
+
+class SearchCache:
+    """
+    LRU cache of serialized search responses. entries expire after ttl seconds, and the whole cache is cleared
+    when the search index generation changes, which happens whenever a write changes the search index.
+    """
+    MAX_ENTRIES = 1000
+    MAX_BYTES = 8 * 1024 * 1024  # counts the length of the cached strings, not python's overhead
+    TTL = 10.0  # seconds. limits how stale results can get while index changes are still on their way to solr
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, ttl: float = TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.entries: OrderedDict[Hashable, tuple] = OrderedDict()  # key -> (expiry time, response), oldest first
+        self.size = 0  # total length of cached responses
+        self.generation: Optional[int] = None  # index generation that the cached responses are from
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0  # total time spent answering hits
+        self.miss_seconds = 0.0  # total time spent answering misses, including the search itself
+
+    def get(self, key: Hashable, generation: int) -> Optional[str]:
+        """
+        :param key: search parameters
+        :param generation: current search index generation
+        :return: cached response, or None if it isn't cached or is out of date
+        """
+        with self.lock:
+            if generation != self.generation:
+                self._clear(generation)
+                return None
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, generation: int, response: str):
+        """
+        :param key: search parameters
+        :param generation: search index generation from before the search was done
+        :param response: serialized search response
+        """
+        if len(response) > self.max_bytes:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return  # the index changed during the search, or a newer generation already cleared the cache
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, response)
+            self.size += len(response)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def record(self, hit: bool, seconds: float):
+        """
+        :param hit: whether the response came from the cache
+        :param seconds: time it took to answer the search
+        """
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.misses += 1
+                self.miss_seconds += seconds
+
+    def _remove(self, key: Hashable):
+        self.size -= len(self.entries.pop(key)[1])
+
+    def _clear(self, generation: int):
+        self.entries.clear()
+        self.size = 0
+        self.generation = generation
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with number of entries, their total size, hits, misses, hit ratio, and average hit and miss
+         latency in milliseconds
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "bytes": self.size,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": self.hits / total if total else 0.0,
+                    "avg_hit_ms": 1000 * self.hit_seconds / self.hits if self.hits else 0.0,
+                    "avg_miss_ms": 1000 * self.miss_seconds / self.misses if self.misses else 0.0}
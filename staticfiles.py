@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Set
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # brotli compression is optional
+
+
+def accepted_encodings(header: Optional[str]) -> Set[str]:
+    """
+    :param header: value of an Accept-Encoding request header
+    :return: set of content codings that the client accepts, lowercase. codings with q=0 or with a q value that
+     isn't a number are left out.
+    """
+    ret = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        q = params.strip().lower()
+        weight = 1.0
+        if q.startswith("q="):
+            try:
+                weight = float(q[2:] or 0)
+            except ValueError:
+                weight = 0.0  # malformed, so the coding isn't used
+        if coding and weight > 0:
+            ret.add(coding)
+    return ret
+
+
+def etag_matches(header: Optional[str], etags: Set[str]) -> bool:
+    """
+    :param header: value of an If-None-Match request header
+    :param etags: etags that the current version of the resource has
+    :return: True if the header matches one of etags, meaning the client's copy is up to date
+    """
+    if not header:
+        return False
+    tags = {t.strip() for t in header.split(",")}
+    # If-None-Match uses weak comparison
+    return "*" in tags or bool({t[2:] if t.startswith("W/") else t for t in tags} & etags)
+
+
+class StaticFile:
+    """
+    a static file, loaded into memory along with compressed copies of it
+    """
+
+    def __init__(self, path: str, content_type: str):
+        """
+        :param path: path of the file
+        :param content_type: value of the Content-type header when it's sent
+        """
+        self.path = path
+        self.content_type = content_type
+        self.mtime = os.stat(path).st_mtime
+
+        with open(path, "rb") as file:
+            data = file.read()
+        tag = hashlib.sha256(data).hexdigest()[:32]
+
+        # content coding -> (body, etag). each coding has its own etag, since etags are strong
+        self.variants: Dict[str, tuple] = {"identity": (data, f'"{tag}"')}
+        if not content_type.startswith("image/"):  # images are already compressed
+            self.variants["gzip"] = (gzip.compress(data, 9, mtime=0), f'"{tag}-gzip"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(data), f'"{tag}-br"')
+
+    @property
+    def etags(self) -> Set[str]:
+        return {v[1] for v in self.variants.values()}
+
+    def choose(self, accept_encoding: Optional[str]) -> str:
+        """
+        :param accept_encoding: value of the request's Accept-Encoding header
+        :return: content coding to send, the smallest one that the client accepts
+        """
+        accepted = accepted_encodings(accept_encoding)
+        ret = "identity"
+        for coding in ["gzip", "br"]:
+            if coding in self.variants and coding in accepted \
+                    and len(self.variants[coding][0]) < len(self.variants[ret][0]):
+                ret = coding
+        return ret
+
+
+class StaticFiles:
+    """
+    the web app's files. they're loaded once and served from memory, precompressed, with etags so that browsers
+    can revalidate their cached copies without downloading them again.
+    """
+    FILES = ["page.html", "main.js", "httprequests.js", "styles.css", "favicon.ico"]
+    CONTENT_TYPES = {
+        "html": "text/html",
+        "js": "text/javascript",
+        "css": "text/css",
+        "ico": "image/x-icon",
+    }
+    CACHE_CONTROL = "no-cache"  # browsers can keep the files, but have to check the etag before using them
+
+    def __init__(self, directory: str = "_web", reload: bool = False):
+        """
+        :param directory: directory with the web app's files
+        :param reload: if True, checks each file's modification time when it's requested and loads it again if it
+         changed. for development.
+        """
+        self.directory = directory
+        self.reload = reload
+        self.files: Dict[str, StaticFile] = {}
+        self.lock = threading.Lock()
+        for name in StaticFiles.FILES:
+            self._load(name)
+
+    def _load(self, name: str):
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            self.files.pop(name, None)
+            return
+        self.files[name] = StaticFile(path, StaticFiles.CONTENT_TYPES[name.split(".")[-1]])
+
+    def get(self, name: str) -> Optional[StaticFile]:
+        """
+        :param name: file name
+        :return: the file, or None if it isn't one of the web app's files or doesn't exist
+        """
+        if name not in StaticFiles.FILES:
+            return None
+        if self.reload:
+            with self.lock:
+                f = self.files.get(name)
+                path = os.path.join(self.directory, name)
+                if not os.path.isfile(path) or f is None or os.stat(path).st_mtime != f.mtime:
+                    self._load(name)
+        return self.files.get(name)
@@ -0,0 +1,127 @@
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from typing import Dict, List, Any, Iterable, Tuple
+
+
+class SuggestIndex:
+    """
+    in-memory prefix index over node titles, for autocomplete without asking solr.
+
+    every title is indexed under its lowercase text and under each of its words, so "Linear Algebra" is found by
+    "lin" and by "alg". the keys are kept in a sorted list, so a prefix lookup is a binary search followed by a scan
+    of the matching keys.
+
+    only changes made through this process's GraphManager are seen. titles changed by other processes show up after
+    a restart.
+    """
+    MAX_WORDS = 8  # words of a title that are indexed, after the whole title
+    MAX_KEY_LENGTH = 64  # keys and prefixes are cut to this many characters
+
+    def __init__(self):
+        self.keys: List[str] = []  # sorted
+        self.ids = array("q")  # ids[i] is the node that keys[i] belongs to. an array takes 8 bytes per id
+        self.titles: Dict[int, str] = {}
+        self.key_bytes = 0  # memory used by the key and title strings
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def index_keys(title: str) -> List[str]:
+        """
+        :return: keys that a node with this title is found under, without duplicates
+        """
+        text = title.lower().strip()
+        keys = [text]
+        for m in islice(re.finditer(r"\w+", text), SuggestIndex.MAX_WORDS):
+            if m.start() > 0:
+                keys.append(text[m.start():])
+        return list(dict.fromkeys(k[:SuggestIndex.MAX_KEY_LENGTH] for k in keys if k))
+
+    def build(self, titles: Iterable[Tuple[int, str]]):
+        """
+        replaces the index's contents. sorts once at the end, which is much faster than adding titles one by one.
+
+        :param titles: (id, title) pairs
+        """
+        entries = []
+        new_titles = {}
+        for _id, title in titles:
+            if title is None:
+                continue  # missing node
+            new_titles[int(_id)] = title
+            entries += [(k, int(_id)) for k in SuggestIndex.index_keys(title)]
+        entries.sort()
+        with self.lock:
+            self.keys = [k for k, _ in entries]
+            self.ids = array("q", (i for _, i in entries))
+            self.titles = new_titles
+            self.key_bytes = sum(sys.getsizeof(k) for k in self.keys) + \
+                sum(sys.getsizeof(t) for t in self.titles.values())
+
+    def set_title(self, _id, title: str):
+        """
+        adds a node, or replaces the title of a node that's already in the index
+        """
+        _id = int(_id)
+        with self.lock:
+            self._remove(_id)
+            self.titles[_id] = title
+            self.key_bytes += sys.getsizeof(title)
+            for k in SuggestIndex.index_keys(title):
+                i = bisect_left(self.keys, k)
+                self.keys.insert(i, k)
+                self.ids.insert(i, _id)
+                self.key_bytes += sys.getsizeof(k)
+
+    def remove(self, _id):
+        """
+        removes a node from the index, if it's in it
+        """
+        with self.lock:
+            self._remove(int(_id))
+
+    def _remove(self, _id: int):
+        title = self.titles.pop(_id, None)
+        if title is None:
+            return
+        self.key_bytes -= sys.getsizeof(title)
+        for k in SuggestIndex.index_keys(title):
+            i = bisect_left(self.keys, k)
+            while i < len(self.keys) and self.keys[i] == k:
+                if self.ids[i] == _id:
+                    self.key_bytes -= sys.getsizeof(self.keys[i])
+                    del self.keys[i]
+                    del self.ids[i]
+                    break
+                i += 1
+
+    def suggest(self, prefix: str, count: int) -> List[Dict[str, Any]]:
+        """
+        :param prefix: start of a title or of one of its words. case doesn't matter.
+        :param count: max number of results
+        :return: list of dicts {"id": x, "title": y}, in alphabetical order of the matching text
+        """
+        prefix = prefix.lower().strip()[:SuggestIndex.MAX_KEY_LENGTH]
+        ret = []
+        seen = set()
+        with self.lock:
+            i = bisect_left(self.keys, prefix)
+            while i < len(self.keys) and len(ret) < count and self.keys[i].startswith(prefix):
+                _id = self.ids[i]
+                if _id not in seen:
+                    seen.add(_id)
+                    ret.append({"id": str(_id), "title": self.titles[_id]})
+                i += 1
+        return ret
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with number of nodes, number of keys, and approximate bytes of memory used
+        """
+        with self.lock:
+            size = sys.getsizeof(self.keys) + sys.getsizeof(self.ids) + sys.getsizeof(self.titles) + self.key_bytes
+            return {"nodes": len(self.titles), "keys": len(self.keys), "bytes": size}
+
@@ -0,0 +1,59 @@
+"""
+shared fixtures. the tests run against an in-process fake redis, like benchmark.py without --redis-url, so they need
+the fakeredis and lupa packages. benchmark.LocalSolr stands in for solr.
+
+run from the repository's root with:
+    py -m pytest tests
+"""
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs it for the lua scripts
+
+import benchmark
+import database
+from api import GraphAPI
+from graphmanager import GraphManager
+
+
+@pytest.fixture
+def make_db():
+    """
+    :return: function that makes a Database. every Database made by one test uses the same fake redis server, like
+     separate server processes using the same redis
+    """
+    server = fakeredis.FakeServer()
+    dbs = []
+
+    def make() -> database.Database:
+        db = database.Database(client=fakeredis.FakeRedis(server=server, decode_responses=True),
+                               solr=benchmark.LocalSolr())
+        dbs.append(db)
+        return db
+
+    yield make
+    for db in dbs:
+        db.close()
+
+
+@pytest.fixture
+def g(make_db) -> GraphManager:
+    return GraphManager(make_db())
+
+
+@pytest.fixture
+def api(g) -> GraphAPI:
+    """
+    :return: GraphAPI for g, serving on a free port until the test ends
+    """
+    api = GraphAPI(g, port=0)
+    thread = threading.Thread(target=api.start_server, daemon=True)
+    thread.start()
+    yield api
+    api.stop_server()
+    thread.join()
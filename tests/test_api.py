@@ -0,0 +1,81 @@
+import gzip
+import http.client
+import json
+import threading
+from api import GraphAPI
+
+
+def request(conn: http.client.HTTPConnection, path: str, headers: dict = None):
+    """
+    :return: (response, body). the body is read, so conn can be used for the next request
+    """
+    conn.request("GET", path, headers=headers or {})
+    res = conn.getresponse()
+    return res, res.read()
+
+
+def test_etag(api):
+    a = api.g.add_node("concept", "a", "", "", 0)
+    conn = http.client.HTTPConnection("localhost", api.server.server_port)
+    res, body = request(conn, f"/get-node?id={a}")
+    assert res.status == 200
+    etag = res.getheader("ETag")
+    assert etag
+    res, body = request(conn, f"/get-node?id={a}", {"If-None-Match": etag})
+    assert res.status == 304 and body == b""
+    assert res.getheader("ETag") == etag
+
+    api.g.set_node_attr(a, "title", "b")
+    res, body = request(conn, f"/get-node?id={a}", {"If-None-Match": etag})
+    assert res.status == 200
+    assert res.getheader("ETag") != etag
+    assert json.loads(body)[0]["title"] == "b"
+
+
+def test_gzip(api):
+    for i in range(50):
+        api.g.add_node("concept", f"node number {i}", "some content " * 5, "", 0)
+    conn = http.client.HTTPConnection("localhost", api.server.server_port)
+    res, plain = request(conn, "/get-graph")
+    assert res.status == 200 and res.getheader("Content-Encoding") is None
+    res, body = request(conn, "/get-graph", {"Accept-Encoding": "gzip"})
+    assert res.status == 200 and res.getheader("Content-Encoding") == "gzip"
+    assert res.getheader("Vary") == "Accept-Encoding"
+    assert len(body) < len(plain)
+    assert json.loads(gzip.decompress(body)) == json.loads(plain)
+
+    # small responses aren't worth compressing
+    res, body = request(conn, "/get-node?id=0", {"Accept-Encoding": "gzip"})
+    assert res.status == 200 and res.getheader("Content-Encoding") is None
+
+
+def test_keep_alive(api):
+    conn = http.client.HTTPConnection("localhost", api.server.server_port)
+    request(conn, "/get-node?id=0")
+    sock = conn.sock
+    for _ in range(5):
+        res, body = request(conn, "/get-node?id=0")
+        assert res.status == 200 and json.loads(body)
+    assert conn.sock is sock  # the same connection was used for every request
+
+
+def test_idle_connections_dont_hold_workers(g):
+    api = GraphAPI(g, port=0, workers=2)
+    thread = threading.Thread(target=api.start_server, daemon=True)
+    thread.start()
+    try:
+        idle = []
+        for _ in range(4):
+            conn = http.client.HTTPConnection("localhost", api.server.server_port, timeout=5)
+            request(conn, "/get-node?id=0")
+            idle.append(conn)
+        # all workers would be busy if idle keep-alive connections held on to them
+        conn = http.client.HTTPConnection("localhost", api.server.server_port, timeout=5)
+        res, body = request(conn, "/get-node?id=0")
+        assert res.status == 200
+        for conn in idle:
+            res, body = request(conn, "/get-node?id=0")
+            assert res.status == 200
+    finally:
+        api.stop_server()
+        thread.join()
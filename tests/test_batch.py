@@ -0,0 +1,71 @@
+import http.client
+import json
+import pytest
+from api import GraphAPI
+from graphmanager import GraphManager
+
+
+def snapshot(g: GraphManager):
+    """
+    :return: everything a batch could change, to check that a failed batch changed nothing
+    """
+    ids = list(g.nodes)
+    return (g.next_id, ids, g.nodes_list(ids), sorted(map(tuple, g.edges_list(ids))),
+            g.db.get_val(GraphManager.GRAPH_VERSION_KEY))
+
+
+def test_batch(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    b = g.add_node("concept", "b", "", "", 0)
+    results = g.batch([{"op": "add", "type": "concept", "title": "c", "parent": a},
+                       {"op": "update", "id": "$0", "attr": "content", "val": "hello"},
+                       {"op": "link", "parent": b, "child": "$0", "two-way": "true"},
+                       {"op": "unlink", "parent": 0, "child": b}])
+    c = results[0]
+    assert results == [c, c, None, None]
+    assert g.nodes_list([c])[0]["content"] == "hello"
+    assert set(g.successors(a)) == {c}
+    assert c in g.successors(b) and b in g.successors(c)
+    assert b not in g.successors(0)
+
+
+@pytest.mark.parametrize("ops", [
+    [{"op": "add"}, {"op": "update", "id": 999, "attr": "title", "val": "x"}],
+    [{"op": "add"}, {"op": "update", "id": "$0", "attr": "nope", "val": "x"}],
+    [{"op": "add"}, {"op": "update", "id": "$0", "attr": "title", "val": None}],
+    [{"op": "add"}, {"op": "link", "parent": "$0", "child": 999}],
+    [{"op": "link", "parent": "$0", "child": 1}],
+    [{"op": "add"}, {"op": "frob"}],
+])
+def test_invalid_batch_changes_nothing(g, ops):
+    for i in range(3):
+        g.add_node("concept", f"n{i}", "", "", 0)
+    before = snapshot(g)
+    with pytest.raises((ValueError, TypeError)):
+        g.batch(ops)
+    assert snapshot(g) == before
+
+
+def test_batch_size_limit(g):
+    with pytest.raises(ValueError):
+        g.batch([{"op": "add"}] * (GraphManager.MAX_BATCH_SIZE + 1))
+    assert g.next_id == 1
+
+
+def test_batch_endpoint(api):
+    conn = http.client.HTTPConnection("localhost", api.server.server_port)
+    ops = [{"op": "add", "title": f"n{i}"} for i in range(GraphManager.MAX_LIST_SIZE + 50)]
+    conn.request("POST", "/batch", body=json.dumps(ops))
+    res = json.loads(conn.getresponse().read())
+    assert len(res["results"]) == len(ops)
+    assert [int(n["id"]) for n in res["nodes"]] == res["results"]
+
+
+def test_batch_endpoint_body_size(api, monkeypatch):
+    monkeypatch.setattr(GraphAPI, "MAX_BATCH_BODY_SIZE", 10)
+    conn = http.client.HTTPConnection("localhost", api.server.server_port)
+    conn.request("POST", "/batch", body=json.dumps([{"op": "add"}]))
+    res = conn.getresponse()
+    assert res.status == 400
+    res.read()
+    assert api.g.next_id == 1
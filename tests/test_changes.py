@@ -0,0 +1,91 @@
+import json
+import time
+from graphmanager import GraphManager
+
+
+def changes(g: GraphManager, since: str, count: int = GraphManager.MAX_CHANGES) -> dict:
+    return json.loads(g.changes_json(since, count))
+
+
+def test_since_start(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    b = g.add_node("concept", "b", "", "", a)
+    res = changes(g, "0")
+    assert not res["reset"] and not res["more"]
+    assert {int(n["id"]) for n in res["nodes"]} == {0, a, b}
+    assert [a, b] in res["added_edges"] and [0, a] in res["added_edges"]
+
+
+def test_since_next(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    since = changes(g, "0")["next"]
+    empty = changes(g, since)
+    assert empty == {"nodes": [], "removed_nodes": [], "added_edges": [], "removed_edges": [], "next": since,
+                     "more": False, "reset": False}
+
+    b = g.add_node("concept", "b", "", "", 0)
+    g.link_nodes(a, b)
+    g.unlink_nodes(a, b)
+    g.set_node_attr(a, "title", "renamed")
+    c = g.add_node("concept", "c", "", "", 0)
+    g.remove_node(c)
+    res = changes(g, since)
+    assert not res["reset"]
+    assert {int(n["id"]): n["title"] for n in res["nodes"]} == {a: "renamed", b: "b"}
+    assert res["removed_nodes"] == [c]
+    # an edge that was added and then removed is only listed as removed
+    assert [a, b] in res["removed_edges"] and [a, b] not in res["added_edges"]
+    assert [0, b] in res["added_edges"]
+    assert changes(g, res["next"])["nodes"] == []
+
+
+def test_more(g):
+    for i in range(5):
+        g.add_node("concept", f"n{i}", "", "", 0)
+    since = "0"
+    seen = set()
+    for _ in range(10):
+        res = changes(g, since, 2)
+        seen.update(int(n["id"]) for n in res["nodes"])
+        since = res["next"]
+        if not res["more"]:
+            break
+    assert seen == set(g.nodes)
+
+
+def test_since_timestamp(g):
+    g.add_node("concept", "a", "", "", 0)
+    time.sleep(0.01)
+    middle = time.time()
+    time.sleep(0.01)
+    b = g.add_node("concept", "b", "", "", 0)
+    res = changes(g, str(middle))
+    assert not res["reset"]
+    assert [int(n["id"]) for n in res["nodes"]] == [b]
+
+
+def test_reset_when_trimmed(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    since = changes(g, "0")["next"]
+    for i in range(5):
+        g.add_node("concept", f"n{i}", "", "", a)
+    g.db.db.xtrim(GraphManager.CHANGE_STREAM_KEY, maxlen=2, approximate=False)
+    latest = g.db.db.xrevrange(GraphManager.CHANGE_STREAM_KEY, count=1)[0][0]
+    for since in [since, "0"]:
+        res = changes(g, since)
+        assert res["reset"]
+        assert res["nodes"] == [] and res["next"] == latest
+    assert not changes(g, latest)["reset"]
+
+
+def test_reset_without_start_marker(g):
+    g.add_node("concept", "a", "", "", 0)
+    g.db.db.delete(GraphManager.CHANGE_STREAM_KEY)
+    b = g.add_node("concept", "b", "", "", 0)
+    res = changes(g, "0")
+    assert res["reset"]
+    assert [int(n["id"]) for n in changes(g, res["next"])["nodes"]] == []
+    c = g.add_node("concept", "c", "", "", b)
+    res = changes(g, res["next"])
+    assert [int(n["id"]) for n in res["nodes"]] == [c]
+    assert res["added_edges"] == [[b, c]]
@@ -0,0 +1,33 @@
+import json
+from graphmanager import GraphManager
+
+
+def test_shortest_path(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    b = g.add_node("concept", "b", "", "", a)
+    c = g.add_node("concept", "c", "", "", b)
+    d = g.add_node("concept", "d", "", "", 0)
+    g.link_nodes(d, c)
+    res = json.loads(g.path_json(0, c))
+    assert res["path"] == [0, d, c] and not res["truncated"]
+    assert [int(n["id"]) for n in res["nodes"]] == [0, d, c]
+    res = json.loads(g.path_json(c, 0))
+    assert res["path"] is None and not res["truncated"]
+
+
+def test_budget_within_a_level(g, monkeypatch):
+    monkeypatch.setattr(GraphManager, "PATH_CHUNK_SIZE", 5)
+    hub = g.add_node("concept", "hub", "", "", 0)
+    for i in range(20):
+        child = g.add_node("concept", f"c{i}", "", "", hub)
+        for j in range(20):
+            g.add_node("concept", f"c{i}.{j}", "", "", child)
+    target = g.add_node("concept", "target", "", "", 0)
+    for i in range(30):
+        g.link_nodes(g.add_node("concept", f"p{i}", "", "", 0), target)
+    # the search goes forward to hub's 20 children, backward to target's 30 parents, then forward again, where
+    # the budget runs out in the first chunk of children
+    commands, _ = g.db.redis_counter.snapshot()
+    res = json.loads(g.path_json(hub, target, max_visited=100))
+    assert res["path"] is None and res["truncated"]
+    assert g.db.redis_counter.snapshot()[0] - commands <= 2 + GraphManager.PATH_CHUNK_SIZE
@@ -0,0 +1,97 @@
+import random
+import time
+from graphmanager import GraphManager
+
+
+def bfs(g: GraphManager, _id: int, direction: str) -> set:
+    """
+    :return: ids reached from _id by following edges in direction, "parents" or "children", not including _id
+    """
+    found = {_id}
+    frontier = [_id]
+    while frontier:
+        next_frontier = []
+        for _, parents, children in g.adjacency_sets(frontier):
+            for m in (parents if direction == "parents" else children):
+                if m not in found:
+                    found.add(m)
+                    next_frontier.append(m)
+        frontier = next_frontier
+    found.discard(_id)
+    return found
+
+
+def wait_for_changes(g: GraphManager, seconds: float = 5.0):
+    """
+    waits until g's reachability index has the changes made by other GraphManagers, or will be built again on the
+    next query
+    """
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        stats = g.reachability_index.stats()
+        if stats["stale"] or stats["version"] == int(g.db.get_val(GraphManager.GRAPH_VERSION_KEY) or 0):
+            return
+        time.sleep(0.01)
+    raise AssertionError("reachability index didn't get the changes")
+
+
+def check(g: GraphManager, rng: random.Random):
+    live = list(g.nodes)
+    for _id in rng.sample(live, min(20, len(live))):
+        descendants, truncated = g.reachability_index.descendants(_id, 10 ** 9)
+        ancestors, _ = g.reachability_index.ancestors(_id, 10 ** 9)
+        expected_descendants = bfs(g, _id, "children")
+        assert not truncated
+        assert len(descendants) == len(set(descendants))
+        assert set(descendants) == expected_descendants
+        assert set(ancestors) == bfs(g, _id, "parents")
+        other = rng.choice(live)
+        assert g.is_ancestor(_id, other) == (other in expected_descendants and other != _id)
+
+
+def random_changes(g: GraphManager, rng: random.Random, steps: int):
+    for _ in range(steps):
+        live = list(g.nodes)
+        a, b = rng.choice(live), rng.choice(live)
+        r = rng.random()
+        if r < 0.4:
+            g.link_nodes(a, b, rng.random() < 0.1)
+        elif r < 0.6:
+            if b in g.successors(a) and not (a == 0 and b == 0):
+                g.unlink_nodes(a, b)
+        elif r < 0.75:
+            if b != 0:
+                g.remove_node(b)
+        else:
+            g.add_node("concept", "x", "", "", a)
+
+
+def test_matches_bfs(g):
+    rng = random.Random(1)
+    for i in range(1, 150):
+        g.add_node("concept", f"n{i}", "", "", rng.randrange(0, i))
+    check(g, rng)
+    for _ in range(15):
+        random_changes(g, rng, 10)
+        check(g, rng)
+
+
+def test_changes_from_other_process(make_db):
+    rng = random.Random(2)
+    g = GraphManager(make_db())
+    other = GraphManager(make_db())
+    for i in range(1, 100):
+        g.add_node("concept", f"n{i}", "", "", rng.randrange(0, i))
+    check(g, rng)
+    for _ in range(10):
+        random_changes(other, rng, 10)
+        wait_for_changes(g)
+        check(g, rng)
+
+
+def test_closure_json_count(g):
+    parent = 0
+    for i in range(5):
+        parent = g.add_node("concept", f"n{i}", "", "", parent)
+    assert '"truncated": true' in g.descendants_json(0, None, 3)
+    assert '"truncated": false' in g.ancestors_json(parent, None, 10)
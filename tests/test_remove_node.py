@@ -0,0 +1,57 @@
+import pytest
+import redis
+
+
+def test_remove_node(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    b = g.add_node("concept", "b", "", "", a)
+    c = g.add_node("concept", "c", "", "", a)
+    g.link_nodes(b, c)
+    assert g.remove_node(a)
+    assert list(g.nodes) == [0, b, c]
+    assert g.node_count() == 3
+    assert g.nodes_list([a]) == [{}]
+    assert a not in g.successors(0)
+    # b lost its only parent so it's linked to the root, c still has b
+    assert set(g.predecessors(b)) == {0}
+    assert set(g.predecessors(c)) == {b}
+    assert not g.remove_node(a)
+    with pytest.raises(ValueError):
+        g.remove_node(0)
+
+
+def test_id_reuse(g):
+    ids = [g.add_node("concept", f"n{i}", "", "", 0) for i in range(5)]
+    next_id = g.next_id
+    g.remove_node(ids[1])
+    g.remove_node(ids[3])
+    reused = {g.add_node("concept", "x", "", "", 0), g.add_node("concept", "y", "", "", 0)}
+    assert reused == {ids[1], ids[3]}
+    assert g.next_id == next_id
+    assert g.add_node("concept", "z", "", "", 0) == next_id
+    assert list(g.nodes) == [0] + ids + [next_id]
+    # a reused id is a new node, nothing is left of the removed one
+    node = g.nodes_list([ids[1]])[0]
+    assert node["title"] in ("x", "y")
+    assert set(g.predecessors(ids[1])) == {0}
+    assert not g.successors(ids[1])
+
+
+def test_removed_node_in_edit(g):
+    a = g.add_node("concept", "a", "", "", 0)
+    b = g.add_node("concept", "b", "", "", 0)
+    g.remove_node(a)
+    with pytest.raises(redis.ResponseError, match="does not exist"):
+        g.link_nodes(a, b)
+    with pytest.raises(redis.ResponseError, match="does not exist"):
+        g.unlink_nodes(a, b)
+    assert set(g.predecessors(b)) == {0}
+
+
+def test_search_index(g):
+    a = g.add_node("concept", "apple", "", "", 0)
+    g.db.flush_search_index(True)
+    assert str(a) in g.db.solr.docs
+    g.remove_node(a)
+    g.db.flush_search_index(True)
+    assert str(a) not in g.db.solr.docs
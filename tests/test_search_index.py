@@ -0,0 +1,59 @@
+import benchmark
+from database import SearchIndexQueue
+
+
+class FailingSolr(benchmark.LocalSolr):
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+
+    def add(self, docs, **kwargs):
+        if self.fail:
+            raise ConnectionError("solr is down")
+        return super().add(docs, **kwargs)
+
+
+def make_queue(solr, batch_size: int = 100) -> SearchIndexQueue:
+    return SearchIndexQueue(solr, batch_size, max_delay=60)
+
+
+def test_batches_changes():
+    solr = benchmark.LocalSolr()
+    queue = make_queue(solr)
+    queue.add({"id": 1, "title": "one", "content": ""})
+    queue.update(1, {"content": "changed"})
+    queue.add({"id": 2, "title": "two", "content": ""})
+    queue.add({"id": 3, "title": "three", "content": ""})
+    queue.delete(3)
+    queue.update(3, {"title": "gone"})  # the document is deleted, so this does nothing
+    assert solr.requests == 0  # nothing is sent before max_delay or batch_size
+    assert queue.stats()["depth"] == 3
+
+    assert queue.flush()
+    assert solr.docs["1"]["title"] == "one" and solr.docs["1"]["content"] == "changed"
+    assert "2" in solr.docs and "3" not in solr.docs
+    assert queue.stats()["depth"] == 0 and queue.stats()["sent"] == 3
+    queue.close()
+
+
+def test_batch_size():
+    solr = benchmark.LocalSolr()
+    queue = make_queue(solr, batch_size=10)
+    for i in range(25):
+        queue.add({"id": i, "title": f"n{i}"})
+    queue.close()  # sends whatever is left
+    assert len(solr.docs) == 25
+    assert queue.stats()["batches"] >= 3  # at most batch_size documents per request
+
+
+def test_failed_flush_is_retried():
+    solr = FailingSolr()
+    queue = make_queue(solr)
+    queue.add({"id": 1, "title": "one", "content": ""})
+    assert not queue.flush()
+    queue.update(1, {"content": "newer"})  # queued while solr was down, so it goes on top
+    solr.fail = False
+    assert queue.flush()
+    assert solr.docs["1"]["title"] == "one" and solr.docs["1"]["content"] == "newer"
+    assert queue.stats()["failures"] == 1
+    queue.close()